@@ -0,0 +1,381 @@
+"""Backfill of the metrics over a range of past slots.
+
+The watcher processes one slot at a time and waits for the beacon on
+each of them, which is the way to go at head but takes days to go
+over a month of history. Past slots don't have to wait for anything:
+the data of the next epochs is fetched concurrently while the slots
+are processed back-to-back, and the metrics of each slot are written
+to a file.
+
+What is fetched from the beacon can be kept in an archive directory,
+another backfill over the same slots (i.e: with different labels)
+then reads it from there instead. Entries are named after what was
+queried, so that they are not reused for another set of validators.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Optional, TextIO, TypeVar
+
+import typer
+
+from eth_validator_watcher_ext import EpochLiveness, EpochRewards, EpochValidators, MetricsByLabel
+
+from .beacon import Beacon
+from .blocks import process_block, process_finalized_block, process_future_blocks
+from .config import Config, ScopeEnum, load_config
+from .decoding import Decoder
+from .keys_index import watched_public_keys
+from .metrics import ValidatorMetricsCollector, WorkerPool, compute_validator_metrics
+from .models import ProposerDuties, Spec
+from .proposer_schedule import ProposerSchedule
+from .rewards import process_rewards
+from .utils import SLOT_FOR_MISSED_ATTESTATIONS_PROCESS, SLOT_FOR_REWARDS_PROCESS, available_cpus
+from .watched_validators import WatchedValidators
+
+T = TypeVar('T')
+
+# Number of epochs fetched ahead of the one being processed.
+PREFETCH_EPOCHS = 4
+
+
+@dataclass
+class EpochData:
+    """Beacon data needed to process the slots of an epoch.
+    """
+    # Validator set at the start of the epoch.
+    validators: EpochValidators
+    # Liveness of the previous epoch, of the active validators.
+    liveness: EpochLiveness
+    # Rewards of the epoch before the previous one.
+    rewards: EpochRewards
+    # Proposer duties of the epoch and of the next one.
+    duties: ProposerDuties
+    next_duties: ProposerDuties
+    # Whether each slot of the epoch has a block, None if it wasn't
+    # looked up.
+    blocks: list[Optional[bool]]
+
+
+def _query_digest(ids: Optional[Iterable]) -> str:
+    """Name the validators a query is about, the whole network if None."""
+    if ids is None:
+        return 'network'
+    h = hashlib.blake2b(digest_size=8)
+    h.update('\n'.join(map(str, ids)).encode())
+    return h.hexdigest()
+
+
+def _dump_blocks(blocks: list[Optional[bool]]) -> bytes:
+    return bytes(2 if b is None else int(b) for b in blocks)
+
+
+def _load_blocks(data: bytes) -> list[Optional[bool]]:
+    return [None if b == 2 else bool(b) for b in data]
+
+
+def _dump_columns(columns) -> bytes:
+    buf = bytearray(columns.nbytes())
+    columns.dump(buf)
+    return bytes(buf)
+
+
+class MetricsWriter:
+    """Writes the metrics of each slot as a line of JSON.
+
+    Samples are named as the watcher exports them. Only the samples
+    which changed since the previous slot are written, gauges mostly
+    change once per epoch.
+    """
+
+    def __init__(self, fh: TextIO, network: str, genesis_time: int, seconds_per_slot: int) -> None:
+        """MetricsWriter
+
+        Parameters:
+        fh              : File to write to
+        network         : Name of the network
+        genesis_time    : Genesis time of the chain
+        seconds_per_slot: Duration of a slot
+        """
+        self._fh = fh
+        self._network = network
+        self._genesis_time = genesis_time
+        self._seconds_per_slot = seconds_per_slot
+        self._collector = ValidatorMetricsCollector()
+        self._samples: dict[str, float] = {}
+
+    def write(self, slot: int, metrics: dict[str, MetricsByLabel]) -> None:
+        """Write the metrics of a slot.
+
+        Parameters:
+        slot   : Slot of the metrics
+        metrics: Metrics of the slot by scope
+        """
+        self._collector.update(self._network, metrics)
+
+        changed = dict()
+        for family in self._collector.collect():
+            for sample in family.samples:
+                if sample.name.endswith('_created'):
+                    continue
+                labels = ','.join(f'{k}="{v}"' for k, v in sorted(sample.labels.items()))
+                key = f'{sample.name}{{{labels}}}'
+                if self._samples.get(key) != sample.value:
+                    self._samples[key] = changed[key] = sample.value
+
+        self._fh.write(json.dumps({
+            'slot': slot,
+            'timestamp': self._genesis_time + slot * self._seconds_per_slot,
+            'samples': changed,
+        }) + '\n')
+
+
+class Backfill:
+    """Computes the metrics of the watched validators over past slots.
+
+    Slots are processed as the watcher does, except that they are all
+    final: blocks are accounted at head and finalized at once. With
+    block_lookup_scope: watched, only the slots of watched validators
+    are looked up, there is no head to learn the others from.
+    """
+
+    def __init__(self, cfg: Config, beacon: Beacon, spec: Spec, decoder: Decoder, pool: WorkerPool,
+                 archive: Optional[Path] = None, prefetch_epochs: int = PREFETCH_EPOCHS) -> None:
+        """Backfill
+
+        Parameters:
+        cfg            : Configuration of the watcher
+        beacon         : Beacon to fetch the data from
+        spec           : Specification of the chain
+        decoder        : Decoder of the large beacon responses
+        pool           : Worker pool used to compute the metrics
+        archive        : Directory where the beacon data is kept, if any
+        prefetch_epochs: Number of epochs fetched ahead
+        """
+        self._cfg = cfg
+        self._beacon = beacon
+        self._spec = spec
+        self._decoder = decoder
+        self._pool = pool
+        self._archive = archive
+        self._prefetch_epochs = max(prefetch_epochs, 1)
+
+        self._ids = None
+        if cfg.validators_scope == ScopeEnum.watched:
+            self._ids = watched_public_keys(cfg)
+
+        self._validators = WatchedValidators()
+        self._schedule = ProposerSchedule(spec)
+        self._validators_epoch = None
+        self._liveness_epoch = None
+        self._rewards_epoch = None
+
+        if archive is not None:
+            archive.mkdir(parents=True, exist_ok=True)
+
+    def run(self, start_slot: int, end_slot: int, writer: MetricsWriter) -> None:
+        """Process the slots from start_slot up to end_slot (excluded).
+
+        Parameters:
+        start_slot: First slot to process
+        end_slot  : Slot to stop at
+        writer    : Where to write the metrics of each slot
+        """
+        slots_per_epoch = self._spec.data.SLOTS_PER_EPOCH
+        first_epoch, last_epoch = start_slot // slots_per_epoch, (end_slot - 1) // slots_per_epoch
+
+        executor = ThreadPoolExecutor(max_workers=self._prefetch_epochs, thread_name_prefix='backfill')
+        try:
+            pending = deque()
+            next_epoch = first_epoch
+            for epoch in range(first_epoch, last_epoch + 1):
+                while next_epoch <= last_epoch and len(pending) < self._prefetch_epochs:
+                    pending.append(executor.submit(self._fetch_epoch, next_epoch))
+                    next_epoch += 1
+
+                data = pending.popleft().result()
+                logging.info(f'🔨 Processing slots of epoch {epoch}')
+                for slot in range(max(start_slot, epoch * slots_per_epoch), min(end_slot, (epoch + 1) * slots_per_epoch)):
+                    writer.write(slot, self._process_slot(slot, data))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _archived(self, name: str, fetch: Callable[[], T], encode: Callable[[T], bytes], decode: Callable[[bytes], T]) -> T:
+        """Read data from the archive, or fetch and archive it."""
+        if self._archive is None:
+            return fetch()
+
+        path = self._archive / name
+        if path.exists():
+            return decode(path.read_bytes())
+
+        value = fetch()
+        # Epochs are fetched concurrently, the same data may be
+        # written twice.
+        fd, tmp = tempfile.mkstemp(dir=self._archive, prefix=f'.{name}.')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(encode(value))
+        os.replace(tmp, path)
+        return value
+
+    def _fetch_blocks(self, epoch: int, slots: Optional[list[int]]) -> list[Optional[bool]]:
+        slots_per_epoch = self._spec.data.SLOTS_PER_EPOCH
+        lookups = [
+            self._beacon.submit(self._beacon.has_block_at_slot, slot) if slots is None or slot in slots else None
+            for slot in range(epoch * slots_per_epoch, (epoch + 1) * slots_per_epoch)
+        ]
+        return [lookup.result() if lookup is not None else None for lookup in lookups]
+
+    def _fetch_duties(self, epoch: int) -> ProposerDuties:
+        return self._archived(
+            f'duties-{epoch}', lambda: self._beacon.get_proposer_duties(epoch),
+            lambda duties: duties.model_dump_json().encode(), ProposerDuties.model_validate_json)
+
+    def _fetch_epoch(self, epoch: int) -> EpochData:
+        """Fetch the data of an epoch, from the archive if possible."""
+        slot = epoch * self._spec.data.SLOTS_PER_EPOCH
+
+        validators = self._archived(
+            f'validators-{epoch}-{_query_digest(self._ids)}',
+            lambda: self._decoder.validators(self._beacon, slot, self._ids),
+            _dump_columns, EpochValidators.load)
+
+        duties = self._fetch_duties(epoch)
+
+        # Scopes are resolved as the watcher does, over the labels the
+        # configuration gives to the validators of the epoch.
+        labelled = None
+        watched_blocks = self._cfg.block_lookup_scope == ScopeEnum.watched
+        if self._cfg.liveness_scope == ScopeEnum.watched or watched_blocks:
+            labelled = WatchedValidators()
+            labelled.process_epoch(validators)
+            labelled.process_config(self._cfg)
+
+        # The liveness is queried for the active validators in scope
+        # and the rewards for the fetched ones.
+        if labelled is not None:
+            liveness_indexes = labelled.get_liveness_indexes(self._cfg.liveness_scope)
+        else:
+            liveness_indexes = validators.indexes(True)
+        liveness = self._archived(
+            f'liveness-{epoch - 1}-{_query_digest(liveness_indexes)}',
+            lambda: self._decoder.liveness(self._beacon, epoch - 1, liveness_indexes),
+            _dump_columns, EpochLiveness.load)
+        rewards_indexes = validators.indexes() if self._ids is not None else None
+        rewards = self._archived(
+            f'rewards-{epoch - 2}-{_query_digest(rewards_indexes)}',
+            lambda: self._decoder.rewards(self._beacon, epoch - 2, rewards_indexes),
+            _dump_columns, EpochRewards.load)
+
+        block_slots = None
+        if watched_blocks:
+            block_slots = []
+            for duty in duties.data:
+                validator = labelled.get_validator_by_index(duty.validator_index)
+                if validator is not None and validator.watched:
+                    block_slots.append(duty.slot)
+        blocks = self._archived(
+            f'blocks-{epoch}-{_query_digest(block_slots)}', lambda: self._fetch_blocks(epoch, block_slots),
+            _dump_blocks, _load_blocks)
+
+        return EpochData(
+            validators=validators,
+            liveness=liveness,
+            rewards=rewards,
+            duties=duties,
+            next_duties=self._fetch_duties(epoch + 1),
+            blocks=blocks,
+        )
+
+    def _process_slot(self, slot: int, data: EpochData) -> dict[str, MetricsByLabel]:
+        """Process a slot, in the same order as the watcher does."""
+        slots_per_epoch = self._spec.data.SLOTS_PER_EPOCH
+        epoch = slot // slots_per_epoch
+        has_block = data.blocks[slot % slots_per_epoch]
+
+        if self._validators_epoch != epoch:
+            self._validators.process_epoch(data.validators)
+            if not self._validators.config_initialized or self._cfg.validators_scope == ScopeEnum.watched:
+                self._validators.process_config(self._cfg)
+            self._schedule.clear(slot, slot)
+            self._schedule.set_duties(epoch, data.duties, final=True)
+            self._schedule.set_duties(epoch + 1, data.next_duties, final=True)
+            self._validators_epoch = epoch
+
+        if self._liveness_epoch is None or (
+                self._liveness_epoch < epoch - 1 and slot % slots_per_epoch >= SLOT_FOR_MISSED_ATTESTATIONS_PROCESS):
+            self._validators.process_liveness(data.liveness)
+            self._liveness_epoch = epoch - 1
+
+        # The watcher only fetches rewards on slots with a block, slots
+        # which weren't looked up most likely have one.
+        if has_block is not False and (self._rewards_epoch is None or (
+                self._rewards_epoch < epoch - 2 and slot % slots_per_epoch >= SLOT_FOR_REWARDS_PROCESS)):
+            process_rewards(self._validators, data.rewards)
+            self._rewards_epoch = epoch - 2
+
+        if has_block is not None:
+            process_block(self._validators, self._schedule, slot, has_block)
+        process_future_blocks(self._validators, self._schedule, slot)
+        if has_block is not None:
+            process_finalized_block(self._validators, self._schedule, slot, has_block)
+
+        return compute_validator_metrics(self._validators, slot, self._pool)
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def handler(
+    output: Path = typer.Argument(
+        ...,
+        help="File to write the metrics of each slot to (JSON lines).",
+        dir_okay=False,
+    ),
+    start_slot: int = typer.Option(..., help="First slot to process."),
+    end_slot: int = typer.Option(..., help="Slot to stop at (excluded)."),
+    config: Optional[Path] = typer.Option(
+        'etc/config.local.yaml',
+        help="File containing the Ethereum Validator Watcher configuration file.",
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        show_default=True,
+    ),
+    archive: Optional[Path] = typer.Option(
+        None,
+        help="Directory where the beacon data is kept, for a single network.",
+        file_okay=False,
+    ),
+    prefetch_epochs: int = typer.Option(PREFETCH_EPOCHS, help="Number of epochs fetched ahead."),
+) -> None:
+    """Compute the metrics of the watched validators over past slots."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)-8s %(message)s'
+    )
+
+    if end_slot <= start_slot:
+        raise typer.BadParameter('The end slot must be after the start slot')
+
+    cfg = load_config(str(config))
+    beacon = Beacon(cfg.beacon_url, cfg.beacon_timeout_sec)
+    decoder = Decoder(cfg.decode_workers or 0)
+    try:
+        spec = beacon.get_spec()
+        genesis_time = beacon.get_genesis().data.genesis_time
+        backfill = Backfill(cfg, beacon, spec, decoder, WorkerPool(cfg.metrics_workers or available_cpus()), archive, prefetch_epochs)
+        with open(output, 'w') as fh:
+            backfill.run(start_slot, end_slot, MetricsWriter(fh, cfg.network, genesis_time, spec.data.SECONDS_PER_SLOT))
+    finally:
+        decoder.close()
+        beacon.close()
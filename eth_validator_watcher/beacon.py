@@ -1,13 +1,18 @@
 """Contains the Beacon class which is used to interact with the consensus layer node."""
 
 import functools
-from typing import Any, Union
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import batched
+from typing import Any, Callable, Iterator, Optional, TypeVar, Union
 
 from requests import HTTPError, Response, Session, codes
 from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import ChunkedEncodingError
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
 
+from eth_validator_watcher_ext import EpochLiveness, EpochValidators
+
 from .models import (
     BlockIdentierType,
     Genesis,
@@ -15,13 +20,32 @@ from .models import (
     ProposerDuties,
     Rewards,
     Spec,
+    ValidatorRecord,
     Validators,
     ValidatorsLivenessResponse,
 )
+from .columns import prepare_epoch
+from .streaming import CHUNK_SIZE, iter_json_array
 
 
 print = functools.partial(print, flush=True)
 
+# Maximum number of requests in flight to the beacon, this also bounds
+# the number of pooled connections.
+MAX_CONCURRENT_REQUESTS = 8
+
+# Maximum number of validator ids per query, beacons limit it.
+VALIDATORS_IDS_CHUNK_SIZE = 1000
+
+# Maximum number of validator indexes per liveness query, the response
+# of a single query for the whole network often times out.
+LIVENESS_CHUNK_SIZE = 20000
+
+# Number of epochs of proposer duties kept in cache.
+PROPOSER_DUTIES_CACHE_EPOCHS = 16
+
+T = TypeVar('T')
+
 
 class NoBlockError(Exception):
     pass
@@ -30,12 +54,13 @@ class NoBlockError(Exception):
 class Beacon:
     """Beacon node abstraction."""
 
-    def __init__(self, url: str, timeout_sec: int) -> None:
+    def __init__(self, url: str, timeout_sec: int, max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS) -> None:
         """Beacon
 
         Parameters:
-        url        : URL where the beacon can be reached
-        timeout_sec: timeout in seconds used to query the beacon
+        url                    : URL where the beacon can be reached
+        timeout_sec            : timeout in seconds used to query the beacon
+        max_concurrent_requests: maximum number of requests in flight
         """
         self._url = url
         self._timeout_sec = timeout_sec
@@ -43,8 +68,21 @@ class Beacon:
         self._http = Session()
         self._first_liveness_call = True
         self._first_rewards_call = True
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_requests, thread_name_prefix='beacon')
+
+        # Responses which don't change, or only along with a known
+        # dependent root.
+        self._cache_lock = threading.Lock()
+        self._genesis = None
+        self._spec = None
+        self._proposer_duties: dict[int, ProposerDuties] = {}
+
+        # Connections are kept alive and reused across requests, there
+        # is at most one per request in flight.
+        pool = dict(pool_connections=1, pool_maxsize=max_concurrent_requests, pool_block=True)
 
         adapter_retry_not_found = HTTPAdapter(
+            **pool,
             max_retries=Retry(
                 backoff_factor=0.5,
                 total=3,
@@ -57,6 +95,7 @@ class Beacon:
         )
 
         adapter = HTTPAdapter(
+            **pool,
             max_retries=Retry(
                 backoff_factor=0.5,
                 total=3,
@@ -100,6 +139,27 @@ class Beacon:
         """Wrapper around requests.get() with retry on 404"""
         return self._http_retry_not_found.post(*args, **kwargs)
 
+    def submit(self, fn: Callable[..., T], *args: Any) -> Future[T]:
+        """Run a call to the beacon in the background.
+
+        This allows to have independent requests in flight at the
+        same time, i.e: submit(beacon.get_header, 'finalized').
+
+        Parameters:
+        fn  : method of the beacon to call
+        args: arguments of the method
+
+        Returns:
+        A future holding the result of the call.
+        """
+        return self._executor.submit(fn, *args)
+
+    def close(self) -> None:
+        """Release the background workers and pooled connections."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._http.close()
+        self._http_retry_not_found.close()
+
     def get_url(self) -> str:
         """Return the URL of the beacon."""
         return self._url
@@ -109,24 +169,32 @@ class Beacon:
         return self._timeout_sec
 
     def get_genesis(self) -> Genesis:
-        """Get genesis data."""
+        """Get genesis data, it is only fetched once."""
+        if self._genesis is not None:
+            return self._genesis
+
         response = self._get_retry_not_found(
             f"{self._url}/eth/v1/beacon/genesis", timeout=self._timeout_sec
         )
 
         response.raise_for_status()
 
-        return Genesis.model_validate_json(response.text)
+        self._genesis = Genesis.model_validate_json(response.text)
+        return self._genesis
 
     def get_spec(self) -> Spec:
-        """Get spec data."""
+        """Get spec data, it is only fetched once."""
+        if self._spec is not None:
+            return self._spec
+
         response = self._get_retry_not_found(
             f"{self._url}/eth/v1/config/spec", timeout=self._timeout_sec
         )
 
         response.raise_for_status()
 
-        return Spec.model_validate_json(response.text)
+        self._spec = Spec.model_validate_json(response.text)
+        return self._spec
 
     def get_header(self, block_identifier: Union[BlockIdentierType, int]) -> Header:
         """Get a header.
@@ -152,34 +220,108 @@ class Beacon:
     def get_proposer_duties(self, epoch: int) -> ProposerDuties:
         """Get proposer duties
 
+        Duties are cached until invalidate_proposer_duties() reports
+        their dependent root changed, which is only known ahead of
+        finalization from the beacon events.
+
         epoch: Epoch corresponding to the proposer duties to retrieve
         """
+        with self._cache_lock:
+            duties = self._proposer_duties.get(epoch)
+        if duties is not None:
+            return duties
+
         response = self._get_retry_not_found(
             f"{self._url}/eth/v1/validator/duties/proposer/{epoch}", timeout=self._timeout_sec
         )
 
         response.raise_for_status()
 
-        return ProposerDuties.model_validate_json(response.text)
+        duties = ProposerDuties.model_validate_json(response.text)
+        with self._cache_lock:
+            self._proposer_duties[epoch] = duties
+            for cached in sorted(self._proposer_duties)[:-PROPOSER_DUTIES_CACHE_EPOCHS]:
+                del self._proposer_duties[cached]
+        return duties
 
-    def get_validators(self, slot: int) -> Validators:
-        response = self._get_retry_not_found(
-            f"{self._url}/eth/v1/beacon/states/{slot}/validators", timeout=self._timeout_sec
-        )
+    def invalidate_proposer_duties(self, epoch: int, dependent_root: Optional[str] = None) -> None:
+        """Drop the cached proposer duties of an epoch if outdated.
 
-        response.raise_for_status()
+        Parameters:
+        epoch         : Epoch of the proposer duties
+        dependent_root: Current dependent root of the duties, i.e: as
+                        announced by the head event of the beacon, if
+                        not set the duties are dropped regardless
+        """
+        with self._cache_lock:
+            duties = self._proposer_duties.get(epoch)
+            if duties is not None and (dependent_root is None or duties.dependent_root != dependent_root):
+                del self._proposer_duties[epoch]
+
+    def get_validators_columns(self, slot: int, ids: Optional[list[str]] = None) -> EpochValidators:
+        """Get the validators of the network as native columns.
 
-        return Validators.model_validate_json(response.text)
+        JSON is requested and decoded as it streams in: the beacon API
+        defines no SSZ encoding for this endpoint.
 
-    def get_rewards(self, epoch: int) -> Rewards:
+        Parameters:
+        slot : Slot corresponding to the beacon state to retrieve
+        ids  : Only retrieve those validators (indexes or public keys),
+               they are queried concurrently by chunks so this must
+               not be called from submit().
+        """
+        if ids is not None:
+            chunks = [
+                self.submit(self._get_validators_columns, slot, list(chunk))
+                for chunk in batched(ids, VALIDATORS_IDS_CHUNK_SIZE)
+            ]
+            validators = EpochValidators()
+            for chunk in chunks:
+                validators.extend(chunk.result())
+            return validators
+
+        return self._get_validators_columns(slot)
+
+    def _get_validators_columns(self, slot: int, ids: Optional[list[str]] = None) -> EpochValidators:
+        """Get validators as native columns, all or a chunk of them."""
+        url = f"{self._url}/eth/v1/beacon/states/{slot}/validators"
+        headers = {'Accept': 'application/json'}
+        if ids is None:
+            response = self._get_retry_not_found(url, headers=headers, timeout=self._timeout_sec, stream=True)
+        else:
+            response = self._post_retry_not_found(url, json={'ids': ids}, headers=headers, timeout=self._timeout_sec, stream=True)
+
+        with response:
+            response.raise_for_status()
+            return prepare_epoch(self._iter_validators_json(response))
+
+    def _iter_validators_json(self, response: Response) -> Iterator[ValidatorRecord]:
+        """Decode validators from a streamed JSON response."""
+        status_enum = Validators.DataItem.StatusEnum
+        for item in iter_json_array(response.iter_content(CHUNK_SIZE), 'data'):
+            validator = item['validator']
+            yield ValidatorRecord(
+                index=int(item['index']),
+                pubkey=validator['pubkey'],
+                effective_balance=int(validator['effective_balance']),
+                slashed=validator['slashed'],
+                status=status_enum(item['status']),
+            )
+
+    def get_rewards(self, epoch: int, indexes: Optional[list[int]] = None) -> Rewards:
         """Get rewards.
 
         Parameters:
-        epoch: Epoch corresponding to the rewards to retrieve.
+        epoch  : Epoch corresponding to the rewards to retrieve.
+        indexes: Only retrieve the rewards of those validators.
         """
+        # An empty list of validators means all of them to the beacon.
+        if indexes is not None and not indexes:
+            return Rewards(data=Rewards.Data(ideal_rewards=[], total_rewards=[]))
+
         response = self._post_retry_not_found(
             f"{self._url}/eth/v1/beacon/rewards/attestations/{epoch}",
-            json=([]),
+            json=[f"{i}" for i in indexes or []],
             timeout=self._timeout_sec,
         )
 
@@ -203,6 +345,42 @@ class Beacon:
 
         return ValidatorsLivenessResponse.model_validate_json(response.text)
 
+    def get_liveness_columns(self, epoch: int, indexes: list[int]) -> EpochLiveness:
+        """Get validators liveness as native columns.
+
+        Indexes are queried concurrently by chunks so this must not be
+        called from submit().
+
+        Parameters:
+        epoch  : Epoch corresponding to the validators liveness to retrieve
+        indexes: Indexes of the validators
+        """
+        chunks = [
+            self.submit(self._get_liveness_columns, epoch, list(chunk))
+            for chunk in batched(indexes, LIVENESS_CHUNK_SIZE)
+        ]
+        liveness = EpochLiveness()
+        for chunk in chunks:
+            liveness.extend(chunk.result())
+        return liveness
+
+    def _get_liveness_columns(self, epoch: int, indexes: list[int]) -> EpochLiveness:
+        """Get the liveness of a chunk of validators as native columns."""
+        response = self._post_retry_not_found(
+            f"{self._url}/eth/v1/validator/liveness/{epoch}",
+            json=[f"{i}" for i in indexes],
+            timeout=self._timeout_sec,
+            stream=True,
+        )
+
+        with response:
+            response.raise_for_status()
+
+            liveness = EpochLiveness()
+            for item in iter_json_array(response.iter_content(CHUNK_SIZE), 'data'):
+                liveness.append(int(item['index']), item['is_live'] is True)
+            return liveness
+
     def has_block_at_slot(self, block_identifier: BlockIdentierType | int) -> bool:
         """Returns the slot of a block identifier if it exists.
 
@@ -1,8 +1,16 @@
 import functools
 
+from itertools import batched
+from typing import Optional
+
+from .beacon import Beacon
 from .proposer_schedule import ProposerSchedule
 from .watched_validators import WatchedValidators
 
+# Number of finalized slots looked up at once during catch-up, the
+# number of requests in flight is bounded by the beacon itself.
+FINALIZED_BATCH_SIZE = 128
+
 
 def process_block(validators: WatchedValidators, schedule: ProposerSchedule, slot_id: int, has_block: bool):
     validator_index = schedule.get_head_proposer(slot_id)
@@ -28,6 +36,42 @@ def process_finalized_block(validators: WatchedValidators, schedule: ProposerSch
     validator.process_block_finalized(slot_id, has_block)
 
 
+def process_finalized_blocks(beacon: Beacon, validators: WatchedValidators, schedule: ProposerSchedule, first_slot: int, last_slot: int, head_blocks: Optional[dict[int, bool]] = None):
+    """Process the finalized slots from first_slot up to last_slot (excluded).
+
+    Slots are looked up concurrently, slots for which we don't know a
+    proposer in the registry are skipped without querying the beacon.
+
+    If head_blocks is set, only the slots of watched validators are
+    looked up: for the others, what was seen at head (slot -> has
+    block) is used, and slots which weren't seen are skipped.
+    """
+    slots = []
+    for slot_id in range(first_slot, last_slot):
+        validator_index = schedule.get_finalized_proposer(slot_id)
+        if validator_index is None:
+            continue
+
+        validator = validators.get_validator_by_index(validator_index)
+        if validator is None:
+            continue
+
+        if head_blocks is None or validator.watched:
+            slots.append((slot_id, None))
+        elif slot_id in head_blocks:
+            slots.append((slot_id, head_blocks[slot_id]))
+
+    for batch in batched(slots, FINALIZED_BATCH_SIZE):
+        has_blocks = [
+            beacon.submit(beacon.has_block_at_slot, slot_id) if has_block is None else None
+            for slot_id, has_block in batch
+        ]
+        for (slot_id, has_block), lookup in zip(batch, has_blocks):
+            if lookup is not None:
+                has_block = lookup.result()
+            process_finalized_block(validators, schedule, slot_id, has_block)
+
+
 def process_future_blocks(validators: WatchedValidators, schedule: ProposerSchedule, slot_id: int):
     future_proposals = schedule.get_future_proposals(slot_id)
 
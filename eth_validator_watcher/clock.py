@@ -1,6 +1,10 @@
 import time
 import logging
 
+from typing import Optional
+
+from .events import BeaconEvents
+
 
 class BeaconClock:
     """Helper class to keep track of the beacon clock.
@@ -70,15 +74,20 @@ class BeaconClock:
         """
         return int((self.now() - self._lag_seconds - self._genesis) // self._slot_duration)
 
-    def maybe_wait_for_slot(self, slot: int) -> None:
+    def maybe_wait_for_slot(self, slot: int, events: Optional[BeaconEvents] = None) -> None:
         """Wait until the given slot is reached.
 
         In replay mode, this will fast-forward the clock to the given slot.
 
+        If beacon events are available, this returns as soon as the
+        block of the slot is announced instead of waiting for the lag.
+
         Args:
         -----
         slot: int
             Slot to wait for.
+        events: Optional[BeaconEvents]
+            Beacon event stream, if any.
         """
         if self._replay_start_at is not None:
             logging.info(f'⏰ Fast-forwarding to slot {slot}')
@@ -86,6 +95,16 @@ class BeaconClock:
             return
 
         target = self._genesis + slot * self._slot_duration + self._lag_seconds
+
+        if events is not None and events.connected():
+            start = self._genesis + slot * self._slot_duration
+            now = self.now()
+            if now < start:
+                time.sleep(start - now)
+            if events.wait_for_block(slot, target - self.now()):
+                logging.info(f'⏰ Block of slot {slot} announced by the beacon')
+                return
+
         now = self.now()
         if now < target:
             logging.info(f'⏰ Waiting {target - now:.2f} seconds for slot {slot}')
@@ -0,0 +1,79 @@
+"""Conversion of the beacon responses to native columns.
+
+Columns are what the registry ingests, they are built by the beacon
+client and the decoder workers without depending on the registry.
+"""
+
+from typing import Iterable, Optional
+
+from eth_validator_watcher_ext import EpochLiveness, EpochRewards, EpochValidators
+
+from .models import Rewards, ValidatorRecord, ValidatorsLivenessResponse
+
+
+def normalized_public_key(pubkey: str) -> str:
+    """Normalize a public key.
+
+    Parameters:
+        pubkey: Public key to normalize
+    """
+    if pubkey.startswith('0x'):
+        pubkey = pubkey[2:]
+    return pubkey.lower()
+
+
+def pubkey_bytes(pubkey: str) -> Optional[bytes]:
+    """Binary representation of a public key.
+
+    Parameters:
+        pubkey: Public key in hexadecimal form
+
+    Returns:
+        The 48 bytes of the public key or None if it can't be decoded.
+    """
+    try:
+        return bytes.fromhex(normalized_public_key(pubkey))
+    except ValueError:
+        return None
+
+
+def prepare_epoch(validators: Iterable[ValidatorRecord]) -> EpochValidators:
+    """Load the validator set of an epoch so it can be applied at once.
+
+    This doesn't touch the registry and can run in the background
+    while slots are being processed.
+
+    Parameters:
+        validators: Validator state for the epoch from the beaconchain,
+                    can be streamed.
+    """
+    epoch = EpochValidators()
+    append = epoch.append
+    for item in validators:
+        append(item.index, pubkey_bytes(item.pubkey), item.effective_balance, item.slashed, item.status)
+    return epoch
+
+
+def liveness_columns(liveness: ValidatorsLivenessResponse) -> EpochLiveness:
+    """Convert validators liveness to native columns.
+
+    Parameters:
+        liveness: Liveness data from the beacon chain
+    """
+    columns = EpochLiveness()
+    append = columns.append
+    for item in liveness.data:
+        append(item.index, item.is_live == True)
+    return columns
+
+
+def rewards_columns(rewards: Rewards) -> EpochRewards:
+    """Converts rewards to native columns.
+    """
+    columns = EpochRewards()
+    for ideal in rewards.data.ideal_rewards:
+        columns.append_ideal(ideal.effective_balance, ideal.source, ideal.target, ideal.head)
+    append = columns.append
+    for reward in rewards.data.total_rewards:
+        append(reward.validator_index, reward.source, reward.target, reward.head)
+    return columns
@@ -1,13 +1,22 @@
-from pydantic import BaseModel
+from enum import StrEnum
+from pydantic import BaseModel, Field, TypeAdapter
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Any, List, Optional
 
+import hashlib
 import logging
 import json
 import os
 import yaml
 
 
+class ScopeEnum(StrEnum):
+    """Set of validators an operation applies to.
+    """
+    network = 'network'
+    watched = 'watched'
+
+
 class WatchedKeyConfig(BaseModel):
     """Configuration of a watched key.
     """
@@ -24,8 +33,40 @@ class Config(BaseSettings):
     beacon_url: Optional[str] = None
     beacon_timeout_sec: Optional[int] = None
     metrics_port: Optional[int] = None
+    metrics_workers: Optional[int] = None
+    metrics_consistency_check: Optional[bool] = None
+
+    # Subscribe to the beacon event stream. Proposer duties changed by
+    # a reorg are only refetched ahead of finalization if set, until
+    # then blocks are accounted to the proposers seen before it.
+    beacon_events: Optional[bool] = None
+    decode_workers: Optional[int] = None
     watched_keys: Optional[List[WatchedKeyConfig]] = None
 
+    # Index compiled with eth-validator-watcher-compile-keys, the
+    # watched keys of the configuration are ignored when set.
+    watched_keys_index: Optional[str] = None
+
+    # Finalized blocks proposed by validators out of this scope are
+    # not looked up on the beacon, what was seen at head is used.
+    block_lookup_scope: Optional[ScopeEnum] = None
+
+    # Only the validators in this scope are fetched on each epoch,
+    # the whole network is refreshed every few epochs if set.
+    validators_scope: Optional[ScopeEnum] = None
+    network_validators_refresh_epochs: Optional[int] = None
+
+    # Liveness is only queried for active validators in this scope,
+    # missed attestations of the others are not reported if watched.
+    liveness_scope: Optional[ScopeEnum] = None
+
+    # State is written there every few epochs to resume from it on
+    # restart. A snapshot is only resumed from up to the epoch after
+    # the one it was taken in (the liveness of the previous epoch is
+    # needed), so it can't be written less often than every 2 epochs.
+    snapshot_path: Optional[str] = None
+    snapshot_interval_epochs: Optional[int] = Field(default=None, ge=1, le=2)
+
     slack_token: Optional[str] = None
     slack_channel: Optional[str] = None
 
@@ -33,6 +74,23 @@ class Config(BaseSettings):
     replay_end_at_ts: Optional[int] = None
 
 
+# Validator of the watched keys, which are validated apart from the
+# rest of the configuration.
+_watched_keys_adapter = TypeAdapter(List[WatchedKeyConfig])
+
+
+def watched_keys_digest(watched_keys: List[WatchedKeyConfig]) -> bytes:
+    """Returns a digest of the content of the watched keys.
+
+    Parameters:
+    watched_keys: watched keys of the configuration
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for key in watched_keys:
+        h.update(f'{key.public_key}\0{"\0".join(key.labels or [])}\n'.encode())
+    return h.digest()
+
+
 def _default_config() -> Config:
     """Returns the default configuration.
     """
@@ -67,6 +125,10 @@ def load_config(config_file: str) -> Config:
         else:
             config = yaml.load(fh, Loader=yaml.CLoader) or dict()
 
+        # The watched keys are most of the configuration, they are
+        # set aside so that they are validated once and never dumped.
+        watched_keys = config.pop('watched_keys', None)
+
         logging.info(f'⚙️ Validating configuration file')
         from_default = _default_config().model_dump()
         from_env = Config().model_dump()
@@ -80,6 +142,11 @@ def load_config(config_file: str) -> Config:
 
         r = Config(**merged)
 
+        # Environment variables have priority here too.
+        if not r.watched_keys and watched_keys:
+            logging.info(f'⚙️ Validating watched keys')
+            r.watched_keys = _watched_keys_adapter.validate_python(watched_keys)
+
         logging.info(f'⚙️ Configuration file is ready')
 
         return r
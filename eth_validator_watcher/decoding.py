@@ -0,0 +1,127 @@
+"""Decoding of the large beacon responses into native columns.
+
+The validator set, rewards and liveness responses are large: decoding
+them holds the GIL for seconds, during which the Prometheus exporter
+thread can't answer scrapes. They can be fetched and decoded in worker
+processes instead, which hand back compact binary columns through
+shared memory that the registry ingests as-is.
+"""
+
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+from eth_validator_watcher_ext import EpochLiveness, EpochRewards, EpochValidators
+
+from .beacon import Beacon
+from .columns import rewards_columns
+
+
+def _fetch_validators(beacon: Beacon, slot: int, ids: Optional[list[str]]) -> EpochValidators:
+    return beacon.get_validators_columns(slot, ids)
+
+
+def _fetch_rewards(beacon: Beacon, epoch: int, indexes: Optional[list[int]]) -> EpochRewards:
+    return rewards_columns(beacon.get_rewards(epoch, indexes))
+
+
+def _fetch_liveness(beacon: Beacon, epoch: int, indexes: list[int]) -> EpochLiveness:
+    return beacon.get_liveness_columns(epoch, indexes)
+
+
+# Beacon of the worker process, reused from call to call to keep the
+# connections alive.
+_worker_beacon: Optional[Beacon] = None
+
+
+def _fetch_in_worker(url: str, timeout_sec: int, fetch, *args) -> str:
+    """Fetch and decode a response from a worker process.
+
+    Returns:
+    The name of the shared memory segment holding the columns, it is
+    up to the caller to unlink it.
+    """
+    global _worker_beacon
+    if _worker_beacon is None or _worker_beacon.get_url() != url or _worker_beacon.get_timeout_sec() != timeout_sec:
+        _worker_beacon = Beacon(url, timeout_sec)
+
+    columns = fetch(_worker_beacon, *args)
+    shm = SharedMemory(create=True, size=max(columns.nbytes(), 1))
+    try:
+        columns.dump(shm.buf)
+    finally:
+        shm.close()
+    return shm.name
+
+
+class Decoder:
+    """Fetches the large beacon responses as native columns.
+
+    With workers, responses are fetched and decoded in separate
+    processes, otherwise in the calling thread.
+    """
+
+    def __init__(self, workers: int) -> None:
+        """Decoder
+
+        Parameters:
+        workers: number of worker processes, 0 to decode in process
+        """
+        self._workers = workers
+        self._executor = None
+        if workers > 0:
+            # Threads are running in the watcher, forking is unsafe.
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def get_workers(self) -> int:
+        """Return the number of worker processes."""
+        return self._workers
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch(self, cls, beacon: Beacon, fetch, *args):
+        if self._executor is None:
+            return fetch(beacon, *args)
+
+        name = self._executor.submit(_fetch_in_worker, beacon.get_url(), beacon.get_timeout_sec(), fetch, *args).result()
+        shm = SharedMemory(name=name)
+        try:
+            return cls.load(shm.buf)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def validators(self, beacon: Beacon, slot: int, ids: Optional[list[str]] = None) -> EpochValidators:
+        """Fetch the validators of the network.
+
+        Parameters:
+        beacon: Beacon to query
+        slot  : Slot corresponding to the beacon state to retrieve
+        ids   : Only fetch those validators (indexes or public keys)
+        """
+        return self._fetch(EpochValidators, beacon, _fetch_validators, slot, ids)
+
+    def rewards(self, beacon: Beacon, epoch: int, indexes: Optional[list[int]] = None) -> EpochRewards:
+        """Fetch the attestation rewards.
+
+        Parameters:
+        beacon : Beacon to query
+        epoch  : Epoch corresponding to the rewards to retrieve
+        indexes: Only fetch the rewards of those validators
+        """
+        return self._fetch(EpochRewards, beacon, _fetch_rewards, epoch, indexes)
+
+    def liveness(self, beacon: Beacon, epoch: int, indexes: list[int]) -> EpochLiveness:
+        """Fetch the validators liveness.
+
+        Parameters:
+        beacon : Beacon to query
+        epoch  : Epoch corresponding to the validators liveness to retrieve
+        indexes: Indexes of the validators
+        """
+        return self._fetch(EpochLiveness, beacon, _fetch_liveness, epoch, indexes)
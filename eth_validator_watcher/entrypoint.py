@@ -2,6 +2,7 @@
 """
 
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
 from prometheus_client import start_http_server
@@ -13,22 +14,28 @@ import typer
 import time
 
 from .coinbase import  get_current_eth_price
+from .decoding import Decoder
 from .clock import BeaconClock
 from .beacon import Beacon, NoBlockError
-from .config import load_config, WatchedKeyConfig
+from .events import BeaconEvents
+from .keys_index import WatchedKeysIndex
+from .config import load_config, ScopeEnum, WatchedKeyConfig
 from .log import log_details, slack_send
-from .metrics import get_prometheus_metrics, compute_validator_metrics
-from .blocks import process_block, process_finalized_block, process_future_blocks
-from .models import BlockIdentierType, Validators
+from .notifications import SlackDispatcher
+from .metrics import get_prometheus_metrics, compute_validator_metrics, WorkerPool
+from .blocks import process_block, process_finalized_blocks, process_future_blocks
+from .models import BlockIdentierType
 from .rewards import process_rewards
+from .snapshot import Snapshot, load_snapshot, write_snapshot
 from .utils import (
     SLOT_FOR_CONFIG_RELOAD,
     SLOT_FOR_MISSED_ATTESTATIONS_PROCESS,
     SLOT_FOR_REWARDS_PROCESS,
-    pct,
+    SLOT_FOR_SNAPSHOT,
+    available_cpus,
 )
 from .proposer_schedule import ProposerSchedule
-from .watched_validators import WatchedValidators
+from .watched_validators import EpochValidators, WatchedValidators
 
 
 app = typer.Typer(add_completion=False)
@@ -58,16 +65,27 @@ class ValidatorWatcher:
         self._cfg = None
         self._cfg_last_modified = None
         self._beacon = None
+        self._events = None
+        self._pool = None
+        self._slack = None
+        self._decoder = None
+        self._network_validators_epoch = None
+        self._epoch_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='epoch')
+        # Liveness is fetched by chunks on the beacon workers, it has
+        # to be waited for from elsewhere.
+        self._liveness_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='liveness')
+        self._snapshot_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot')
         self._slot_duration = None
         self._genesis = None
 
         self._reload_config()
 
-        self._spec = self._beacon.get_spec()        
-        genesis = self._beacon.get_genesis().data.genesis_time
+        self._spec = self._beacon.get_spec()
+        self._reload_events()
+        self._genesis = self._beacon.get_genesis().data.genesis_time
 
         self._clock = BeaconClock(
-            genesis,
+            self._genesis,
             self._spec.data.SECONDS_PER_SLOT,
             self._spec.data.SLOTS_PER_EPOCH,
             self._cfg.replay_start_at_ts,
@@ -87,9 +105,148 @@ class ValidatorWatcher:
         except ValidationError as err:
             raise typer.BadParameter(f'Invalid configuration file: {err}')
 
+        # Background requests are bound to the clients they were
+        # submitted with, replaced clients are closed once done.
+        retired = []
         if self._beacon is None or self._beacon.get_url() != self._cfg.beacon_url or self._beacon.get_timeout_sec() != self._cfg.beacon_timeout_sec:
+            if self._beacon is not None:
+                retired.append(self._beacon)
             self._beacon = Beacon(self._cfg.beacon_url, self._cfg.beacon_timeout_sec)
 
+        decode_workers = self._cfg.decode_workers or 0
+        if self._decoder is None or self._decoder.get_workers() != decode_workers:
+            if self._decoder is not None:
+                retired.append(self._decoder)
+            self._decoder = Decoder(decode_workers)
+
+        if retired:
+            self._retire_clients(retired)
+
+        slack_target = None
+        if self._cfg.slack_token and self._cfg.slack_channel:
+            slack_target = (self._cfg.slack_token, self._cfg.slack_channel)
+        if (self._slack.get_target() if self._slack is not None else None) != slack_target:
+            if self._slack is not None:
+                self._slack.close()
+                self._slack = None
+            if slack_target is not None:
+                self._slack = SlackDispatcher(
+                    *slack_target,
+                    self._metrics.eth_slack_queue_depth.labels(self._cfg.network),
+                    self._metrics.eth_slack_dropped_messages_total.labels(self._cfg.network),
+                )
+
+        workers = self._cfg.metrics_workers or available_cpus()
+        if self._pool is None or self._pool.size() != workers:
+            logging.info(f'⚙️ Using {workers} workers to compute metrics')
+            self._pool = WorkerPool(workers)
+
+    def _retire_clients(self, clients: list) -> None:
+        """Close clients once the background requests using them are done.
+
+        The loaders run their requests in order, closing is queued
+        behind those already submitted.
+        """
+        liveness_done = self._liveness_loader.submit(lambda: None)
+
+        def close():
+            liveness_done.result()
+            for client in clients:
+                client.close()
+
+        self._epoch_loader.submit(close)
+
+    def _reload_events(self) -> None:
+        """Subscribe or unsubscribe to the beacon events.
+        """
+        url = self._beacon.get_url() if self._cfg.beacon_events else None
+        if self._events is not None and self._events.get_url() == url:
+            return
+
+        if self._events is not None:
+            self._events.stop()
+            self._events = None
+
+        if url is not None:
+            # The head event comes at least once per slot on a
+            # healthy beacon, consider the stream dead after a few.
+            self._events = BeaconEvents(url, 3 * self._spec.data.SECONDS_PER_SLOT)
+            self._events.start()
+
+    def _submit_epoch(self, watched_validators: WatchedValidators, epoch: int) -> Future:
+        """Load the validator set of an epoch in the background.
+
+        Only the watched validators are fetched if configured so, the
+        whole network is then refreshed every few epochs if set. What
+        to fetch is decided here, the background load doesn't touch
+        the state of the watcher.
+        """
+        ids = None
+        if self._cfg.validators_scope == ScopeEnum.watched:
+            refresh = self._cfg.network_validators_refresh_epochs
+            if not refresh or (self._network_validators_epoch is not None and epoch - self._network_validators_epoch < refresh):
+                ids = watched_validators.get_watched_public_keys(self._cfg)
+
+        return self._epoch_loader.submit(self._prepare_epoch, epoch, ids, self._beacon, self._decoder)
+
+    def _prepare_epoch(self, epoch: int, ids: Optional[list[str]], beacon: Beacon, decoder: Decoder) -> tuple[EpochValidators, Optional[int]]:
+        """Fetch and load the validator set of an epoch.
+
+        Args:
+        -----
+        epoch: Epoch to fetch the validator set of.
+        ids: Public keys of the validators to fetch, all if None.
+        beacon: Beacon at the time of the submission, it may be
+            replaced by a configuration reload in the meantime.
+        decoder: Decoder at the time of the submission.
+
+        Returns:
+        --------
+        The validator set and the epoch it is if it is the whole
+        network, None otherwise.
+        """
+        validators = decoder.validators(beacon, self._clock.epoch_to_slot(epoch), ids)
+        return validators, epoch if ids is None else None
+
+    def _submit_rewards(self, watched_validators: WatchedValidators, epoch: int) -> Future:
+        """Request the rewards of the epoch before the previous one.
+
+        Only the rewards of the watched validators are requested if
+        the validator set is restricted to them.
+        """
+        indexes = None
+        if self._cfg.validators_scope == ScopeEnum.watched:
+            indexes = watched_validators.get_watched_indexes()
+        return self._beacon.submit(self._decoder.rewards, self._beacon, epoch - 2, indexes)
+
+    def _has_block_at_slot(self, slot: int) -> bool:
+        """Whether there is a block at slot, from the events if possible.
+        """
+        if self._events is not None and self._events.has_block(slot):
+            return True
+        return self._beacon.has_block_at_slot(slot)
+
+    def _invalidate_proposer_duties(self) -> None:
+        """Drop the proposer duties whose dependent root changed.
+        """
+        if self._events is None:
+            return
+
+        for head_slot, previous_root, current_root in self._events.pop_dependent_roots():
+            head_epoch = head_slot // self._spec.data.SLOTS_PER_EPOCH
+            for epoch, root in ((head_epoch - 1, previous_root), (head_epoch, current_root)):
+                self._beacon.invalidate_proposer_duties(epoch, root)
+                self._schedule.invalidate(epoch, root)
+
+    def _write_snapshot(self, snapshot: Snapshot) -> None:
+        """Write a snapshot of the state, failures are not fatal.
+        """
+        try:
+            write_snapshot(snapshot, self._cfg.snapshot_path)
+            logging.info(f'💾 Wrote snapshot of slot {snapshot.slot}')
+        except OSError as e:
+            logging.warning(f'💾 Unable to write snapshot: {e}')
+
     def _update_metrics(self, watched_validators: WatchedValidators, epoch: int, slot: int) -> None:
         """Update the Prometheus metrics with the watched validators.
 
@@ -109,38 +266,13 @@ class ValidatorWatcher:
         # there is a log of entries here, this makes code here a bit
         # more complex and entangled.
 
-        metrics = compute_validator_metrics(watched_validators.get_validators(), slot)
-
-        log_details(self._cfg, watched_validators, metrics, slot)
-
-        for label, m in metrics.items():
-            for status in Validators.DataItem.StatusEnum:
-                value = m.validator_status_count.get(status, 0)
-                self._metrics.eth_validator_status_count.labels(label, status, network).set(value)
-
-        for label, m in metrics.items():
-            self._metrics.eth_suboptimal_sources_rate.labels(label, network).set(pct(m.suboptimal_source_count, m.optimal_source_count))
-            self._metrics.eth_suboptimal_targets_rate.labels(label, network).set(pct(m.suboptimal_target_count, m.optimal_target_count))
-            self._metrics.eth_suboptimal_heads_rate.labels(label, network).set(pct(m.suboptimal_head_count, m.optimal_head_count))
+        metrics = compute_validator_metrics(watched_validators, slot, self._pool, bool(self._cfg.metrics_consistency_check))
 
-            self._metrics.eth_ideal_consensus_rewards_gwei.labels(label, network).set(m.ideal_consensus_reward)
-            self._metrics.eth_actual_consensus_rewards_gwei.labels(label, network).set(m.actual_consensus_reward)
-            self._metrics.eth_consensus_rewards_rate.labels(label, network).set(pct(m.actual_consensus_reward, m.ideal_consensus_reward, True))
+        log_details(self._cfg, watched_validators, metrics, slot, self._slack)
+        if self._slack is not None:
+            self._slack.flush()
 
-            self._metrics.eth_missed_attestations_count.labels(label, network).set(m.missed_attestations)
-            self._metrics.eth_missed_consecutive_attestations_count.labels(label, network).set(m.missed_consecutive_attestations)
-            self._metrics.eth_slashed_validators_count.labels(label, network).set(m.validator_slashes)
-
-            # Here we inc, it's fine since we previously reset the
-            # counters on each run; we can't use set because those
-            # metrics are counters.
-
-            self._metrics.eth_block_proposals_head_total.labels(label, network).inc(m.proposed_blocks)
-            self._metrics.eth_missed_block_proposals_head_total.labels(label, network).inc(m.missed_blocks)
-            self._metrics.eth_block_proposals_finalized_total.labels(label, network).inc(m.proposed_blocks_finalized)
-            self._metrics.eth_missed_block_proposals_finalized_total.labels(label, network).inc(m.missed_blocks_finalized)
-
-            self._metrics.eth_future_block_proposals.labels(label, network).set(m.future_blocks_proposal)
+        self._metrics.validators.update(network, metrics)
 
         global prometheus_metrics_thread_started
         if not prometheus_metrics_thread_started:
@@ -155,52 +287,143 @@ class ValidatorWatcher:
         epoch = self._clock.get_current_epoch()
         slot = self._clock.get_current_slot()
 
-        beacon_validators = None
-        validators_liveness = None
-        rewards = None
+        validators_processed = False
+        epoch_request = None
+        liveness_epoch = None
+        rewards_epoch = None
         last_processed_finalized_slot = None
-
-        slack_send(self._cfg, f'🚀 *Ethereum Validator Watcher* started on {self._cfg.network}, watching {len(self._cfg.watched_keys)} validators')
+        last_finalized = None
+        head_blocks = dict()
+
+        snapshot = None
+        if self._cfg.snapshot_path:
+            snapshot = load_snapshot(self._cfg.snapshot_path, self._cfg.network, self._genesis, slot, epoch)
+        if snapshot is not None:
+            logging.info(f'💾 Resuming from the snapshot of slot {snapshot.slot}')
+            watched_validators.restore(snapshot.registry)
+            watched_validators.process_config(self._cfg)
+            self._schedule.load(snapshot.schedule)
+            self._network_validators_epoch = snapshot.network_validators_epoch
+            liveness_epoch = snapshot.liveness_epoch
+            rewards_epoch = snapshot.rewards_epoch
+            last_processed_finalized_slot = snapshot.last_processed_finalized_slot
+            head_blocks = snapshot.head_blocks
+
+            # Metrics are exported from the snapshot right away, the
+            # validator set is refreshed in the background if we are
+            # in another epoch (unless it is its first slot anyway).
+            validators_processed = True
+            if snapshot.slot // self._spec.data.SLOTS_PER_EPOCH != epoch and slot % self._spec.data.SLOTS_PER_EPOCH != 0:
+                epoch_request = self._submit_epoch(watched_validators, epoch)
+            snapshot = None
+
+        if self._cfg.watched_keys_index:
+            with WatchedKeysIndex(self._cfg.watched_keys_index) as index:
+                watched_count = len(index)
+        else:
+            watched_count = len(self._cfg.watched_keys)
+        slack_send(self._slack, f'🚀 *Ethereum Validator Watcher* started on {self._cfg.network}, watching {watched_count} validators')
+        if self._slack is not None:
+            self._slack.flush()
 
         while True:
             logging.info(f'🔨 Processing slot {slot}')
 
-            last_finalized_slot = self._beacon.get_header(BlockIdentierType.FINALIZED).data.header.message.slot
+            self._invalidate_proposer_duties()
+
+            # Requests which don't depend on each other are sent at
+            # once, results are processed in the same order as before.
+            # The finalized header is only refetched when the event
+            # stream can't tell it didn't change.
+            if last_finalized is None or self._events is None or self._events.finalized_changed():
+                last_finalized = self._beacon.submit(self._beacon.get_header, BlockIdentierType.FINALIZED)
+            has_block = self._beacon.submit(self._has_block_at_slot, slot)
+
+            # The validator set is large, it is loaded in the
+            # background and swapped in once ready so that the epoch
+            # boundary doesn't delay the processing of its slot. The
+            # first time we need it right away.
+            if not validators_processed or (slot % self._spec.data.SLOTS_PER_EPOCH == 0):
+                logging.info(f'🔨 Fetching validators of epoch {epoch}')
+                epoch_request = self._submit_epoch(watched_validators, epoch)
+            should_process_validators = epoch_request is not None and (not validators_processed or epoch_request.done())
+
+            last_finalized_slot = last_finalized.result().data.header.message.slot
             self._schedule.update(self._beacon, slot, last_processed_finalized_slot, last_finalized_slot)
 
-            if beacon_validators == None or (slot % self._spec.data.SLOTS_PER_EPOCH == 0):
+            # The liveness of an epoch is processed once: processing
+            # it twice would report its missed attestations as
+            # consecutive. Rewards are retried until there is a block.
+            should_process_liveness = liveness_epoch is None or (
+                liveness_epoch < epoch - 1 and slot % self._spec.data.SLOTS_PER_EPOCH >= SLOT_FOR_MISSED_ATTESTATIONS_PROCESS)
+            should_process_rewards = rewards_epoch is None or (
+                rewards_epoch < epoch - 2 and slot % self._spec.data.SLOTS_PER_EPOCH >= SLOT_FOR_REWARDS_PROCESS)
+
+            # There is a possibility the slot is missed, in which
+            # case we'll have to wait for the next one for rewards.
+            has_block = has_block.result()
+            should_process_rewards = should_process_rewards and has_block
+
+            # Watched validators are only known once the configuration
+            # was applied, otherwise rewards are requested after the
+            # epoch is processed.
+            rewards_request = None
+            if should_process_rewards and (self._cfg.validators_scope != ScopeEnum.watched or watched_validators.config_initialized):
+                rewards_request = self._submit_rewards(watched_validators, epoch)
+
+            # Liveness needs the indexes of the validators, which are
+            # only known ahead when the validator set isn't refreshed.
+            liveness_request = None
+            if should_process_liveness and not should_process_validators:
+                liveness_request = self._liveness_loader.submit(
+                    self._decoder.liveness, self._beacon, epoch - 1, watched_validators.get_liveness_indexes(self._cfg.liveness_scope))
+
+            if should_process_validators:
                 logging.info(f'🔨 Processing epoch {epoch}')
-                beacon_validators = self._beacon.get_validators(self._clock.epoch_to_slot(epoch))
-                watched_validators.process_epoch(beacon_validators)
-                if not watched_validators.config_initialized:
+                validators, network_validators_epoch = epoch_request.result()
+                watched_validators.process_epoch(validators)
+                if network_validators_epoch is not None:
+                    self._network_validators_epoch = network_validators_epoch
+                epoch_request = None
+                validators_processed = True
+                # With a partial validator set, newly fetched validators
+                # have to be labelled.
+                if not watched_validators.config_initialized or self._cfg.validators_scope == ScopeEnum.watched:
                     watched_validators.process_config(self._cfg)
 
-            if validators_liveness == None or (slot % self._spec.data.SLOTS_PER_EPOCH == SLOT_FOR_MISSED_ATTESTATIONS_PROCESS):
+            if should_process_rewards and rewards_request is None:
+                rewards_request = self._submit_rewards(watched_validators, epoch)
+
+            if should_process_liveness:
                 logging.info('🔨 Processing validator liveness')
-                validators_liveness = self._beacon.get_validators_liveness(epoch - 1, watched_validators.get_indexes())
-                watched_validators.process_liveness(validators_liveness)
- 
-            has_block = self._beacon.has_block_at_slot(slot)
-
-            if rewards == None or (slot % self._spec.data.SLOTS_PER_EPOCH == SLOT_FOR_REWARDS_PROCESS):
-                # There is a possibility the slot is missed, in which
-                # case we'll have to wait for the next one.
-                if not has_block:
-                    rewards = None
-                else:
-                    logging.info('🔨 Trying to process rewards')
-                    rewards = self._beacon.get_rewards(epoch - 2)
-                    process_rewards(watched_validators, rewards)
+                if liveness_request is None:
+                    liveness_request = self._liveness_loader.submit(
+                        self._decoder.liveness, self._beacon, epoch - 1, watched_validators.get_liveness_indexes(self._cfg.liveness_scope))
+                watched_validators.process_liveness(liveness_request.result())
+                liveness_epoch = epoch - 1
+
+            if rewards_request is not None:
+                logging.info('🔨 Trying to process rewards')
+                process_rewards(watched_validators, rewards_request.result())
+                rewards_epoch = epoch - 2
 
             process_block(watched_validators, self._schedule, slot, has_block)
+            head_blocks[slot] = has_block
+
+            # What we saw at head for reorged slots can't be trusted.
+            if self._events is not None:
+                for reorg_slot, depth in self._events.pop_reorgs():
+                    for reorged in range(reorg_slot - depth + 1, reorg_slot + 1):
+                        head_blocks.pop(reorged, None)
             process_future_blocks(watched_validators, self._schedule, slot)
 
-            while last_processed_finalized_slot and last_processed_finalized_slot < last_finalized_slot:
-                logging.info(f'🔨 Processing finalized slot from {last_processed_finalized_slot or last_finalized_slot} to {last_finalized_slot}')
-                has_block = self._beacon.has_block_at_slot(last_processed_finalized_slot)
-                process_finalized_block(watched_validators, self._schedule, last_processed_finalized_slot, has_block)
-                last_processed_finalized_slot += 1
+            if last_processed_finalized_slot and last_processed_finalized_slot < last_finalized_slot:
+                logging.info(f'🔨 Processing finalized slot from {last_processed_finalized_slot} to {last_finalized_slot}')
+                watched_only = self._cfg.block_lookup_scope == ScopeEnum.watched
+                process_finalized_blocks(self._beacon, watched_validators, self._schedule, last_processed_finalized_slot, last_finalized_slot,
+                                         head_blocks if watched_only else None)
             last_processed_finalized_slot = last_finalized_slot
+            head_blocks = {k: v for k, v in head_blocks.items() if k >= last_processed_finalized_slot}
 
             logging.info('🔨 Updating Prometheus metrics')
             self._update_metrics(watched_validators, epoch, slot)
@@ -208,10 +431,27 @@ class ValidatorWatcher:
             if (slot % self._spec.data.SLOTS_PER_EPOCH == SLOT_FOR_CONFIG_RELOAD):
                 logging.info('🔨 Processing configuration update')
                 self._reload_config()
+                self._reload_events()
                 watched_validators.process_config(self._cfg)
 
             self._schedule.clear(slot, last_processed_finalized_slot)
-            self._clock.maybe_wait_for_slot(slot + 1)
+
+            # The state is copied here and written in the background.
+            interval = self._cfg.snapshot_interval_epochs or 1
+            if self._cfg.snapshot_path and slot % self._spec.data.SLOTS_PER_EPOCH == SLOT_FOR_SNAPSHOT and epoch % interval == 0:
+                self._snapshot_writer.submit(self._write_snapshot, Snapshot(
+                    network=self._cfg.network,
+                    genesis_time=self._genesis,
+                    slot=slot,
+                    last_processed_finalized_slot=last_processed_finalized_slot,
+                    liveness_epoch=liveness_epoch,
+                    rewards_epoch=rewards_epoch,
+                    network_validators_epoch=self._network_validators_epoch,
+                    head_blocks=dict(head_blocks),
+                    schedule=self._schedule.dump(),
+                    registry=watched_validators.get_state(),
+                ))
+            self._clock.maybe_wait_for_slot(slot + 1, self._events)
 
             if self._slot_hook:
                 self._slot_hook(slot)
@@ -0,0 +1,250 @@
+"""Subscription to the event stream of the beacon node.
+
+The beacon exposes server-sent events on /eth/v1/events, this allows
+to know a block exists as soon as the beacon imported it instead of
+waiting a fixed delay into the slot and polling for its header. The
+stream is only an accelerator: when it is down, the watcher falls back
+to its clock.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Iterable, Iterator
+
+from requests import Session
+from requests.exceptions import RequestException
+
+# Topics we subscribe to.
+TOPICS = ['head', 'block', 'finalized_checkpoint', 'chain_reorg']
+
+# How many slots of block events are kept around.
+BLOCKS_HISTORY_SLOTS = 64
+
+# Delay before reconnecting after the stream dropped.
+RECONNECT_DELAY_SEC = 5.0
+
+# How long stop() waits for the background thread to exit.
+STOP_TIMEOUT_SEC = 5.0
+
+
+def iter_events(chunks: Iterable[bytes]) -> Iterator[tuple[str, Any]]:
+    """Iterate over the events of a server-sent events stream.
+
+    Parameters:
+    chunks: iterator of raw bytes (i.e: requests' iter_content())
+
+    Returns:
+    An iterator over (event name, decoded JSON data).
+    """
+    buf = b''
+    event, data = 'message', []
+
+    for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b'\n')
+
+        for line in lines:
+            line = line.rstrip(b'\r').decode('utf-8')
+
+            # An empty line dispatches the event.
+            if not line:
+                if data:
+                    yield event, json.loads('\n'.join(data))
+                event, data = 'message', []
+                continue
+
+            # Comments are used as keep-alives.
+            if line.startswith(':'):
+                continue
+
+            name, _, value = line.partition(':')
+            value = value.removeprefix(' ')
+            if name == 'event':
+                event = value
+            elif name == 'data':
+                data.append(value)
+
+
+class BeaconEvents:
+    """Keeps track of the blocks announced on the beacon event stream.
+
+    The stream is consumed from a background thread which reconnects
+    whenever it drops.
+    """
+
+    def __init__(self, url: str, read_timeout_sec: float) -> None:
+        """BeaconEvents
+
+        Parameters:
+        url             : URL where the beacon can be reached
+        read_timeout_sec: time without any data after which the stream
+                          is considered dead
+        """
+        self._url = url
+        self._read_timeout_sec = read_timeout_sec
+        self._http = Session()
+        self._cond = threading.Condition()
+        self._connected = False
+        self._stopped = False
+        # Response being streamed, closed by stop() to interrupt it.
+        self._response = None
+        self._blocks = set()
+        self._reorgs = []
+        self._dependent_roots = []
+        self._finalized_changed = True
+        self._thread = threading.Thread(target=self._run, name='beacon-events', daemon=True)
+
+    def get_url(self) -> str:
+        """Return the URL of the beacon."""
+        return self._url
+
+    def start(self) -> None:
+        """Start consuming the event stream in the background."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop consuming the event stream and wait for the background
+        thread to exit."""
+        with self._cond:
+            self._stopped = True
+            response = self._response
+            self._cond.notify_all()
+        if response is not None:
+            response.close()
+        if self._thread.is_alive():
+            self._thread.join(STOP_TIMEOUT_SEC)
+        self._http.close()
+
+    def connected(self) -> bool:
+        """Whether the event stream is currently up."""
+        with self._cond:
+            return self._connected
+
+    def has_block(self, slot: int) -> bool:
+        """Whether a block was announced for the slot.
+
+        False means we don't know: the block may be missed, late or
+        announced while the stream was down.
+        """
+        with self._cond:
+            return slot in self._blocks
+
+    def wait_for_block(self, slot: int, timeout: float) -> bool:
+        """Wait for a block to be announced for the slot.
+
+        Parameters:
+        slot   : slot of the block
+        timeout: maximum time to wait, in seconds
+
+        Returns:
+        True if the block was announced, False if it wasn't in time
+        or the stream dropped meanwhile.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while slot not in self._blocks and self._connected and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return slot in self._blocks
+
+    def pop_reorgs(self) -> list[tuple[int, int]]:
+        """Returns the (slot, depth) of chain reorgs since the last call."""
+        with self._cond:
+            reorgs, self._reorgs = self._reorgs, []
+            return reorgs
+
+    def pop_dependent_roots(self) -> list[tuple[int, str, str]]:
+        """Returns the (slot, previous, current) duty dependent roots
+        announced by head events since the last call."""
+        with self._cond:
+            roots, self._dependent_roots = self._dependent_roots, []
+            return roots
+
+    def finalized_changed(self) -> bool:
+        """Whether the finalized checkpoint may have changed since
+        the last call.
+
+        This is always the case while the stream is down.
+        """
+        with self._cond:
+            changed, self._finalized_changed = self._finalized_changed or not self._connected, False
+            return changed
+
+    def _process_event(self, event: str, data: Any) -> None:
+        """Update the state of the stream with an event."""
+        with self._cond:
+            if event in ('head', 'block'):
+                slot = int(data['slot'])
+                self._blocks.add(slot)
+                self._blocks = {s for s in self._blocks if s > slot - BLOCKS_HISTORY_SLOTS}
+                if event == 'head' and 'current_duty_dependent_root' in data:
+                    self._dependent_roots.append((slot, data['previous_duty_dependent_root'], data['current_duty_dependent_root']))
+            elif event == 'chain_reorg':
+                slot, depth = int(data['slot']), int(data['depth'])
+                logging.info(f'🔀 Chain reorg of depth {depth} at slot {slot}')
+                self._blocks = {s for s in self._blocks if s <= slot - depth}
+                self._reorgs.append((slot, depth))
+            elif event == 'finalized_checkpoint':
+                logging.info(f'🔒 Finalized checkpoint at epoch {data["epoch"]}')
+                self._finalized_changed = True
+            self._cond.notify_all()
+
+    def _set_connected(self, connected: bool) -> None:
+        with self._cond:
+            self._connected = connected
+            # We may have missed events while disconnected, forget
+            # about what we know to fall back to the beacon.
+            if not connected:
+                self._blocks = set()
+            self._finalized_changed = True
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        """Consume the event stream until stopped."""
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+
+            try:
+                response = self._http.get(
+                    f'{self._url}/eth/v1/events',
+                    params={'topics': ','.join(TOPICS)},
+                    # Compression would buffer events.
+                    headers={'Accept': 'text/event-stream', 'Accept-Encoding': 'identity'},
+                    timeout=self._read_timeout_sec,
+                    stream=True,
+                )
+                with response:
+                    with self._cond:
+                        if self._stopped:
+                            return
+                        self._response = response
+                    response.raise_for_status()
+                    logging.info('📡 Subscribed to beacon events')
+                    self._set_connected(True)
+                    for event, data in iter_events(response.iter_content(chunk_size=None)):
+                        with self._cond:
+                            if self._stopped:
+                                return
+                        self._process_event(event, data)
+            except (RequestException, ValueError, KeyError, AttributeError, OSError) as e:
+                # Closing the response from stop() interrupts the
+                # read with any of those.
+                with self._cond:
+                    if self._stopped:
+                        return
+                logging.warning(f'📡 Beacon event stream failed: {e}')
+            finally:
+                with self._cond:
+                    self._response = None
+
+            self._set_connected(False)
+
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(RECONNECT_DELAY_SEC)
@@ -0,0 +1,221 @@
+"""Compiled index of the watched keys.
+
+Large operators watch hundreds of thousands of keys: parsing them from
+the configuration file and turning each of them into Python objects
+takes most of the startup and reload time. The watched keys can be
+compiled ahead of time into a binary index which the watcher memory
+maps and hands as-is to the registry.
+
+The index is laid out as follows, integers are little-endian:
+
+- header: magic, digest of the rest of the file, number of keys,
+  labels, label ids and size of the labels table (all u64),
+- pubkeys: the 48 bytes public keys, sorted,
+- offsets: u64, the label ids of the i-th key are
+  label_ids[offsets[i]:offsets[i + 1]],
+- label_ids: u32, position of the label in the labels table,
+- labels: u32 length-prefixed UTF-8 labels.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterable, Optional
+
+import typer
+
+from .config import Config, WatchedKeyConfig, load_config
+
+MAGIC = b'EVWKIDX1'
+
+PUBKEY_SIZE = 48
+
+_HEADER = struct.Struct('<8s16sQQQQ')
+
+
+def compile_watched_keys(watched_keys: Iterable[WatchedKeyConfig], path: str) -> int:
+    """Compile watched keys into an index file.
+
+    The file is replaced atomically so that a running watcher never
+    sees a partial index.
+
+    Parameters:
+    watched_keys: watched keys of the configuration
+    path        : path of the index to write
+
+    Returns:
+    The number of keys in the index.
+    """
+    # Last one wins for duplicate keys, as with the configuration.
+    by_pubkey = dict()
+    for key in watched_keys:
+        try:
+            pubkey = bytes.fromhex(key.public_key.removeprefix('0x'))
+        except ValueError:
+            pubkey = None
+        if pubkey is None or len(pubkey) != PUBKEY_SIZE:
+            raise ValueError(f'invalid public key: {key.public_key}')
+        by_pubkey[pubkey] = key.labels or []
+
+    labels, label_positions = [], dict()
+    offsets, label_ids = array('Q', [0]), array('I')
+    for pubkey in sorted(by_pubkey):
+        for label in by_pubkey[pubkey]:
+            position = label_positions.get(label)
+            if position is None:
+                position = label_positions[label] = len(labels)
+                labels.append(label)
+            label_ids.append(position)
+        offsets.append(len(label_ids))
+
+    table = b''.join(struct.pack('<I', len(encoded)) + encoded for encoded in (label.encode() for label in labels))
+    body = [b''.join(sorted(by_pubkey)), offsets.tobytes(), label_ids.tobytes(), table]
+
+    h = hashlib.blake2b(digest_size=16)
+    for part in body:
+        h.update(part)
+    header = _HEADER.pack(MAGIC, h.digest(), len(by_pubkey), len(labels), len(label_ids), len(table))
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(header)
+        for part in body:
+            fh.write(part)
+    os.replace(tmp, path)
+
+    return len(by_pubkey)
+
+
+class WatchedKeysIndex:
+    """Read-only view on a compiled index of the watched keys.
+
+    The file is memory mapped: the keys are only paged in when read,
+    and processes watching the same keys share the page cache.
+    """
+
+    def __init__(self, path: str) -> None:
+        """WatchedKeysIndex
+
+        Parameters:
+        path: path of the index
+        """
+        with open(path, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < _HEADER.size:
+                raise ValueError(f'{path} is not a watched keys index')
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.digest, key_count, label_count, label_ids_count, labels_size = _HEADER.unpack_from(self._mmap)
+        expected = _HEADER.size + key_count * PUBKEY_SIZE + (key_count + 1) * 8 + label_ids_count * 4 + labels_size
+        if magic != MAGIC or size != expected:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a watched keys index')
+
+        # The index is applied as-is to the registry, a truncated or
+        # half-written file must not get there.
+        view = memoryview(self._mmap)
+        pubkeys = offsets = label_ids = None
+        try:
+            if hashlib.blake2b(view[_HEADER.size:], digest_size=16).digest() != self.digest:
+                raise ValueError(f'{path} is corrupted')
+
+            start = _HEADER.size
+            pubkeys = view[start:start + key_count * PUBKEY_SIZE]
+            start += key_count * PUBKEY_SIZE
+            offsets = view[start:start + (key_count + 1) * 8]
+            start += (key_count + 1) * 8
+            label_ids = view[start:start + label_ids_count * 4]
+            start += label_ids_count * 4
+            if struct.unpack_from('<Q', offsets, key_count * 8)[0] != label_ids_count:
+                raise ValueError(f'{path} is corrupted')
+
+            # There are few distinct labels, they are decoded upfront.
+            labels = []
+            for _ in range(label_count):
+                if start + 4 > size:
+                    raise ValueError(f'{path} is corrupted')
+                length, = struct.unpack_from('<I', self._mmap, start)
+                labels.append(bytes(view[start + 4:start + 4 + length]).decode())
+                start += 4 + length
+            if start != size:
+                raise ValueError(f'{path} is corrupted')
+        except ValueError:
+            for v in (pubkeys, offsets, label_ids, view):
+                if v is not None:
+                    v.release()
+            self._mmap.close()
+            raise
+        view.release()
+
+        self.pubkeys, self.offsets, self.label_ids, self.labels = pubkeys, offsets, label_ids, labels
+        self._count = key_count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> 'WatchedKeysIndex':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def public_keys(self) -> list[str]:
+        """Return the public keys in hexadecimal form."""
+        pubkeys = self.pubkeys
+        return [f'0x{pubkeys[i:i + PUBKEY_SIZE].hex()}' for i in range(0, len(pubkeys), PUBKEY_SIZE)]
+
+    def close(self) -> None:
+        """Unmap the index, views on it can't be used anymore."""
+        for view in (self.pubkeys, self.offsets, self.label_ids):
+            view.release()
+        self._mmap.close()
+
+
+def watched_public_keys(cfg: Config) -> list[str]:
+    """Public keys of the watched validators, from the index if
+    configured.
+
+    Parameters:
+    cfg: configuration of the watcher
+    """
+    if cfg.watched_keys_index:
+        with WatchedKeysIndex(cfg.watched_keys_index) as index:
+            return index.public_keys()
+    return [key.public_key for key in cfg.watched_keys or []]
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def handler(
+    output: Path = typer.Argument(
+        ...,
+        help="File to write the index to.",
+        dir_okay=False,
+    ),
+    config: Optional[Path] = typer.Option(
+        'etc/config.local.yaml',
+        help="File containing the Ethereum Validator Watcher configuration file.",
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        show_default=True,
+    ),
+) -> None:
+    """Compile the watched keys of a configuration file into an index."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)-8s %(message)s'
+    )
+
+    cfg = load_config(str(config))
+    try:
+        count = compile_watched_keys(cfg.watched_keys or [], str(output))
+    except ValueError as err:
+        raise typer.BadParameter(f'Invalid watched keys: {err}')
+    logging.info(f'⚙️ Compiled {count} watched keys into {output}')
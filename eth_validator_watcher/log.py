@@ -1,11 +1,11 @@
 import collections
 import logging
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+from typing import Optional
 
 from eth_validator_watcher_ext import MetricsByLabel
 from .config import Config
+from .notifications import SlackDispatcher
 from .utils import LABEL_SCOPE_WATCHED, SLOT_FOR_MISSED_ATTESTATIONS_PROCESS
 from .watched_validators import WatchedValidators
 
@@ -37,19 +37,13 @@ def beaconcha_slot_link(cfg: Config, slot: int) -> str:
     return f'<https://{cfg.network}.beaconcha.in/slot/{slot}|{slot}>'
 
 
-def slack_send(cfg: Config, msg: str) -> None:
-    """Attempts to send a message to the configured slack channel."""
-    if not (cfg.slack_channel and cfg.slack_token):
-        return
+def slack_send(slack: Optional[SlackDispatcher], msg: str) -> None:
+    """Queues a message for the configured slack channel, if any."""
+    if slack is not None:
+        slack.send(msg)
 
-    try:
-        w = WebClient(token=cfg.slack_token)
-        w.chat_postMessage(channel=cfg.slack_channel, text=msg)
-    except SlackApiError as e:
-        logging.warning(f'😿 Unable to send slack notification: {e.response["error"]}')
 
-
-def log_single_entry(cfg: Config, validator: str, registry: WatchedValidators, msg: str, emoji: str, slot: int, color: str) -> None:
+def log_single_entry(cfg: Config, validator: str, registry: WatchedValidators, msg: str, emoji: str, slot: int, color: str, slack: Optional[SlackDispatcher] = None) -> None:
     """Logs a single validator entry.
     """
     v = registry.get_validator_by_pubkey(validator)
@@ -66,10 +60,10 @@ def log_single_entry(cfg: Config, validator: str, registry: WatchedValidators, m
     logging.info(msg_shell)
 
     msg_slack = f'{emoji} Validator {beaconcha_validator_link(cfg, validator)}{label_msg_slack} {msg} on slot {beaconcha_slot_link(cfg, slot)}'
-    slack_send(cfg, msg_slack)
+    slack_send(slack, msg_slack)
 
 
-def log_multiple_entries(cfg: Config, validators: list[str], registry: WatchedValidators, msg: str, emoji: str, color: str) -> None:
+def log_multiple_entries(cfg: Config, validators: list[str], registry: WatchedValidators, msg: str, emoji: str, color: str, slack: Optional[SlackDispatcher] = None) -> None:
     """Logs a multiple validator entries.
     """
 
@@ -94,11 +88,12 @@ def log_multiple_entries(cfg: Config, validators: list[str], registry: WatchedVa
 
     msg_validators_slack = f'{", ".join([beaconcha_validator_link(cfg, v) for v in validators])} and more'
     msg_slack = f'{emoji} Validator(s) {msg_validators_slack}{label_msg_slack} {msg}'
-    slack_send(cfg, msg_slack)
+    slack_send(slack, msg_slack)
 
 
-def log_details(cfg: Config, registry: WatchedValidators, metrics: MetricsByLabel, current_slot: int):
-    """Log details about watched validators
+def log_details(cfg: Config, registry: WatchedValidators, metrics: MetricsByLabel, current_slot: int, slack: Optional[SlackDispatcher] = None):
+    """Log details about watched validators, notifications are queued
+    on the slack dispatcher if set.
     """
     m = metrics.get(LABEL_SCOPE_WATCHED)
     if not m:
@@ -107,18 +102,18 @@ def log_details(cfg: Config, registry: WatchedValidators, metrics: MetricsByLabe
     for slot, validator in m.details_future_blocks:
         # Only log once per epoch future block proposals.
         if current_slot % 32 == 0 and slot >= current_slot + 32:
-            log_single_entry(cfg, validator, registry, f'will propose a block', '🙏', slot, COLOR_GREEN)
+            log_single_entry(cfg, validator, registry, f'will propose a block', '🙏', slot, COLOR_GREEN, slack)
 
     for slot, validator in m.details_proposed_blocks:
-        log_single_entry(cfg, validator, registry, f'proposed a block', '🏅', slot, COLOR_BOLD_GREEN)
+        log_single_entry(cfg, validator, registry, f'proposed a block', '🏅', slot, COLOR_BOLD_GREEN, slack)
 
     for slot, validator in m.details_missed_blocks:
-        log_single_entry(cfg, validator, registry, f'likely missed a block', '😩', slot, COLOR_RED)
+        log_single_entry(cfg, validator, registry, f'likely missed a block', '😩', slot, COLOR_RED, slack)
 
     for slot, validator in m.details_missed_blocks_finalized:
-        log_single_entry(cfg, validator, registry, f'missed a block for real', '😭', slot, COLOR_BOLD_RED)
+        log_single_entry(cfg, validator, registry, f'missed a block for real', '😭', slot, COLOR_BOLD_RED, slack)
 
     if m.details_missed_attestations:
         # Only log once per epoch future block proposals.
         if current_slot % 32 == SLOT_FOR_MISSED_ATTESTATIONS_PROCESS:
-            log_multiple_entries(cfg, m.details_missed_attestations, registry, f'missed an attestation', '😞', COLOR_YELLOW)
+            log_multiple_entries(cfg, m.details_missed_attestations, registry, f'missed an attestation', '😞', COLOR_YELLOW, slack)
@@ -1,22 +1,119 @@
 import logging
 import os
+import threading
+import time
 
 from collections import defaultdict
 from dataclasses import dataclass, field
 from itertools import batched
+from typing import Iterator
 
-from prometheus_client import Counter, Gauge
+from prometheus_client import REGISTRY, Counter, Gauge
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
 
-from eth_validator_watcher_ext import fast_compute_validator_metrics, MetricsByLabel
+from eth_validator_watcher_ext import MetricsByLabel, WorkerPool, verify_validator_metrics
 
-from .utils import LABEL_SCOPE_WATCHED
-from .watched_validators import WatchedValidator
+from .models import Validators
+from .utils import LABEL_SCOPE_WATCHED, pct
+from .watched_validators import WatchedValidators
 
 
 # This is global because Prometheus metrics don't support registration
 # multiple times. This is a workaround for unit tests.
 _metrics = None
 
+# Gauges by scope: name, documentation and value from the metrics of
+# the scope.
+_SCOPE_GAUGES = [
+    ("eth_suboptimal_sources_rate", "Suboptimal sources rate sampled every epoch", lambda m: pct(m.suboptimal_source_count, m.optimal_source_count)),
+    ("eth_suboptimal_targets_rate", "Suboptimal targets rate sampled every epoch", lambda m: pct(m.suboptimal_target_count, m.optimal_target_count)),
+    ("eth_suboptimal_heads_rate", "Suboptimal heads rate sampled every epoch", lambda m: pct(m.suboptimal_head_count, m.optimal_head_count)),
+    ("eth_ideal_consensus_rewards_gwei", "Ideal consensus rewards sampled every epoch", lambda m: m.ideal_consensus_reward),
+    ("eth_actual_consensus_rewards_gwei", "Actual consensus rewards sampled every epoch", lambda m: m.actual_consensus_reward),
+    ("eth_consensus_rewards_rate", "Consensus rewards rate sampled every epoch", lambda m: pct(m.actual_consensus_reward, m.ideal_consensus_reward, True)),
+    ("eth_missed_attestations", "Missed attestations in the last epoch", lambda m: m.missed_attestations),
+    ("eth_missed_consecutive_attestations", "Missed consecutive attestations in the last two epochs", lambda m: m.missed_consecutive_attestations),
+    ("eth_slashed_validators", "Slashed validators", lambda m: m.validator_slashes),
+    ("eth_future_block_proposals", "Future block proposals", lambda m: m.future_blocks_proposal),
+]
+
+# Counters by scope: name, documentation and increment from the
+# metrics of the scope, which are reset once reported.
+_SCOPE_COUNTERS = [
+    ("eth_block_proposals_head_total", "Total block proposals at head", lambda m: m.proposed_blocks),
+    ("eth_missed_block_proposals_head_total", "Total missed block proposals at head", lambda m: m.missed_blocks),
+    ("eth_block_proposals_finalized_total", "Total finalized block proposals", lambda m: m.proposed_blocks_finalized),
+    ("eth_missed_block_proposals_finalized_total", "Total missed finalized block proposals", lambda m: m.missed_blocks_finalized),
+]
+
+
+class ValidatorMetricsCollector(Collector):
+    """Exposes the metrics of the validators by scope.
+
+    The latest snapshot of the metrics is kept and rendered on scrape,
+    instead of setting each metric of each scope on every slot: the
+    cost of a slot doesn't depend on the number of labels anymore, and
+    the cost of a scrape doesn't depend on how often slots are
+    processed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Latest metrics by (scope, network).
+        self._gauges: dict[tuple[str, str], MetricsByLabel] = {}
+        # Running totals by (scope, network), kept for scopes which
+        # went away as counters never go backward.
+        self._counters: dict[tuple[str, str], list[int]] = {}
+        self._created: dict[tuple[str, str], float] = {}
+
+    def update(self, network: str, metrics: dict[str, MetricsByLabel]) -> None:
+        """Replace the snapshot with the metrics of a slot.
+
+        Parameters:
+        network: Name of the network
+        metrics: Metrics of the slot by scope
+        """
+        with self._lock:
+            self._gauges = {(label, network): m for label, m in metrics.items()}
+            for key, m in self._gauges.items():
+                counters = self._counters.get(key)
+                if counters is None:
+                    counters = self._counters[key] = [0] * len(_SCOPE_COUNTERS)
+                    self._created[key] = time.time()
+                for i, (_, _, value) in enumerate(_SCOPE_COUNTERS):
+                    counters[i] += value(m)
+
+    def describe(self) -> Iterator[Metric]:
+        yield GaugeMetricFamily("eth_validator_status_count", "Validator status count sampled every epoch", labels=['scope', 'status', 'network'])
+        for name, documentation, _ in _SCOPE_GAUGES:
+            yield GaugeMetricFamily(name, documentation, labels=['scope', 'network'])
+        for name, documentation, _ in _SCOPE_COUNTERS:
+            yield CounterMetricFamily(name, documentation, labels=['scope', 'network'])
+
+    def collect(self) -> Iterator[Metric]:
+        with self._lock:
+            gauges = self._gauges
+            counters = {key: (list(values), self._created[key]) for key, values in self._counters.items()}
+
+        status_count = GaugeMetricFamily("eth_validator_status_count", "Validator status count sampled every epoch", labels=['scope', 'status', 'network'])
+        for (label, network), m in gauges.items():
+            for status in Validators.DataItem.StatusEnum:
+                status_count.add_metric([label, status, network], m.validator_status_count.get(status, 0))
+        yield status_count
+
+        for name, documentation, value in _SCOPE_GAUGES:
+            family = GaugeMetricFamily(name, documentation, labels=['scope', 'network'])
+            for key, m in gauges.items():
+                family.add_metric(list(key), value(m))
+            yield family
+
+        for i, (name, documentation, _) in enumerate(_SCOPE_COUNTERS):
+            family = CounterMetricFamily(name, documentation, labels=['scope', 'network'])
+            for key, (values, created) in counters.items():
+                family.add_metric(list(key), values[i], created=created)
+            yield family
+
 
 @dataclass
 class PrometheusMetrics:
@@ -26,39 +123,36 @@ class PrometheusMetrics:
     eth_epoch: Gauge
     eth_current_price_dollars: Gauge
 
-    eth_validator_status_count: Gauge
-    eth_suboptimal_sources_rate: Gauge
-    eth_suboptimal_targets_rate: Gauge
-    eth_suboptimal_heads_rate: Gauge
-    eth_consensus_rewards_rate: Gauge
-    eth_ideal_consensus_rewards_gwei: Gauge
-    eth_actual_consensus_rewards_gwei: Gauge
-    eth_missed_attestations_count: Gauge
-    eth_missed_consecutive_attestations_count: Gauge
-    eth_slashed_validators_count: Gauge
-    
-    eth_block_proposals_head_total: Counter
-    eth_missed_block_proposals_head_total: Counter
-    eth_block_proposals_finalized_total: Counter
-    eth_missed_block_proposals_finalized_total: Counter
+    validators: ValidatorMetricsCollector
+
+    eth_slack_queue_depth: Gauge
+    eth_slack_dropped_messages_total: Counter
 
-    eth_future_block_proposals: Gauge
 
+def compute_validator_metrics(validators: WatchedValidators, slot: int, pool: WorkerPool, verify: bool = False) -> dict[str, MetricsByLabel]:
+    """Compute the metrics from the registry of validators.
 
-def compute_validator_metrics(validators: dict[int, WatchedValidator], slot: int) -> dict[str, MetricsByLabel]:
-    """Compute the metrics from a list of validators.
+    The registry keeps running totals per set of labels which are
+    updated as validators change, so this does not walk the whole
+    validator set unless `verify` is set.
 
     Parameters:
-    validators: list[WatchedValidator]
+    validators: WatchedValidators
+    slot: int
+    pool: Worker pool used to run the full recomputation
+    verify: Cross-check the running totals against a full recomputation
 
     Returns:
     dict[str, MetricsByLabel]
     """
     logging.info(f"📊 Computing metrics for {len(validators)} validators")
-    metrics = fast_compute_validator_metrics(validators)
-    
-    for _, v in validators.items():
-        v.reset_blocks()
+    registry = validators.get_registry()
+
+    if verify and not verify_validator_metrics(registry, pool):
+        logging.warning(f"⚠️ Running metrics diverged from a full recomputation at slot {slot}, rebuilt them")
+
+    metrics = registry.metrics()
+    registry.reset_all_blocks()
 
     return metrics
                 
@@ -78,22 +172,11 @@ def get_prometheus_metrics() -> PrometheusMetrics:
             eth_epoch=Gauge("eth_epoch", "Current epoch", ["network"]),
             eth_current_price_dollars=Gauge("eth_current_price_dollars", "Current price of ETH in USD", ["network"]),
 
-            eth_validator_status_count=Gauge("eth_validator_status_count", "Validator status count sampled every epoch", ['scope', 'status', 'network']),
-            eth_suboptimal_sources_rate=Gauge("eth_suboptimal_sources_rate", "Suboptimal sources rate sampled every epoch", ['scope', 'network']),
-            eth_suboptimal_targets_rate=Gauge("eth_suboptimal_targets_rate", "Suboptimal targets rate sampled every epoch", ['scope', 'network']),
-            eth_suboptimal_heads_rate=Gauge("eth_suboptimal_heads_rate", "Suboptimal heads rate sampled every epoch", ['scope', 'network']),
-            eth_ideal_consensus_rewards_gwei=Gauge("eth_ideal_consensus_rewards_gwei", "Ideal consensus rewards sampled every epoch", ['scope', 'network']),
-            eth_actual_consensus_rewards_gwei=Gauge("eth_actual_consensus_rewards_gwei", "Actual consensus rewards sampled every epoch", ['scope', 'network']),
-            eth_consensus_rewards_rate=Gauge("eth_consensus_rewards_rate", "Consensus rewards rate sampled every epoch", ['scope', 'network']),
-            eth_missed_attestations_count=Gauge("eth_missed_attestations", "Missed attestations in the last epoch", ['scope', 'network']),
-            eth_missed_consecutive_attestations_count=Gauge("eth_missed_consecutive_attestations", "Missed consecutive attestations in the last two epochs", ['scope', 'network']),
-            eth_slashed_validators_count=Gauge("eth_slashed_validators", "Slashed validators", ['scope', 'network']),
-
-            eth_block_proposals_head_total=Counter("eth_block_proposals_head_total", "Total block proposals at head", ['scope', 'network']),
-            eth_missed_block_proposals_head_total=Counter("eth_missed_block_proposals_head_total", "Total missed block proposals at head", ['scope', 'network']),
-            eth_block_proposals_finalized_total=Counter("eth_block_proposals_finalized_total", "Total finalized block proposals", ['scope', 'network']),
-            eth_missed_block_proposals_finalized_total=Counter("eth_missed_block_proposals_finalized_total", "Total missed finalized block proposals", ['scope', 'network']),
-            eth_future_block_proposals=Gauge("eth_future_block_proposals", "Future block proposals", ['scope', 'network'])
+            validators=ValidatorMetricsCollector(),
+
+            eth_slack_queue_depth=Gauge("eth_slack_queue_depth", "Slack notifications waiting to be posted", ["network"]),
+            eth_slack_dropped_messages_total=Counter("eth_slack_dropped_messages_total", "Slack notifications dropped", ["network"]),
         )
+        REGISTRY.register(_metrics.validators)
 
     return _metrics
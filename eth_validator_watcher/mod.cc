@@ -1,6 +1,18 @@
+#include <algorithm>
+#include <array>
+#include <condition_variable>
+#include <cstring>
+#include <functional>
 #include <iostream>
-#include <vector>
+#include <map>
+#include <mutex>
+#include <set>
+#include <stdexcept>
+#include <string_view>
 #include <thread>
+#include <type_traits>
+#include <unordered_map>
+#include <vector>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 
@@ -11,35 +23,85 @@ static constexpr char kLogLabel[] = "scope:watched";
 
 using float64_t = double;
 
-// Flat structure to allow stupid simple conversions to Python without
-// having too-many levels of mental indirections. Processing is shared
-// between python (convenience) and cpp (fast).
-struct Validator {
-  // Updated data from the config processing
-  std::vector<std::string> labels;
-
-  // Updated data from the rewards processing
-  bool missed_attestation = false;
-  bool previous_missed_attestation = false;
-  bool suboptimal_source = false;
-  bool suboptimal_target = false;
-  bool suboptimal_head = false;
-  float64_t ideal_consensus_reward = 0;
-  float64_t actual_consensus_reward = 0;
+// Validator statuses as exposed by the beacon API, the position in
+// this array is the value stored in the registry status column.
+static constexpr std::size_t kStatusCount = 9;
+static const std::array<std::string, kStatusCount> kStatuses = {
+  "pending_initialized",
+  "pending_queued",
+  "active_ongoing",
+  "active_exiting",
+  "active_slashed",
+  "exited_unslashed",
+  "exited_slashed",
+  "withdrawal_possible",
+  "withdrawal_done",
+};
+
+// Whether a status (by position) is one of the active ones.
+static const std::array<bool, kStatusCount> kActiveStatuses = [] {
+  std::array<bool, kStatusCount> active;
+  for (std::size_t i = 0; i < kStatusCount; i++) {
+    active[i] = kStatuses[i].find("active") != std::string::npos;
+  }
+  return active;
+}();
+
+// Position of a status in kStatuses.
+static uint8_t status_id(const std::string &status) {
+  static const std::unordered_map<std::string, uint8_t> ids = [] {
+    std::unordered_map<std::string, uint8_t> ids;
+    for (std::size_t i = 0; i < kStatuses.size(); i++) {
+      ids[kStatuses[i]] = i;
+    }
+    return ids;
+  }();
+
+  auto it = ids.find(status);
+  if (it == ids.end()) {
+    throw std::invalid_argument("unknown validator status: " + status);
+  }
+  return it->second;
+}
 
-  // Updated data from the blocks processing
+static constexpr std::size_t kPubkeySize = 48;
+
+// Integers are little-endian, as are the platforms we run on.
+static uint64_t read_uint64(const uint8_t *src) {
+  uint64_t value;
+  std::memcpy(&value, src, sizeof(value));
+  return value;
+}
+
+static uint32_t read_uint32(const uint8_t *src) {
+  uint32_t value;
+  std::memcpy(&value, src, sizeof(value));
+  return value;
+}
+
+// Bits of the registry flags column.
+static constexpr uint8_t kMissedAttestation = 1 << 0;
+static constexpr uint8_t kPreviousMissedAttestation = 1 << 1;
+static constexpr uint8_t kSuboptimalSource = 1 << 2;
+static constexpr uint8_t kSuboptimalTarget = 1 << 3;
+static constexpr uint8_t kSuboptimalHead = 1 << 4;
+
+enum class BlockEvent {
+  kProposed,
+  kMissed,
+  kProposedFinalized,
+  kMissedFinalized,
+  kFuture,
+};
+
+// Block events are rare (a handful of validators per slot), they are
+// kept in a side table instead of in columns.
+struct BlockEvents {
   std::vector<uint64_t> missed_blocks;
   std::vector<uint64_t> missed_blocks_finalized;
   std::vector<uint64_t> proposed_blocks;
   std::vector<uint64_t> proposed_blocks_finalized;
   std::vector<uint64_t> future_blocks_proposal;
-
-  // Updated data from the beacon state processing
-  std::string consensus_pubkey;
-  uint64_t consensus_effective_balance = 0;
-  bool consensus_slashed = false;
-  uint64_t consensus_index = 0;
-  std::string consensus_status;
 };
 
 // Same, flat structure approach. This is used to aggregate data from
@@ -75,138 +137,1289 @@ struct MetricsByLabel {
 
 namespace {
 
-  void process_details(const std::string &validator, std::vector<uint64_t> slots, std::vector<std::pair<uint64_t, std::string>> *out) {
-    for (const auto& slot: slots) {
+  template <typename T>
+  void append_details(const std::vector<T> &details, std::vector<T> *out) {
+    for (const auto& detail: details) {
       if (out->size() >= kMaxLogging) {
         break;
       }
-      out->push_back({slot, validator});
+      out->push_back(detail);
     }
   }
-  
-  void process(std::size_t from, std::size_t to, const std::vector<Validator> &vals, std::map<std::string, MetricsByLabel> &out) {
-    for (std::size_t i = from; i < to; i++) {
-      auto &v = vals[i];
 
-      for (const auto& label: v.labels) {
-        MetricsByLabel & m = out[label];
+} // anonymous namespace
+
+// Same metrics as MetricsByLabel but keyed by integers (status,
+// validator index) instead of strings, this is what is computed in
+// the innermost loop for each set of labels. Details hold the index
+// of validators, with the slot for blocks.
+struct Aggregate {
+  std::array<uint64_t, kStatusCount> validator_status_count{};
+
+  uint64_t suboptimal_source_count = 0;
+  uint64_t suboptimal_target_count = 0;
+  uint64_t suboptimal_head_count = 0;
+  uint64_t optimal_source_count = 0;
+  uint64_t optimal_target_count = 0;
+  uint64_t optimal_head_count = 0;
+  uint64_t validator_slashes = 0;
+
+  int64_t ideal_consensus_reward = 0;
+  int64_t actual_consensus_reward = 0;
+  uint64_t missed_attestations = 0;
+  uint64_t missed_consecutive_attestations = 0;
+
+  uint64_t proposed_blocks = 0;
+  uint64_t missed_blocks = 0;
+  uint64_t proposed_blocks_finalized = 0;
+  uint64_t missed_blocks_finalized = 0;
+  uint64_t future_blocks_proposal = 0;
+
+  std::vector<std::pair<uint64_t, uint64_t>> details_proposed_blocks;
+  std::vector<std::pair<uint64_t, uint64_t>> details_missed_blocks;
+  std::vector<std::pair<uint64_t, uint64_t>> details_missed_blocks_finalized;
+  std::vector<std::pair<uint64_t, uint64_t>> details_future_blocks;
+  std::vector<uint64_t> details_missed_attestations;
+
+  bool empty() const {
+    for (auto count: validator_status_count) {
+      if (count) {
+        return false;
+      }
+    }
+    return true;
+  }
+
+  bool same_counters(const Aggregate &other) const {
+    return validator_status_count == other.validator_status_count &&
+      suboptimal_source_count == other.suboptimal_source_count &&
+      suboptimal_target_count == other.suboptimal_target_count &&
+      suboptimal_head_count == other.suboptimal_head_count &&
+      optimal_source_count == other.optimal_source_count &&
+      optimal_target_count == other.optimal_target_count &&
+      optimal_head_count == other.optimal_head_count &&
+      validator_slashes == other.validator_slashes &&
+      ideal_consensus_reward == other.ideal_consensus_reward &&
+      actual_consensus_reward == other.actual_consensus_reward &&
+      missed_attestations == other.missed_attestations &&
+      missed_consecutive_attestations == other.missed_consecutive_attestations &&
+      proposed_blocks == other.proposed_blocks &&
+      missed_blocks == other.missed_blocks &&
+      proposed_blocks_finalized == other.proposed_blocks_finalized &&
+      missed_blocks_finalized == other.missed_blocks_finalized &&
+      future_blocks_proposal == other.future_blocks_proposal;
+  }
+
+  // Adds the metrics of validators with higher indexes.
+  void merge(const Aggregate &other) {
+    for (std::size_t i = 0; i < kStatusCount; i++) {
+      validator_status_count[i] += other.validator_status_count[i];
+    }
+
+    suboptimal_source_count += other.suboptimal_source_count;
+    suboptimal_target_count += other.suboptimal_target_count;
+    suboptimal_head_count += other.suboptimal_head_count;
+    optimal_source_count += other.optimal_source_count;
+    optimal_target_count += other.optimal_target_count;
+    optimal_head_count += other.optimal_head_count;
+    validator_slashes += other.validator_slashes;
+
+    ideal_consensus_reward += other.ideal_consensus_reward;
+    actual_consensus_reward += other.actual_consensus_reward;
+    missed_attestations += other.missed_attestations;
+    missed_consecutive_attestations += other.missed_consecutive_attestations;
+
+    proposed_blocks += other.proposed_blocks;
+    missed_blocks += other.missed_blocks;
+    proposed_blocks_finalized += other.proposed_blocks_finalized;
+    missed_blocks_finalized += other.missed_blocks_finalized;
+    future_blocks_proposal += other.future_blocks_proposal;
+
+    append_details(other.details_proposed_blocks, &details_proposed_blocks);
+    append_details(other.details_missed_blocks, &details_missed_blocks);
+    append_details(other.details_missed_blocks_finalized, &details_missed_blocks_finalized);
+    append_details(other.details_future_blocks, &details_future_blocks);
+    append_details(other.details_missed_attestations, &details_missed_attestations);
+  }
+};
+
+// Hash of a public key: mixes all the 8-bytes words of the key so
+// we don't depend on keys being uniformly distributed.
+struct PubkeyHash {
+  std::size_t operator()(const std::array<uint8_t, kPubkeySize> &pubkey) const {
+    uint64_t h = 0;
+    for (std::size_t i = 0; i < kPubkeySize; i += sizeof(uint64_t)) {
+      uint64_t word;
+      std::memcpy(&word, pubkey.data() + i, sizeof(word));
+      // Murmur3 finalizer.
+      h ^= word;
+      h ^= h >> 33;
+      h *= 0xff51afd7ed558ccdULL;
+      h ^= h >> 33;
+      h *= 0xc4ceb9fe1a85ec53ULL;
+      h ^= h >> 33;
+    }
+    return h;
+  }
+};
+
+// Long-lived pool of threads used for the metrics computation.
+//
+// Spawning threads on each slot is wasteful and std::thread's
+// hardware_concurrency() ignores container CPU quotas, so the pool is
+// created once from Python with an explicit size.
+class WorkerPool {
+ public:
+  explicit WorkerPool(std::size_t size) {
+    size = std::max<std::size_t>(size, 1);
+    for (std::size_t i = 0; i < size; i++) {
+      threads_.emplace_back([this] { work(); });
+    }
+  }
+
+  ~WorkerPool() {
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      stop_ = true;
+    }
+    wakeup_.notify_all();
+    for (auto& thread: threads_) {
+      thread.join();
+    }
+  }
+
+  std::size_t size() const { return threads_.size(); }
+
+  // Runs fn(0) ... fn(n - 1) on the pool and waits for completion.
+  void run(std::size_t n, const std::function<void(std::size_t)> &fn) {
+    std::lock_guard<std::mutex> run_lock(run_mutex_);
+    std::unique_lock<std::mutex> lock(mutex_);
+    fn_ = &fn;
+    next_ = 0;
+    total_ = n;
+    pending_ = n;
+    wakeup_.notify_all();
+    done_.wait(lock, [this] { return pending_ == 0; });
+    fn_ = nullptr;
+  }
+
+ private:
+  void work() {
+    std::unique_lock<std::mutex> lock(mutex_);
+    while (true) {
+      wakeup_.wait(lock, [this] { return stop_ || next_ < total_; });
+      if (stop_) {
+        return;
+      }
+      std::size_t task = next_++;
+      const auto *fn = fn_;
+      lock.unlock();
+      (*fn)(task);
+      lock.lock();
+      if (--pending_ == 0) {
+        done_.notify_all();
+      }
+    }
+  }
+
+  std::vector<std::thread> threads_;
+  std::mutex run_mutex_;
+  std::mutex mutex_;
+  std::condition_variable wakeup_;
+  std::condition_variable done_;
+  const std::function<void(std::size_t)> *fn_ = nullptr;
+  std::size_t next_ = 0;
+  std::size_t total_ = 0;
+  std::size_t pending_ = 0;
+  bool stop_ = false;
+};
+
+// Columns which can be moved through a flat buffer, i.e: shared
+// memory between processes. Each column is laid out as its number of
+// elements followed by its raw data. Derived classes list their
+// columns in a static columns(self, fn) method.
+template <typename Derived>
+class FlatColumns {
+ public:
+  std::size_t nbytes() const {
+    std::size_t n = 0;
+    Derived::columns(self(), [&n](const auto &column) {
+      n += sizeof(uint64_t) + column.size() * sizeof(column[0]);
+    });
+    return n;
+  }
+
+  void dump(py::buffer buffer) const {
+    py::buffer_info info = buffer.request(true);
+    if (static_cast<std::size_t>(info.size * info.itemsize) < nbytes()) {
+      throw std::invalid_argument("buffer too small");
+    }
+    uint8_t *dst = static_cast<uint8_t *>(info.ptr);
+    Derived::columns(self(), [&dst](const auto &column) {
+      uint64_t count = column.size();
+      std::memcpy(dst, &count, sizeof(count));
+      dst += sizeof(count);
+      std::memcpy(dst, column.data(), count * sizeof(column[0]));
+      dst += count * sizeof(column[0]);
+    });
+  }
+
+  static Derived load(py::buffer buffer) {
+    py::buffer_info info = buffer.request();
+    const uint8_t *src = static_cast<const uint8_t *>(info.ptr);
+    const uint8_t *end = src + info.size * info.itemsize;
+
+    Derived out;
+    Derived::columns(out, [&src, end](auto &column) {
+      using T = typename std::decay_t<decltype(column)>::value_type;
+      uint64_t count;
+      if (static_cast<std::size_t>(end - src) < sizeof(count)) {
+        throw std::invalid_argument("truncated columns");
+      }
+      std::memcpy(&count, src, sizeof(count));
+      src += sizeof(count);
+      if (static_cast<std::size_t>(end - src) / sizeof(T) < count) {
+        throw std::invalid_argument("truncated columns");
+      }
+      column.resize(count);
+      std::memcpy(column.data(), src, count * sizeof(T));
+      src += count * sizeof(T);
+    });
+    if (!out.consistent()) {
+      throw std::invalid_argument("inconsistent columns");
+    }
+    return out;
+  }
+
+ private:
+  const Derived &self() const { return static_cast<const Derived &>(*this); }
+};
+
+// Validator set of an epoch, loaded in columns ahead of time (i.e:
+// from a background thread or another process) so that it can be
+// applied to the registry in one go.
+class EpochValidators : public FlatColumns<EpochValidators> {
+ public:
+  void append(uint64_t index, const py::bytes &pubkey, uint64_t effective_balance, bool slashed, const std::string &status) {
+    std::string_view view(pubkey);
+    if (view.size() != kPubkeySize) {
+      throw std::invalid_argument("invalid public key size");
+    }
+    indexes_.push_back(index);
+    pubkeys_.insert(pubkeys_.end(), view.begin(), view.end());
+    effective_balance_.push_back(effective_balance);
+    slashed_.push_back(slashed);
+    status_.push_back(status_id(status));
+  }
+
+  // Appends the validators of another set.
+  void extend(const EpochValidators &other) {
+    indexes_.insert(indexes_.end(), other.indexes_.begin(), other.indexes_.end());
+    pubkeys_.insert(pubkeys_.end(), other.pubkeys_.begin(), other.pubkeys_.end());
+    effective_balance_.insert(effective_balance_.end(), other.effective_balance_.begin(), other.effective_balance_.end());
+    slashed_.insert(slashed_.end(), other.slashed_.begin(), other.slashed_.end());
+    status_.insert(status_.end(), other.status_.begin(), other.status_.end());
+  }
+
+  // Indexes of the validators, only the active ones if active_only
+  // is set.
+  std::vector<uint64_t> indexes(bool active_only) const {
+    std::vector<uint64_t> out;
+    out.reserve(indexes_.size());
+    for (std::size_t i = 0; i < indexes_.size(); i++) {
+      if (!active_only || kActiveStatuses[status_[i]]) {
+        out.push_back(indexes_[i]);
+      }
+    }
+    return out;
+  }
+
+  std::size_t size() const { return indexes_.size(); }
+
+ private:
+  friend class Registry;
+  friend class FlatColumns<EpochValidators>;
+
+  template <typename Self, typename F>
+  static void columns(Self &self, F fn) {
+    fn(self.indexes_);
+    fn(self.pubkeys_);
+    fn(self.effective_balance_);
+    fn(self.slashed_);
+    fn(self.status_);
+  }
+
+  bool consistent() const {
+    std::size_t n = size();
+    return pubkeys_.size() == n * kPubkeySize && effective_balance_.size() == n && slashed_.size() == n
+      && status_.size() == n && std::all_of(status_.begin(), status_.end(), [](uint8_t s) { return s < kStatusCount; });
+  }
+
+  std::vector<uint64_t> indexes_;
+  std::vector<uint8_t> pubkeys_;
+  std::vector<uint64_t> effective_balance_;
+  std::vector<uint8_t> slashed_;
+  std::vector<uint8_t> status_;
+};
+
+// Attestation rewards of an epoch: the ideal rewards by effective
+// balance and the actual rewards by validator index.
+class EpochRewards : public FlatColumns<EpochRewards> {
+ public:
+  void append_ideal(uint64_t effective_balance, int64_t source, int64_t target, int64_t head) {
+    ideal_effective_balance_.push_back(effective_balance);
+    ideal_source_.push_back(source);
+    ideal_target_.push_back(target);
+    ideal_head_.push_back(head);
+  }
+
+  void append(uint64_t index, int64_t source, int64_t target, int64_t head) {
+    indexes_.push_back(index);
+    source_.push_back(source);
+    target_.push_back(target);
+    head_.push_back(head);
+  }
+
+  std::size_t size() const { return indexes_.size(); }
+
+ private:
+  friend class Registry;
+  friend class FlatColumns<EpochRewards>;
+
+  template <typename Self, typename F>
+  static void columns(Self &self, F fn) {
+    fn(self.ideal_effective_balance_);
+    fn(self.ideal_source_);
+    fn(self.ideal_target_);
+    fn(self.ideal_head_);
+    fn(self.indexes_);
+    fn(self.source_);
+    fn(self.target_);
+    fn(self.head_);
+  }
+
+  bool consistent() const {
+    std::size_t ideal = ideal_effective_balance_.size();
+    std::size_t n = size();
+    return ideal_source_.size() == ideal && ideal_target_.size() == ideal && ideal_head_.size() == ideal
+      && source_.size() == n && target_.size() == n && head_.size() == n;
+  }
+
+  std::vector<uint64_t> ideal_effective_balance_;
+  std::vector<int64_t> ideal_source_;
+  std::vector<int64_t> ideal_target_;
+  std::vector<int64_t> ideal_head_;
+  std::vector<uint64_t> indexes_;
+  std::vector<int64_t> source_;
+  std::vector<int64_t> target_;
+  std::vector<int64_t> head_;
+};
+
+// Liveness of validators for an epoch.
+class EpochLiveness : public FlatColumns<EpochLiveness> {
+ public:
+  void append(uint64_t index, bool is_live) {
+    indexes_.push_back(index);
+    is_live_.push_back(is_live);
+  }
+
+  void extend(const EpochLiveness &other) {
+    indexes_.insert(indexes_.end(), other.indexes_.begin(), other.indexes_.end());
+    is_live_.insert(is_live_.end(), other.is_live_.begin(), other.is_live_.end());
+  }
+
+  std::size_t size() const { return indexes_.size(); }
+
+ private:
+  friend class Registry;
+  friend class FlatColumns<EpochLiveness>;
+
+  template <typename Self, typename F>
+  static void columns(Self &self, F fn) {
+    fn(self.indexes_);
+    fn(self.is_live_);
+  }
+
+  bool consistent() const {
+    return is_live_.size() == indexes_.size();
+  }
+
+  std::vector<uint64_t> indexes_;
+  std::vector<uint8_t> is_live_;
+};
+
+// What the registry knows of the validators, to warm start the
+// watcher from disk. Labels come from the configuration and block
+// events are reported on each slot, neither is part of it.
+class RegistryState : public FlatColumns<RegistryState> {
+ public:
+  std::size_t size() const {
+    return std::count(present_.begin(), present_.end(), 1);
+  }
+
+ private:
+  friend class Registry;
+  friend class FlatColumns<RegistryState>;
+
+  template <typename Self, typename F>
+  static void columns(Self &self, F fn) {
+    fn(self.present_);
+    fn(self.pubkeys_);
+    fn(self.effective_balance_);
+    fn(self.status_);
+    fn(self.slashed_);
+    fn(self.flags_);
+    fn(self.ideal_reward_);
+    fn(self.actual_reward_);
+  }
+
+  bool consistent() const {
+    const std::size_t n = present_.size();
+    if (pubkeys_.size() != n * kPubkeySize || effective_balance_.size() != n || status_.size() != n ||
+        slashed_.size() != n || flags_.size() != n || ideal_reward_.size() != n || actual_reward_.size() != n) {
+      return false;
+    }
+    return std::all_of(present_.begin(), present_.end(), [](uint8_t present) { return present <= 1; }) &&
+      std::all_of(status_.begin(), status_.end(), [](uint8_t status) { return status < kStatusCount; });
+  }
+
+  std::vector<uint8_t> present_;
+  std::vector<uint8_t> pubkeys_;
+  std::vector<uint64_t> effective_balance_;
+  std::vector<uint8_t> status_;
+  std::vector<uint8_t> slashed_;
+  std::vector<uint8_t> flags_;
+  std::vector<int64_t> ideal_reward_;
+  std::vector<int64_t> actual_reward_;
+};
+
+// Struct-of-arrays holding the state of all validators of the
+// network, indexed by validator index. With ~1 million validators,
+// per-validator objects (and their Python counterparts) dominate the
+// memory usage, columns keep it compact.
+//
+// The registry also keeps running aggregates by set of labels: each
+// modification removes the contribution of the validator before
+// applying it and adds it back afterwards. Most slots only see a
+// handful of block events, so metrics can be produced without going
+// over all validators.
+class Registry {
+ public:
+  explicit Registry(std::vector<std::string> default_labels) {
+    default_label_set_ = intern_label_set(default_labels);
+  }
+
+  std::size_t size() const { return count_; }
+
+  bool has(uint64_t index) const {
+    return index < present_.size() && present_[index];
+  }
+
+  std::vector<uint64_t> indexes() const {
+    std::vector<uint64_t> out;
+    out.reserve(count_);
+    for (std::size_t i = 0; i < present_.size(); i++) {
+      if (present_[i]) {
+        out.push_back(i);
+      }
+    }
+    return out;
+  }
+
+  // Indexes of the validators having the label, only the active ones
+  // if active_only is set.
+  std::vector<uint64_t> indexes_with_label(const std::string &label, bool active_only) const {
+    std::vector<uint64_t> out;
+    auto it = label_ids_.find(label);
+    if (it == label_ids_.end()) {
+      return out;
+    }
+
+    std::vector<bool> matches(label_sets_.size());
+    for (std::size_t set = 0; set < label_sets_.size(); set++) {
+      const auto &ids = label_sets_[set];
+      matches[set] = std::find(ids.begin(), ids.end(), it->second) != ids.end();
+    }
+
+    for (std::size_t i = 0; i < present_.size(); i++) {
+      if (present_[i] && matches[label_set_[i]] && (!active_only || kActiveStatuses[status_[i]])) {
+        out.push_back(i);
+      }
+    }
+    return out;
+  }
+
+  int64_t find(const py::bytes &pubkey) const {
+    std::string_view view(pubkey);
+    if (view.size() != kPubkeySize) {
+      return -1;
+    }
+    std::array<uint8_t, kPubkeySize> key;
+    std::memcpy(key.data(), view.data(), kPubkeySize);
+    auto it = pubkey_to_index_.find(key);
+    if (it == pubkey_to_index_.end()) {
+      return -1;
+    }
+    return it->second;
+  }
+
+  void set_epoch(uint64_t index, const py::bytes &pubkey, uint64_t effective_balance, bool slashed, const std::string &status) {
+    std::string_view view(pubkey);
+    if (view.size() != kPubkeySize) {
+      throw std::invalid_argument("invalid public key size");
+    }
+    set_epoch(index, reinterpret_cast<const uint8_t *>(view.data()), effective_balance, slashed, status_id(status));
+  }
+
+  // Applies the validator set of an epoch at once.
+  void set_epoch_all(const EpochValidators &validators) {
+    for (std::size_t i = 0; i < validators.size(); i++) {
+      set_epoch(validators.indexes_[i], &validators.pubkeys_[i * kPubkeySize],
+                validators.effective_balance_[i], validators.slashed_[i], validators.status_[i]);
+    }
+  }
+
+  void set_epoch(uint64_t index, const uint8_t *pubkey, uint64_t effective_balance, bool slashed, uint8_t status) {
+    if (index >= present_.size()) {
+      resize(index + 1);
+    }
+    bool added = !present_[index];
+    if (added) {
+      present_[index] = 1;
+      label_set_[index] = default_label_set_;
+      count_++;
+    } else {
+      contribute(index, -1);
+    }
+
+    uint8_t *dst = &pubkeys_[index * kPubkeySize];
+    if (added || std::memcmp(dst, pubkey, kPubkeySize) != 0) {
+      std::array<uint8_t, kPubkeySize> key;
+      std::memcpy(key.data(), pubkey, kPubkeySize);
+      pubkey_to_index_[key] = index;
+      std::memcpy(dst, pubkey, kPubkeySize);
+    }
+
+    effective_balance_[index] = effective_balance;
+    slashed_[index] = slashed;
+    status_[index] = status;
+
+    contribute(index, 1);
+  }
+
+  void set_labels(uint64_t index, const std::vector<std::string> &labels) {
+    check(index);
+    uint32_t label_set = intern_label_set(labels);
+    contribute(index, -1);
+    label_set_[index] = label_set;
+    contribute(index, 1);
+  }
+
+  // Labels the validators of a compiled watched keys index (see
+  // keys_index.py): keys are 48 bytes each and the labels of the i-th
+  // key are label_ids[offsets[i]:offsets[i + 1]], as positions in
+  // labels. Listed validators get the prefix labels followed by their
+  // own, validators having watched_label which are not listed anymore
+  // get the default labels back.
+  //
+  // Returns the number of keys which are not in the registry.
+  uint64_t apply_watched_keys(const py::buffer &pubkeys, const py::buffer &offsets, const py::buffer &label_ids,
+                              const std::vector<std::string> &labels, const std::vector<std::string> &prefix,
+                              const std::string &watched_label) {
+    py::buffer_info keys_info = pubkeys.request();
+    py::buffer_info offsets_info = offsets.request();
+    py::buffer_info ids_info = label_ids.request();
+    const std::size_t keys_size = keys_info.size * keys_info.itemsize;
+    const std::size_t offsets_size = offsets_info.size * offsets_info.itemsize;
+    const std::size_t ids_count = ids_info.size * ids_info.itemsize / sizeof(uint32_t);
+    const std::size_t count = keys_size / kPubkeySize;
+    if (keys_size % kPubkeySize != 0 || (count > 0 && offsets_size != (count + 1) * sizeof(uint64_t))) {
+      throw std::invalid_argument("inconsistent watched keys index");
+    }
+    const uint8_t *keys = static_cast<const uint8_t *>(keys_info.ptr);
+    const uint8_t *offs = static_cast<const uint8_t *>(offsets_info.ptr);
+    const uint8_t *ids = static_cast<const uint8_t *>(ids_info.ptr);
+
+    // Most validators share a handful of label lists.
+    std::map<std::vector<uint32_t>, uint32_t> label_set_by_ids;
+    std::vector<uint8_t> listed(present_.size());
+    uint64_t missing = 0;
 
-        m.validator_status_count[v.consensus_status] += 1;
+    for (std::size_t i = 0; i < count; i++) {
+      std::array<uint8_t, kPubkeySize> key;
+      std::memcpy(key.data(), keys + i * kPubkeySize, kPubkeySize);
+      auto it = pubkey_to_index_.find(key);
+      if (it == pubkey_to_index_.end()) {
+        missing++;
+        continue;
+      }
+      const uint64_t index = it->second;
+      listed[index] = 1;
 
-        m.validator_slashes += (v.consensus_slashed == true);
+      const uint64_t begin = read_uint64(offs + i * sizeof(uint64_t));
+      const uint64_t end = read_uint64(offs + (i + 1) * sizeof(uint64_t));
+      if (begin > end || end > ids_count) {
+        throw std::invalid_argument("inconsistent watched keys index");
+      }
+      std::vector<uint32_t> positions;
+      positions.reserve(end - begin);
+      for (uint64_t j = begin; j < end; j++) {
+        positions.push_back(read_uint32(ids + j * sizeof(uint32_t)));
+      }
 
-        // Everything below implies to have a validator that is active
-        // on the beacon chain, this prevents miscounting missed
-        // attestation for instance.
-        if (v.consensus_status.find("active") == std::string::npos) {
-          continue;
+      uint32_t label_set;
+      auto cached = label_set_by_ids.find(positions);
+      if (cached != label_set_by_ids.end()) {
+        label_set = cached->second;
+      } else {
+        std::vector<std::string> names = prefix;
+        for (uint32_t position: positions) {
+          if (position >= labels.size()) {
+            throw std::invalid_argument("inconsistent watched keys index");
+          }
+          names.push_back(labels[position]);
         }
+        label_set = intern_label_set(names);
+        label_set_by_ids[positions] = label_set;
+      }
+
+      if (label_set_[index] != label_set) {
+        contribute(index, -1);
+        label_set_[index] = label_set;
+        contribute(index, 1);
+      }
+    }
 
-        m.suboptimal_source_count += int(v.suboptimal_source == true);
-        m.suboptimal_target_count += int(v.suboptimal_target == true);
-        m.suboptimal_head_count += int(v.suboptimal_head == true);
-        m.optimal_source_count += int(v.suboptimal_source == false);
-        m.optimal_target_count += int(v.suboptimal_target == false);
-        m.optimal_head_count += int(v.suboptimal_head == false);
-
-        m.ideal_consensus_reward += v.ideal_consensus_reward;
-        m.actual_consensus_reward += v.actual_consensus_reward;
-
-        m.missed_attestations += int(v.missed_attestation == true);
-        m.missed_consecutive_attestations += int(v.previous_missed_attestation == true);
-
-        m.proposed_blocks += v.proposed_blocks.size();
-        m.missed_blocks += v.missed_blocks.size();
-        m.proposed_blocks_finalized += v.proposed_blocks_finalized.size();
-        m.missed_blocks_finalized += v.missed_blocks_finalized.size();
-        m.future_blocks_proposal += v.future_blocks_proposal.size();
-
-        process_details(v.consensus_pubkey, v.proposed_blocks, &m.details_proposed_blocks);
-        process_details(v.consensus_pubkey, v.missed_blocks, &m.details_missed_blocks);
-        process_details(v.consensus_pubkey, v.missed_blocks_finalized, &m.details_missed_blocks_finalized);
-        process_details(v.consensus_pubkey, v.future_blocks_proposal, &m.details_future_blocks);
-        if (v.missed_attestation && m.details_missed_attestations.size() < kMaxLogging) {
-          m.details_missed_attestations.push_back(v.consensus_pubkey);
+    auto watched = label_ids_.find(watched_label);
+    if (watched != label_ids_.end()) {
+      std::vector<bool> matches(label_sets_.size());
+      for (std::size_t set = 0; set < label_sets_.size(); set++) {
+        const auto &set_ids = label_sets_[set];
+        matches[set] = std::find(set_ids.begin(), set_ids.end(), watched->second) != set_ids.end();
+      }
+      for (std::size_t i = 0; i < present_.size(); i++) {
+        if (present_[i] && !listed[i] && matches[label_set_[i]]) {
+          contribute(i, -1);
+          label_set_[i] = default_label_set_;
+          contribute(i, 1);
         }
       }
     }
+
+    return missing;
   }
 
-  void merge_details(const std::vector<std::pair<uint64_t, std::string>> &details, std::vector<std::pair<uint64_t, std::string>> *out) {
-    for (const auto& detail: details) {
-      if (out->size() >= kMaxLogging) {
+  void set_liveness(uint64_t index, bool is_live) {
+    check(index);
+    contribute(index, -1);
+    uint8_t &flags = flags_[index];
+    flags = set_flag(flags, kPreviousMissedAttestation, flags & kMissedAttestation);
+    flags = set_flag(flags, kMissedAttestation, !is_live);
+    contribute(index, 1);
+  }
+
+  void set_rewards(uint64_t index, bool suboptimal_source, bool suboptimal_target, bool suboptimal_head, int64_t ideal_reward, int64_t actual_reward) {
+    check(index);
+    contribute(index, -1);
+    uint8_t &flags = flags_[index];
+    flags = set_flag(flags, kSuboptimalSource, suboptimal_source);
+    flags = set_flag(flags, kSuboptimalTarget, suboptimal_target);
+    flags = set_flag(flags, kSuboptimalHead, suboptimal_head);
+    ideal_reward_[index] = ideal_reward;
+    actual_reward_[index] = actual_reward;
+    contribute(index, 1);
+  }
+
+  // Applies the liveness of an epoch at once, unknown validators are
+  // ignored.
+  void set_liveness_all(const EpochLiveness &liveness) {
+    for (std::size_t i = 0; i < liveness.size(); i++) {
+      if (has(liveness.indexes_[i])) {
+        set_liveness(liveness.indexes_[i], liveness.is_live_[i]);
+      }
+    }
+  }
+
+  // Applies the rewards of an epoch at once, unknown validators and
+  // validators without an ideal reward for their effective balance
+  // are ignored.
+  void set_rewards_all(const EpochRewards &rewards) {
+    std::unordered_map<uint64_t, std::size_t> ideal_by_effective_balance;
+    for (std::size_t i = 0; i < rewards.ideal_effective_balance_.size(); i++) {
+      ideal_by_effective_balance[rewards.ideal_effective_balance_[i]] = i;
+    }
+
+    for (std::size_t i = 0; i < rewards.size(); i++) {
+      uint64_t index = rewards.indexes_[i];
+      if (!has(index)) {
+        continue;
+      }
+      auto it = ideal_by_effective_balance.find(effective_balance_[index]);
+      if (it == ideal_by_effective_balance.end()) {
+        continue;
+      }
+      std::size_t ideal = it->second;
+      set_rewards(
+        index,
+        rewards.source_[i] != rewards.ideal_source_[ideal],
+        rewards.target_[i] != rewards.ideal_target_[ideal],
+        rewards.head_[i] != rewards.ideal_head_[ideal],
+        rewards.ideal_source_[ideal] + rewards.ideal_target_[ideal] + rewards.ideal_head_[ideal],
+        rewards.source_[i] + rewards.target_[i] + rewards.head_[i]);
+    }
+  }
+
+  void add_block_event(uint64_t index, BlockEvent event, uint64_t slot) {
+    check(index);
+    contribute(index, -1);
+    BlockEvents &blocks = blocks_[index];
+    switch (event) {
+    case BlockEvent::kProposed: blocks.proposed_blocks.push_back(slot); break;
+    case BlockEvent::kMissed: blocks.missed_blocks.push_back(slot); break;
+    case BlockEvent::kProposedFinalized: blocks.proposed_blocks_finalized.push_back(slot); break;
+    case BlockEvent::kMissedFinalized: blocks.missed_blocks_finalized.push_back(slot); break;
+    case BlockEvent::kFuture: blocks.future_blocks_proposal.push_back(slot); break;
+    }
+    contribute(index, 1);
+  }
+
+  void reset_blocks(uint64_t index) {
+    if (blocks_.count(index) == 0) {
+      return;
+    }
+    contribute(index, -1);
+    blocks_.erase(index);
+    contribute(index, 1);
+  }
+
+  // Clears the block events of all validators, only the validators
+  // which had events are touched.
+  void reset_all_blocks() {
+    std::vector<uint64_t> indexes;
+    indexes.reserve(blocks_.size());
+    for (const auto& [index, _]: blocks_) {
+      indexes.push_back(index);
+    }
+    for (auto index: indexes) {
+      reset_blocks(index);
+    }
+  }
+
+  RegistryState state() const {
+    RegistryState out;
+    out.present_ = present_;
+    out.pubkeys_ = pubkeys_;
+    out.effective_balance_ = effective_balance_;
+    out.status_ = status_;
+    out.slashed_ = slashed_;
+    out.flags_ = flags_;
+    out.ideal_reward_ = ideal_reward_;
+    out.actual_reward_ = actual_reward_;
+    return out;
+  }
+
+  // Loads a state into an empty registry, validators get the default
+  // labels.
+  void restore(const RegistryState &state) {
+    if (count_ != 0) {
+      throw std::invalid_argument("registry is not empty");
+    }
+    resize(state.present_.size());
+    present_ = state.present_;
+    pubkeys_ = state.pubkeys_;
+    effective_balance_ = state.effective_balance_;
+    status_ = state.status_;
+    slashed_ = state.slashed_;
+    flags_ = state.flags_;
+    ideal_reward_ = state.ideal_reward_;
+    actual_reward_ = state.actual_reward_;
+
+    pubkey_to_index_.reserve(state.size());
+    for (std::size_t i = 0; i < present_.size(); i++) {
+      if (!present_[i]) {
+        continue;
+      }
+      std::array<uint8_t, kPubkeySize> key;
+      std::memcpy(key.data(), &pubkeys_[i * kPubkeySize], kPubkeySize);
+      pubkey_to_index_[key] = i;
+      count_++;
+      contribute(i, 1);
+    }
+  }
+
+  uint64_t effective_balance(uint64_t index) const {
+    check(index);
+    return effective_balance_[index];
+  }
+
+  std::vector<std::string> labels(uint64_t index) const {
+    check(index);
+    std::vector<std::string> out;
+    for (auto id: label_sets_[label_set_[index]]) {
+      out.push_back(labels_[id]);
+    }
+    return out;
+  }
+
+  std::string pubkey(uint64_t index) const {
+    check(index);
+    return pubkey_hex(index);
+  }
+
+  // Number of index slots in the columns (i.e: highest index + 1).
+  std::size_t capacity() const { return present_.size(); }
+
+  // Aggregate validators with an index in [from, to) by set of
+  // labels, out is indexed by label set identifier. This reads the
+  // columns in place and does not touch Python objects so it can run
+  // from multiple threads without the GIL, as long as the registry
+  // isn't modified in the meantime.
+  void aggregate(std::size_t from, std::size_t to, std::vector<Aggregate> &out) const {
+    out.resize(label_sets_.size());
+
+    for (std::size_t i = from; i < to; i++) {
+      if (!present_[i]) {
+        continue;
+      }
+
+      Aggregate &m = out[label_set_[i]];
+      const BlockEvents *blocks = accumulate(i, 1, m);
+
+      if (!kActiveStatuses[status_[i]]) {
+        continue;
+      }
+
+      if ((flags_[i] & kMissedAttestation) && m.details_missed_attestations.size() < kMaxLogging) {
+        m.details_missed_attestations.push_back(i);
+      }
+
+      if (blocks != nullptr) {
+        add_block_details(i, *blocks, m);
+      }
+    }
+  }
+
+  // Metrics from the running aggregates, this only goes over the
+  // validators needed for the details (block events and the first
+  // validators which missed an attestation).
+  std::map<std::string, MetricsByLabel> metrics() const {
+    std::vector<Aggregate> by_label_set = totals_;
+
+    for (std::size_t set = 0; set < missed_attestations_.size(); set++) {
+      auto &details = by_label_set[set].details_missed_attestations;
+      for (auto it = missed_attestations_[set].begin(); it != missed_attestations_[set].end() && details.size() < kMaxLogging; ++it) {
+        details.push_back(*it);
+      }
+    }
+
+    std::vector<uint64_t> indexes;
+    indexes.reserve(blocks_.size());
+    for (const auto& [index, _]: blocks_) {
+      indexes.push_back(index);
+    }
+    std::sort(indexes.begin(), indexes.end());
+    for (auto index: indexes) {
+      if (kActiveStatuses[status_[index]]) {
+        add_block_details(index, blocks_.at(index), by_label_set[label_set_[index]]);
+      }
+    }
+
+    return metrics_by_label(by_label_set);
+  }
+
+  // Compares the running aggregates with aggregates computed from
+  // scratch, resynchronizes them if they diverge.
+  bool verify(const std::vector<Aggregate> &by_label_set) {
+    bool same = true;
+    for (std::size_t set = 0; set < totals_.size(); set++) {
+      const Aggregate empty;
+      const Aggregate &expected = set < by_label_set.size() ? by_label_set[set] : empty;
+      if (!totals_[set].same_counters(expected)) {
+        same = false;
         break;
       }
-      out->push_back(detail);
     }
+    if (same) {
+      return true;
+    }
+
+    for (auto &totals: totals_) {
+      totals = Aggregate();
+    }
+    for (auto &missed: missed_attestations_) {
+      missed.clear();
+    }
+    for (std::size_t i = 0; i < present_.size(); i++) {
+      if (present_[i]) {
+        contribute(i, 1);
+      }
+    }
+    return false;
   }
 
-  void merge(const std::vector<std::map<std::string, MetricsByLabel>> &thread_metrics, std::map<std::string, MetricsByLabel> *out) {
-    for (const auto& thread_metric: thread_metrics) {
-      for (const auto& [label, metric]: thread_metric) {
-        MetricsByLabel & m = (*out)[label];
+  // Converts aggregates by set of labels to metrics by label. There
+  // are only a few hundred sets of labels so this is cheap compared to
+  // the aggregation.
+  std::map<std::string, MetricsByLabel> metrics_by_label(const std::vector<Aggregate> &by_label_set) const {
+    std::vector<Aggregate> by_label(labels_.size());
+    std::vector<bool> seen(labels_.size(), false);
+
+    for (std::size_t set = 0; set < by_label_set.size(); set++) {
+      const Aggregate &a = by_label_set[set];
+      if (a.empty()) {
+        continue;
+      }
+      for (auto id: label_sets_[set]) {
+        by_label[id].merge(a);
+        seen[id] = true;
+      }
+    }
+
+    std::map<std::string, MetricsByLabel> out;
+    for (std::size_t id = 0; id < labels_.size(); id++) {
+      if (!seen[id]) {
+        continue;
+      }
+
+      Aggregate &a = by_label[id];
+      MetricsByLabel &m = out[labels_[id]];
 
-        for (const auto& [status, count]: metric.validator_status_count) {
-          m.validator_status_count[status] += count;
+      for (std::size_t status = 0; status < kStatusCount; status++) {
+        if (a.validator_status_count[status]) {
+          m.validator_status_count[kStatuses[status]] = a.validator_status_count[status];
         }
+      }
+
+      m.suboptimal_source_count = a.suboptimal_source_count;
+      m.suboptimal_target_count = a.suboptimal_target_count;
+      m.suboptimal_head_count = a.suboptimal_head_count;
+      m.optimal_source_count = a.optimal_source_count;
+      m.optimal_target_count = a.optimal_target_count;
+      m.optimal_head_count = a.optimal_head_count;
+      m.validator_slashes = a.validator_slashes;
+
+      m.ideal_consensus_reward = a.ideal_consensus_reward;
+      m.actual_consensus_reward = a.actual_consensus_reward;
+      m.missed_attestations = a.missed_attestations;
+      m.missed_consecutive_attestations = a.missed_consecutive_attestations;
+
+      m.proposed_blocks = a.proposed_blocks;
+      m.missed_blocks = a.missed_blocks;
+      m.proposed_blocks_finalized = a.proposed_blocks_finalized;
+      m.missed_blocks_finalized = a.missed_blocks_finalized;
+      m.future_blocks_proposal = a.future_blocks_proposal;
+
+      // Details of a label come from several sets of labels, keep
+      // the ones of the validators with the lowest indexes.
+      block_details(a.details_proposed_blocks, &m.details_proposed_blocks);
+      block_details(a.details_missed_blocks, &m.details_missed_blocks);
+      block_details(a.details_missed_blocks_finalized, &m.details_missed_blocks_finalized);
+      block_details(a.details_future_blocks, &m.details_future_blocks);
+
+      std::stable_sort(a.details_missed_attestations.begin(), a.details_missed_attestations.end());
+      for (std::size_t i = 0; i < a.details_missed_attestations.size() && i < kMaxLogging; i++) {
+        m.details_missed_attestations.push_back(pubkey_hex(a.details_missed_attestations[i]));
+      }
+    }
+
+    return out;
+  }
+
+ private:
+  static uint8_t set_flag(uint8_t flags, uint8_t flag, bool value) {
+    return value ? (flags | flag) : (flags & ~flag);
+  }
+
+  // Adds (d = 1) or removes (d = -1, wraps around) the counters of
+  // a validator to an aggregate. Returns its block events if it is
+  // active and has some.
+  const BlockEvents *accumulate(uint64_t i, uint64_t d, Aggregate &m) const {
+    const uint8_t status = status_[i];
+
+    m.validator_status_count[status] += d;
+
+    m.validator_slashes += d * (slashed_[i] != 0);
+
+    // Everything below implies to have a validator that is active
+    // on the beacon chain, this prevents miscounting missed
+    // attestation for instance.
+    if (!kActiveStatuses[status]) {
+      return nullptr;
+    }
+
+    const uint8_t flags = flags_[i];
+
+    m.suboptimal_source_count += d * ((flags & kSuboptimalSource) != 0);
+    m.suboptimal_target_count += d * ((flags & kSuboptimalTarget) != 0);
+    m.suboptimal_head_count += d * ((flags & kSuboptimalHead) != 0);
+    m.optimal_source_count += d * ((flags & kSuboptimalSource) == 0);
+    m.optimal_target_count += d * ((flags & kSuboptimalTarget) == 0);
+    m.optimal_head_count += d * ((flags & kSuboptimalHead) == 0);
+
+    m.ideal_consensus_reward += static_cast<int64_t>(d) * ideal_reward_[i];
+    m.actual_consensus_reward += static_cast<int64_t>(d) * actual_reward_[i];
+
+    m.missed_attestations += d * ((flags & kMissedAttestation) != 0);
+    m.missed_consecutive_attestations += d * ((flags & kPreviousMissedAttestation) != 0);
+
+    if (blocks_.empty()) {
+      return nullptr;
+    }
+    auto it = blocks_.find(i);
+    if (it == blocks_.end()) {
+      return nullptr;
+    }
+    const BlockEvents &blocks = it->second;
+
+    m.proposed_blocks += d * blocks.proposed_blocks.size();
+    m.missed_blocks += d * blocks.missed_blocks.size();
+    m.proposed_blocks_finalized += d * blocks.proposed_blocks_finalized.size();
+    m.missed_blocks_finalized += d * blocks.missed_blocks_finalized.size();
+    m.future_blocks_proposal += d * blocks.future_blocks_proposal.size();
+
+    return &blocks;
+  }
+
+  // Updates the running aggregates with the contribution of a
+  // validator, sign is 1 to add it and -1 to remove it.
+  void contribute(uint64_t index, int sign) {
+    accumulate(index, static_cast<uint64_t>(static_cast<int64_t>(sign)), totals_[label_set_[index]]);
+
+    if (kActiveStatuses[status_[index]] && (flags_[index] & kMissedAttestation)) {
+      if (sign > 0) {
+        missed_attestations_[label_set_[index]].insert(index);
+      } else {
+        missed_attestations_[label_set_[index]].erase(index);
+      }
+    }
+  }
+
+  static void add_details(uint64_t index, const std::vector<uint64_t> &slots, std::vector<std::pair<uint64_t, uint64_t>> *out) {
+    for (const auto& slot: slots) {
+      if (out->size() >= kMaxLogging) {
+        break;
+      }
+      out->push_back({index, slot});
+    }
+  }
+
+  static void add_block_details(uint64_t index, const BlockEvents &blocks, Aggregate &m) {
+    add_details(index, blocks.proposed_blocks, &m.details_proposed_blocks);
+    add_details(index, blocks.missed_blocks, &m.details_missed_blocks);
+    add_details(index, blocks.missed_blocks_finalized, &m.details_missed_blocks_finalized);
+    add_details(index, blocks.future_blocks_proposal, &m.details_future_blocks);
+  }
+
+  void block_details(std::vector<std::pair<uint64_t, uint64_t>> &details, std::vector<std::pair<uint64_t, std::string>> *out) const {
+    std::stable_sort(details.begin(), details.end(), [](const auto &a, const auto &b) {
+      return a.first < b.first;
+    });
+    for (std::size_t i = 0; i < details.size() && i < kMaxLogging; i++) {
+      out->push_back({details[i].second, pubkey_hex(details[i].first)});
+    }
+  }
+
+  void check(uint64_t index) const {
+    if (!has(index)) {
+      throw py::index_error("unknown validator index " + std::to_string(index));
+    }
+  }
+
+  void resize(std::size_t n) {
+    present_.resize(n, 0);
+    pubkeys_.resize(n * kPubkeySize, 0);
+    effective_balance_.resize(n, 0);
+    status_.resize(n, 0);
+    slashed_.resize(n, 0);
+    flags_.resize(n, 0);
+    ideal_reward_.resize(n, 0);
+    actual_reward_.resize(n, 0);
+    label_set_.resize(n, default_label_set_);
+  }
+
+  uint32_t intern_label(const std::string &label) {
+    auto it = label_ids_.find(label);
+    if (it != label_ids_.end()) {
+      return it->second;
+    }
+    uint32_t id = labels_.size();
+    labels_.push_back(label);
+    label_ids_[label] = id;
+    return id;
+  }
 
-        m.suboptimal_source_count += metric.suboptimal_source_count;
-        m.suboptimal_target_count += metric.suboptimal_target_count;
-        m.suboptimal_head_count += metric.suboptimal_head_count;
-        m.optimal_source_count += metric.optimal_source_count;
-        m.optimal_target_count += metric.optimal_target_count;
-        m.optimal_head_count += metric.optimal_head_count;
-        m.validator_slashes += metric.validator_slashes;
-
-        m.ideal_consensus_reward += metric.ideal_consensus_reward;
-        m.actual_consensus_reward += metric.actual_consensus_reward;
-        m.missed_attestations += metric.missed_attestations;
-        m.missed_consecutive_attestations += metric.missed_consecutive_attestations;
-
-        m.proposed_blocks += metric.proposed_blocks;
-        m.missed_blocks += metric.missed_blocks;
-        m.proposed_blocks_finalized += metric.proposed_blocks_finalized;
-        m.missed_blocks_finalized += metric.missed_blocks_finalized;
-        m.future_blocks_proposal += metric.future_blocks_proposal;
-
-        merge_details(metric.details_proposed_blocks, &m.details_proposed_blocks);
-        merge_details(metric.details_missed_blocks, &m.details_missed_blocks);
-        merge_details(metric.details_missed_blocks_finalized, &m.details_missed_blocks_finalized);
-        merge_details(metric.details_future_blocks, &m.details_future_blocks);
-
-        for (const auto& missed_attestation: metric.details_missed_attestations) {
-          if (m.details_missed_attestations.size() < kMaxLogging) {
-            m.details_missed_attestations.push_back(missed_attestation);
+  uint32_t intern_label_set(const std::vector<std::string> &labels) {
+    std::vector<uint32_t> ids;
+    ids.reserve(labels.size());
+    for (const auto& label: labels) {
+      ids.push_back(intern_label(label));
+    }
+
+    auto it = label_set_ids_.find(ids);
+    if (it != label_set_ids_.end()) {
+      return it->second;
+    }
+    uint32_t id = label_sets_.size();
+    label_sets_.push_back(ids);
+    label_set_ids_[ids] = id;
+    totals_.emplace_back();
+    missed_attestations_.emplace_back();
+    return id;
+  }
+
+  std::string pubkey_hex(uint64_t index) const {
+    static constexpr char kHex[] = "0123456789abcdef";
+    std::string out = "0x";
+    out.reserve(2 + 2 * kPubkeySize);
+    const uint8_t *src = &pubkeys_[index * kPubkeySize];
+    for (std::size_t i = 0; i < kPubkeySize; i++) {
+      out.push_back(kHex[src[i] >> 4]);
+      out.push_back(kHex[src[i] & 0xf]);
+    }
+    return out;
+  }
+
+  std::size_t count_ = 0;
+
+  // Columns, indexed by validator index.
+  std::vector<uint8_t> present_;
+  std::vector<uint8_t> pubkeys_;
+  std::vector<uint64_t> effective_balance_;
+  std::vector<uint8_t> status_;
+  std::vector<uint8_t> slashed_;
+  std::vector<uint8_t> flags_;
+  std::vector<int64_t> ideal_reward_;
+  std::vector<int64_t> actual_reward_;
+  std::vector<uint32_t> label_set_;
+
+  // Labels are interned to small integers, and most validators
+  // share the same labels so we only store an identifier of their
+  // set of labels.
+  std::vector<std::string> labels_;
+  std::unordered_map<std::string, uint32_t> label_ids_;
+  uint32_t default_label_set_ = 0;
+  std::vector<std::vector<uint32_t>> label_sets_;
+  std::map<std::vector<uint32_t>, uint32_t> label_set_ids_;
+
+  // Running aggregates by set of labels (without details), and the
+  // active validators which missed an attestation so that details
+  // are available without a full pass.
+  std::vector<Aggregate> totals_;
+  std::vector<std::set<uint64_t>> missed_attestations_;
+
+  std::unordered_map<std::array<uint8_t, kPubkeySize>, uint64_t, PubkeyHash> pubkey_to_index_;
+  std::unordered_map<uint64_t, BlockEvents> blocks_;
+};
+
+namespace {
+
+  // Merges partitions pairwise on the pool, the result ends up in the
+  // first partition. Partitions are merged in order so that details
+  // are the same as with a sequential merge.
+  void tree_merge(WorkerPool &pool, std::vector<std::vector<Aggregate>> &partitions) {
+    for (std::size_t step = 1; step < partitions.size(); step *= 2) {
+      std::size_t pairs = (partitions.size() + 2 * step - 1) / (2 * step);
+      pool.run(pairs, [step, &partitions](std::size_t pair) {
+        std::size_t into = pair * 2 * step;
+        std::size_t from = into + step;
+        if (from < partitions.size()) {
+          auto &out = partitions[into];
+          out.resize(std::max(out.size(), partitions[from].size()));
+          for (std::size_t set = 0; set < partitions[from].size(); set++) {
+            out[set].merge(partitions[from][set]);
           }
         }
-      }
+      });
     }
   }
 
+  // Aggregates all validators of the registry by set of labels, from
+  // scratch. Must be called without the GIL.
+  std::vector<Aggregate> compute_aggregates(const Registry &registry, WorkerPool &pool) {
+    std::size_t n = pool.size();
+    std::size_t chunk = (registry.capacity() / n) + 1;
+    std::vector<std::vector<Aggregate>> partitions(n);
+
+    pool.run(n, [chunk, &registry, &partitions](std::size_t i) {
+      std::size_t from = std::min(i * chunk, registry.capacity());
+      std::size_t to = std::min(from + chunk, registry.capacity());
+      registry.aggregate(from, to, partitions[i]);
+    });
+
+    tree_merge(pool, partitions);
+    return std::move(partitions[0]);
+  }
+
 } // anonymous namespace
 
 PYBIND11_MODULE(eth_validator_watcher_ext, m) {
 
-  py::class_<Validator>(m, "Validator")
+  py::enum_<BlockEvent>(m, "BlockEvent")
+    .value("PROPOSED", BlockEvent::kProposed)
+    .value("MISSED", BlockEvent::kMissed)
+    .value("PROPOSED_FINALIZED", BlockEvent::kProposedFinalized)
+    .value("MISSED_FINALIZED", BlockEvent::kMissedFinalized)
+    .value("FUTURE", BlockEvent::kFuture);
+
+  py::class_<EpochValidators>(m, "EpochValidators")
+    .def(py::init<>())
+    .def("__len__", &EpochValidators::size)
+    .def("append", &EpochValidators::append)
+    .def("extend", &EpochValidators::extend)
+    .def("indexes", &EpochValidators::indexes, py::arg("active_only") = false)
+    .def("nbytes", &EpochValidators::nbytes)
+    .def("dump", &EpochValidators::dump)
+    .def_static("load", &EpochValidators::load);
+
+  py::class_<EpochRewards>(m, "EpochRewards")
+    .def(py::init<>())
+    .def("__len__", &EpochRewards::size)
+    .def("append_ideal", &EpochRewards::append_ideal)
+    .def("append", &EpochRewards::append)
+    .def("nbytes", &EpochRewards::nbytes)
+    .def("dump", &EpochRewards::dump)
+    .def_static("load", &EpochRewards::load);
+
+  py::class_<EpochLiveness>(m, "EpochLiveness")
     .def(py::init<>())
-    .def_readwrite("labels", &Validator::labels)
-    .def_readwrite("missed_attestation", &Validator::missed_attestation)
-    .def_readwrite("previous_missed_attestation", &Validator::previous_missed_attestation)
-    .def_readwrite("suboptimal_source", &Validator::suboptimal_source)
-    .def_readwrite("suboptimal_target", &Validator::suboptimal_target)
-    .def_readwrite("suboptimal_head", &Validator::suboptimal_head)
-    .def_readwrite("ideal_consensus_reward", &Validator::ideal_consensus_reward)
-    .def_readwrite("actual_consensus_reward", &Validator::actual_consensus_reward)
-    .def_readwrite("missed_blocks", &Validator::missed_blocks)
-    .def_readwrite("missed_blocks_finalized", &Validator::missed_blocks_finalized)
-    .def_readwrite("proposed_blocks", &Validator::proposed_blocks)
-    .def_readwrite("proposed_blocks_finalized", &Validator::proposed_blocks_finalized)
-    .def_readwrite("future_blocks_proposal", &Validator::future_blocks_proposal)
-    .def_readwrite("consensus_pubkey", &Validator::consensus_pubkey)
-    .def_readwrite("consensus_effective_balance", &Validator::consensus_effective_balance)
-    .def_readwrite("consensus_slashed", &Validator::consensus_slashed)
-    .def_readwrite("consensus_index", &Validator::consensus_index)
-    .def_readwrite("consensus_status", &Validator::consensus_status);
+    .def("__len__", &EpochLiveness::size)
+    .def("append", &EpochLiveness::append)
+    .def("extend", &EpochLiveness::extend)
+    .def("nbytes", &EpochLiveness::nbytes)
+    .def("dump", &EpochLiveness::dump)
+    .def_static("load", &EpochLiveness::load);
+
+  py::class_<RegistryState>(m, "RegistryState")
+    .def(py::init<>())
+    .def("__len__", &RegistryState::size)
+    .def("nbytes", &RegistryState::nbytes)
+    .def("dump", &RegistryState::dump)
+    .def_static("load", &RegistryState::load);
+
+  py::class_<Registry>(m, "Registry")
+    .def(py::init<std::vector<std::string>>())
+    .def("__len__", &Registry::size)
+    .def("has", &Registry::has)
+    .def("indexes", &Registry::indexes)
+    .def("indexes_with_label", &Registry::indexes_with_label, py::arg("label"), py::arg("active_only") = false)
+    .def("apply_watched_keys", &Registry::apply_watched_keys)
+    .def("find", &Registry::find)
+    .def("set_epoch", py::overload_cast<uint64_t, const py::bytes &, uint64_t, bool, const std::string &>(&Registry::set_epoch))
+    .def("set_epoch_all", &Registry::set_epoch_all)
+    .def("set_liveness_all", &Registry::set_liveness_all)
+    .def("set_rewards_all", &Registry::set_rewards_all)
+    .def("set_labels", &Registry::set_labels)
+    .def("set_liveness", &Registry::set_liveness)
+    .def("set_rewards", &Registry::set_rewards)
+    .def("add_block_event", &Registry::add_block_event)
+    .def("reset_blocks", &Registry::reset_blocks)
+    .def("reset_all_blocks", &Registry::reset_all_blocks)
+    .def("state", &Registry::state)
+    .def("restore", &Registry::restore)
+    .def("metrics", &Registry::metrics)
+    .def("effective_balance", &Registry::effective_balance)
+    .def("labels", &Registry::labels)
+    .def("pubkey", &Registry::pubkey);
 
   py::class_<MetricsByLabel>(m, "MetricsByLabel")
     .def(py::init<>())
@@ -233,39 +1446,30 @@ PYBIND11_MODULE(eth_validator_watcher_ext, m) {
     .def_readwrite("details_future_blocks", &MetricsByLabel::details_future_blocks)
     .def_readwrite("details_missed_attestations", &MetricsByLabel::details_missed_attestations);
     
-  m.def("fast_compute_validator_metrics", [](const py::dict& pyvals) {
-    std::vector<Validator> vals;
-    vals.reserve(pyvals.size());
-    for (auto& pyval: pyvals) {
-      vals.push_back(pyval.second.attr("_v").cast<Validator>());
-    }
-
-    auto n = std::thread::hardware_concurrency();
-
-    std::size_t chunk = (vals.size() / n) + 1;
-    std::vector<std::thread> threads;
-    std::vector<std::map<std::string, MetricsByLabel>> thread_metrics(n);
+  py::class_<WorkerPool>(m, "WorkerPool")
+    .def(py::init<std::size_t>())
+    .def("size", &WorkerPool::size);
 
-    for (size_t i = 0; i < n; i++) {
-      threads.push_back(std::thread([i, chunk, &vals, &thread_metrics] {
-        std::size_t from = i * chunk;
-        std::size_t to = std::min(from + chunk, vals.size());
-        process(from, to, vals, thread_metrics[i]);
-      }));
-    }
+  m.def("fast_compute_validator_metrics", [](const Registry& registry, WorkerPool& pool) {
+    std::map<std::string, MetricsByLabel> metrics;
 
-    for (auto& thread: threads) {
-      thread.join();
+    {
+      // Aggregation only reads the registry columns, no need to hold
+      // the GIL which would freeze the Prometheus HTTP server.
+      py::gil_scoped_release release;
+      metrics = registry.metrics_by_label(compute_aggregates(registry, pool));
     }
 
-    std::map<std::string, MetricsByLabel> metrics;
-    merge(thread_metrics, &metrics);
-
     py::dict pymetrics;
     for (const auto& [label, metric]: metrics) {
       pymetrics[py::str(label)] = metric;
     }
- 
+
     return pymetrics;
   });
+
+  m.def("verify_validator_metrics", [](Registry& registry, WorkerPool& pool) {
+    py::gil_scoped_release release;
+    return registry.verify(compute_aggregates(registry, pool));
+  });
 }
@@ -1,6 +1,7 @@
 """Contains the models for the validator watcher."""
 
 from enum import StrEnum
+from typing import NamedTuple
 
 from pydantic import BaseModel
 
@@ -31,6 +32,19 @@ class Validators(BaseModel):
     data: list[DataItem]
 
 
+class ValidatorRecord(NamedTuple):
+    """Compact view of a validator from the beacon state.
+
+    This is what gets streamed from the beacon when processing a new
+    epoch, it only holds what the watcher needs.
+    """
+    index: int
+    pubkey: str
+    effective_balance: int
+    slashed: bool
+    status: Validators.DataItem.StatusEnum
+
+
 class Genesis(BaseModel):
     class Data(BaseModel):
         genesis_time: int
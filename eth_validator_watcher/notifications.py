@@ -0,0 +1,145 @@
+"""Delivery of Slack notifications in the background.
+
+Posting to Slack takes a round trip to its API, which may be slow or
+rate limited: the slot loop only hands messages over to a dispatcher
+which posts them from its own thread.
+"""
+
+import logging
+import queue
+import threading
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+# Maximum number of pending Slack messages, newer ones are dropped
+# once reached.
+SLACK_QUEUE_SIZE = 256
+
+# Maximum length of a message, Slack truncates longer ones.
+SLACK_MAX_MESSAGE_LENGTH = 4000
+
+# Number of attempts to post a message before dropping it.
+SLACK_MAX_ATTEMPTS = 5
+
+# Initial delay before retrying a failed post, doubled on each attempt
+# unless Slack tells us how long to wait.
+SLACK_BACKOFF_SEC = 1.0
+
+
+def _retry_after(error: SlackApiError) -> Optional[float]:
+    """Delay requested by Slack when rate limiting, if any."""
+    if error.response.status_code != 429:
+        return None
+    for name, value in error.response.headers.items():
+        if name.lower() == 'retry-after':
+            return float(value[0] if isinstance(value, list) else value)
+    return SLACK_BACKOFF_SEC
+
+
+class SlackDispatcher:
+    """Posts messages to a Slack channel from a background thread.
+
+    Messages sent during a slot are coalesced and posted at once when
+    flushed. Pending posts are bounded: when Slack can't keep up,
+    messages are dropped rather than delaying the watcher.
+    """
+
+    def __init__(self, token: str, channel: str, queue_depth: Gauge, dropped: Counter, base_url: str = WebClient.BASE_URL) -> None:
+        """SlackDispatcher
+
+        Parameters:
+        token      : Slack token
+        channel    : Slack channel to post to
+        queue_depth: gauge of the number of pending posts
+        dropped    : counter of the messages dropped
+        base_url   : URL of the Slack API
+        """
+        self._client = WebClient(token=token, base_url=base_url)
+        self._token = token
+        self._channel = channel
+        self._dropped = dropped
+        self._pending: list[str] = []
+        self._queue: queue.Queue[Optional[list[str]]] = queue.Queue(maxsize=SLACK_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='slack', daemon=True)
+        self._thread.start()
+        queue_depth.set_function(self._queue.qsize)
+
+    def get_target(self) -> tuple[str, str]:
+        """Return the token and channel messages are posted with."""
+        return self._token, self._channel
+
+    def send(self, msg: str) -> None:
+        """Add a message to the batch of the current slot."""
+        self._pending.append(msg)
+
+    def flush(self) -> None:
+        """Hand the batch of the current slot over to the background
+        thread, this never blocks."""
+        pending, self._pending = self._pending, []
+
+        batch, length = [], 0
+        for msg in pending:
+            if batch and length + len(msg) + 1 > SLACK_MAX_MESSAGE_LENGTH:
+                self._enqueue(batch)
+                batch, length = [], 0
+            batch.append(msg)
+            length += len(msg) + 1
+        if batch:
+            self._enqueue(batch)
+
+    def close(self) -> None:
+        """Stop posting, pending messages are dropped."""
+        self._stopped.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Wait for the pending messages to be posted."""
+        self._queue.put(None, timeout=timeout)
+        self._thread.join(timeout)
+
+    def _enqueue(self, batch: list[str]) -> None:
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            logging.warning(f'😿 Slack notifications queue is full, dropping {len(batch)} message(s)')
+            self._dropped.inc(len(batch))
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            batch = self._queue.get()
+            if batch is None:
+                return
+            if not self._post('\n'.join(batch)):
+                self._dropped.inc(len(batch))
+
+    def _post(self, text: str) -> bool:
+        """Post a message, retrying with backoff. Returns whether it
+        was posted."""
+        delay = SLACK_BACKOFF_SEC
+        for _ in range(SLACK_MAX_ATTEMPTS):
+            try:
+                self._client.chat_postMessage(channel=self._channel, text=text)
+                return True
+            except SlackApiError as e:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    logging.warning(f'😿 Unable to send slack notification: {e.response["error"]}')
+                    return False
+                logging.info(f'😿 Slack rate limited notifications, retrying in {retry_after}s')
+                wait = retry_after
+            except OSError as e:
+                logging.warning(f'😿 Unable to reach slack: {e}')
+                wait, delay = delay, delay * 2
+
+            if self._stopped.wait(wait):
+                return False
+
+        logging.warning(f'😿 Giving up on slack notification after {SLACK_MAX_ATTEMPTS} attempts')
+        return False
@@ -1,58 +1,170 @@
 """This module contains facilities to keep track of which validator proposes blocks.
 """
 
+import struct
+
+from bisect import bisect_right
 from dataclasses import dataclass
+from typing import Optional
 
 from .beacon import Beacon
-from .models import Spec
+from .models import ProposerDuties, Spec
+
+# Dumped duties of an epoch: epoch, length of the dependent root and
+# number of duties, followed by the dependent root and the (slot,
+# validator index) of the duties.
+_EPOCH_HEADER = struct.Struct('<QII')
+_DUTY = struct.Struct('<QQ')
+
+
+@dataclass
+class EpochDuties:
+    """Proposer duties of an epoch, ordered by slot.
+
+    Duties only change when a reorg changes their dependent root,
+    once it is finalized they are final.
+    """
+    dependent_root: str
+    slots: list[int]
+    validator_indexes: list[int]
+    final: bool
+
+    def get_proposer(self, slot: int) -> Optional[int]:
+        i = bisect_right(self.slots, slot) - 1
+        if i >= 0 and self.slots[i] == slot:
+            return self.validator_indexes[i]
+        return None
 
 
 class ProposerSchedule:
     """Helper class to keep track of which validator proposes blocks.
 
     We need to keep track of all slots since the last finalization and
-    up to the end of the next epoch.
+    up to the end of the next epoch. Duties are stored by epoch along
+    with their dependent root so that a reorg only invalidates the
+    epochs it affects.
     """
 
     def __init__(self, spec: Spec):
         self._spec = spec
-        self._last_slot = None
-        self._head_schedule = dict()
-        self._finalized_schedule = dict()
+        self._epochs: dict[int, EpochDuties] = dict()
 
     def get_head_proposer(self, slot: int) -> int:
-        return self._head_schedule.get(slot, None)
+        duties = self._epochs.get(self.epoch(slot))
+        return duties.get_proposer(slot) if duties else None
 
     def get_finalized_proposer(self, slot: int) -> int:
-        return self._finalized_schedule.get(slot, None)
+        duties = self._epochs.get(self.epoch(slot))
+        return duties.get_proposer(slot) if duties and duties.final else None
 
     def get_future_proposals(self, slot: int) -> dict[int, int]:
-        return {k: v for k, v in self._head_schedule.items() if k > slot}
+        proposals = dict()
+        for epoch in sorted(self._epochs):
+            if epoch < self.epoch(slot):
+                continue
+            duties = self._epochs[epoch]
+            i = bisect_right(duties.slots, slot)
+            proposals.update(zip(duties.slots[i:], duties.validator_indexes[i:]))
+        return proposals
 
     def epoch(self, slot: int) -> int:
         return slot // self._spec.data.SLOTS_PER_EPOCH
 
+    def set_duties(self, epoch: int, duties: ProposerDuties, final: bool) -> None:
+        """Store the proposer duties of an epoch.
+
+        Parameters:
+        epoch : Epoch of the duties
+        duties: Proposer duties as returned by the beacon
+        final : Whether the dependent root of the duties is finalized
+        """
+        ordered = sorted(duties.data, key=lambda duty: duty.slot)
+        self._epochs[epoch] = EpochDuties(
+            dependent_root=duties.dependent_root,
+            slots=[duty.slot for duty in ordered],
+            validator_indexes=[duty.validator_index for duty in ordered],
+            final=final,
+        )
+
+    def dump(self) -> bytes:
+        """Dump the final duties.
+
+        The others may have been reorged by the time they are loaded
+        back, they are left out to be fetched again.
+        """
+        out = []
+        for epoch, duties in sorted(self._epochs.items()):
+            if not duties.final:
+                continue
+            root = duties.dependent_root.encode()
+            out.append(_EPOCH_HEADER.pack(epoch, len(root), len(duties.slots)))
+            out.append(root)
+            out.extend(_DUTY.pack(slot, index) for slot, index in zip(duties.slots, duties.validator_indexes))
+        return b''.join(out)
+
+    def load(self, data: bytes) -> None:
+        """Load duties dumped with dump().
+
+        Parameters:
+        data: Dumped duties
+        """
+        offset = 0
+        while offset < len(data):
+            epoch, root_size, count = _EPOCH_HEADER.unpack_from(data, offset)
+            offset += _EPOCH_HEADER.size
+            root = data[offset:offset + root_size].decode()
+            offset += root_size
+            duties = list(_DUTY.iter_unpack(data[offset:offset + count * _DUTY.size]))
+            offset += count * _DUTY.size
+            self._epochs[epoch] = EpochDuties(
+                dependent_root=root,
+                slots=[slot for slot, _ in duties],
+                validator_indexes=[index for _, index in duties],
+                final=True,
+            )
+
+    def invalidate(self, epoch: int, dependent_root: str) -> None:
+        """Drop the duties of an epoch if their dependent root changed.
+
+        Parameters:
+        epoch         : Epoch of the duties
+        dependent_root: Current dependent root of the duties
+        """
+        duties = self._epochs.get(epoch)
+        if duties is not None and not duties.final and duties.dependent_root != dependent_root:
+            del self._epochs[epoch]
+
     def update(self, beacon: Beacon, slot: int, last_processed_finalized: int, last_finalized: int) -> None:
         # Current slots & future proposals.
         epoch = self.epoch(slot)
-        if slot not in self._head_schedule:
-            duties = beacon.get_proposer_duties(epoch)
-            for duty in duties.data:
-                self._head_schedule[duty.slot] = duty.validator_index
-        if (slot + self._spec.data.SLOTS_PER_EPOCH) not in self._head_schedule:
-            duties = beacon.get_proposer_duties(epoch + 1)
-            for duty in duties.data:
-                self._head_schedule[duty.slot] = duty.validator_index
-
-        # Finalized slots.
+        epochs = {epoch, epoch + 1}
+
+        # Finalized slots, duties fetched at head may have been
+        # reorged since: they are fetched again once their dependent
+        # root is finalized.
         if not last_processed_finalized:
             last_processed_finalized = last_finalized
-        for slot in range(last_processed_finalized, last_finalized + 1):
-            if slot not in self._finalized_schedule:
-                duties = beacon.get_proposer_duties(self.epoch(slot))
-                for duty in duties.data:
-                    self._finalized_schedule[duty.slot] = duty.validator_index
+        finalized_epochs = set(range(self.epoch(last_processed_finalized), self.epoch(last_finalized) + 1))
+        for finalized_epoch in finalized_epochs:
+            duties = self._epochs.get(finalized_epoch)
+            if duties is not None and not duties.final:
+                beacon.invalidate_proposer_duties(finalized_epoch)
+                del self._epochs[finalized_epoch]
+
+        # Duties of the different epochs are independent, fetch them
+        # all at once.
+        duties = {
+            epoch: beacon.submit(beacon.get_proposer_duties, epoch)
+            for epoch in sorted(epochs | finalized_epochs)
+            if epoch not in self._epochs
+        }
+
+        for epoch, request in duties.items():
+            # The dependent root is the last block before the epoch.
+            final = epoch * self._spec.data.SLOTS_PER_EPOCH - 1 <= last_finalized
+            self.set_duties(epoch, request.result(), final)
 
     def clear(self, last_processed: int, last_processed_finalized) -> None:
-        self._head_schedule = {k: v for k, v in self._head_schedule.items() if k > last_processed}
-        self._finalized_schedule = {k: v for k, v in self._finalized_schedule.items() if k > last_processed_finalized}
+        first_epoch = self.epoch(min(last_processed, last_processed_finalized))
+        for epoch in [epoch for epoch in self._epochs if epoch < first_epoch]:
+            del self._epochs[epoch]
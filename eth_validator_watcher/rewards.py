@@ -1,24 +1,19 @@
 """Contains functions to handle rewards calculation"""
 
+from eth_validator_watcher_ext import EpochRewards
+
+from .columns import rewards_columns
 from .models import Rewards
 from .watched_validators import WatchedValidators
 
 
-def process_rewards(validators: WatchedValidators, rewards: Rewards) -> None:
+def process_rewards(validators: WatchedValidators, rewards: Rewards | EpochRewards) -> None:
     """Processes rewards for all validators.
-    """
-    ideal_by_eb: dict[int, Rewards.Data.IdealReward] = {}
-    for ideal_reward in rewards.data.ideal_rewards:
-        ideal_by_eb[ideal_reward.effective_balance] = ideal_reward
-
-    for reward in rewards.data.total_rewards:
-        validator = validators.get_validator_by_index(reward.validator_index)
-        if not validator:
-            continue
 
-        ideal = ideal_by_eb.get(validator.effective_balance)
-        if not ideal:
-            continue
-
-        validator.process_rewards(ideal, reward)
+    Validators are matched with the ideal rewards of their effective
+    balance, this is done natively over the columns.
+    """
+    if not isinstance(rewards, EpochRewards):
+        rewards = rewards_columns(rewards)
+    validators.get_registry().set_rewards_all(rewards)
 
@@ -0,0 +1,178 @@
+"""Snapshots of the state of the watcher, to warm start it.
+
+Without a snapshot, a restarted watcher fetches the whole validator
+set before exporting any metric and forgets about the liveness of the
+previous epochs. The state is periodically written to disk and loaded
+back on start if it is recent enough, the watcher then only fetches
+what changed since.
+
+A snapshot is laid out as follows, integers are little-endian:
+
+- header: magic and digest of the rest of the file,
+- meta: genesis time, slot, progress markers (-1 if unset), sizes of
+  the network name, proposer duties and head blocks,
+- network name (UTF-8), proposer duties, head blocks,
+- registry columns (see RegistryState).
+"""
+
+import hashlib
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+from eth_validator_watcher_ext import RegistryState
+
+MAGIC = b'EVWSNAP1'
+
+_HEADER = struct.Struct('<8s16s')
+_META = struct.Struct('<QQqqqqIQQ')
+_HEAD_BLOCK = struct.Struct('<QB')
+
+
+@dataclass
+class Snapshot:
+    """State of the watcher at the end of a slot.
+    """
+    network: str
+    genesis_time: int
+    slot: int
+    last_processed_finalized_slot: Optional[int]
+    liveness_epoch: Optional[int]
+    rewards_epoch: Optional[int]
+    network_validators_epoch: Optional[int]
+    head_blocks: dict[int, bool]
+    schedule: bytes
+    registry: RegistryState
+
+
+def _marker(value: Optional[int]) -> int:
+    return -1 if value is None else value
+
+
+def _optional(value: int) -> Optional[int]:
+    return None if value < 0 else value
+
+
+def write_snapshot(snapshot: Snapshot, path: str) -> None:
+    """Write a snapshot to disk.
+
+    The file is replaced atomically so that a watcher restarting
+    meanwhile never sees a partial snapshot.
+
+    Parameters:
+    snapshot: State of the watcher
+    path    : Path of the snapshot
+    """
+    network = snapshot.network.encode()
+    head_blocks = b''.join(_HEAD_BLOCK.pack(slot, has_block) for slot, has_block in sorted(snapshot.head_blocks.items()))
+    meta = _META.pack(
+        snapshot.genesis_time,
+        snapshot.slot,
+        _marker(snapshot.last_processed_finalized_slot),
+        _marker(snapshot.liveness_epoch),
+        _marker(snapshot.rewards_epoch),
+        _marker(snapshot.network_validators_epoch),
+        len(network),
+        len(snapshot.schedule),
+        len(snapshot.head_blocks),
+    )
+    registry = bytearray(snapshot.registry.nbytes())
+    snapshot.registry.dump(registry)
+    body = [meta, network, snapshot.schedule, head_blocks, registry]
+
+    h = hashlib.blake2b(digest_size=16)
+    for part in body:
+        h.update(part)
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(_HEADER.pack(MAGIC, h.digest()))
+        for part in body:
+            fh.write(part)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path: str) -> Snapshot:
+    """Read a snapshot from disk.
+
+    Parameters:
+    path: Path of the snapshot
+
+    Raises:
+    ValueError if the file is not a valid snapshot.
+    """
+    with open(path, 'rb') as fh:
+        data = memoryview(fh.read())
+
+    if len(data) < _HEADER.size + _META.size:
+        raise ValueError(f'{path} is not a snapshot')
+    magic, digest = _HEADER.unpack_from(data)
+    if magic != MAGIC or hashlib.blake2b(data[_HEADER.size:], digest_size=16).digest() != digest:
+        raise ValueError(f'{path} is not a snapshot or is corrupted')
+
+    offset = _HEADER.size
+    (genesis_time, slot, last_processed_finalized_slot, liveness_epoch, rewards_epoch, network_validators_epoch,
+     network_size, schedule_size, head_blocks_count) = _META.unpack_from(data, offset)
+    offset += _META.size
+
+    network = bytes(data[offset:offset + network_size]).decode()
+    offset += network_size
+    schedule = bytes(data[offset:offset + schedule_size])
+    offset += schedule_size
+    head_blocks = {
+        head_slot: bool(has_block)
+        for head_slot, has_block in _HEAD_BLOCK.iter_unpack(data[offset:offset + head_blocks_count * _HEAD_BLOCK.size])
+    }
+    offset += head_blocks_count * _HEAD_BLOCK.size
+
+    return Snapshot(
+        network=network,
+        genesis_time=genesis_time,
+        slot=slot,
+        last_processed_finalized_slot=_optional(last_processed_finalized_slot),
+        liveness_epoch=_optional(liveness_epoch),
+        rewards_epoch=_optional(rewards_epoch),
+        network_validators_epoch=_optional(network_validators_epoch),
+        head_blocks=head_blocks,
+        schedule=schedule,
+        registry=RegistryState.load(data[offset:]),
+    )
+
+
+def load_snapshot(path: str, network: str, genesis_time: int, slot: int, epoch: int) -> Optional[Snapshot]:
+    """Load a snapshot to resume from, if there is a usable one.
+
+    A snapshot is usable if it was taken on the same chain before the
+    current slot, and recently enough that no liveness is missing:
+    the liveness of an epoch is needed to tell whether validators
+    missed consecutive attestations in the next one.
+
+    Parameters:
+    path        : Path of the snapshot
+    network     : Network the watcher runs on
+    genesis_time: Genesis time of the chain
+    slot        : Current slot
+    epoch       : Current epoch
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        snapshot = read_snapshot(path)
+    except (OSError, ValueError) as e:
+        logging.warning(f'💾 Ignoring snapshot: {e}')
+        return None
+
+    if snapshot.network != network or snapshot.genesis_time != genesis_time:
+        logging.warning(f'💾 Ignoring snapshot of another chain ({snapshot.network})')
+        return None
+
+    if snapshot.slot >= slot or snapshot.liveness_epoch is None or snapshot.liveness_epoch < epoch - 2:
+        logging.info(f'💾 Ignoring snapshot of slot {snapshot.slot}, it is too old to resume from')
+        return None
+
+    return snapshot
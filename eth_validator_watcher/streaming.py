@@ -0,0 +1,118 @@
+"""Incremental JSON parsing helpers for large beacon responses.
+
+Some beacon endpoints (i.e: the validator set of the network) return
+documents of several hundreds of megabytes. Loading those at once
+(raw text + the resulting object tree) makes the memory usage of the
+watcher spike on each epoch, so we parse them as they come from the
+socket instead.
+"""
+
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+# Size of the chunks read from the socket.
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACES = ' \t\n\r'
+
+
+class _Reader:
+    """Buffered text reader on top of an iterator of bytes chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Read one more chunk into the buffer, returns False on EOF."""
+        if self.eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.eof = True
+            chunk = b''
+        # Drop what was already consumed so the buffer stays bounded
+        # to roughly one chunk plus one item.
+        self.buf = self.buf[self.pos:] + self._decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACES:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('unexpected end of JSON document')
+
+    def expect(self, char: str) -> None:
+        """Consume the next non-whitespace character which must be `char`."""
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at offset {self.pos}, got {self.buf[self.pos]!r}')
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next JSON value, reading more data if needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+                # A number at the very end of the buffer may be
+                # truncated, make sure there is nothing more to it.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """Iterate over the items of a top-level array in a JSON object.
+
+    Only one item of the array is decoded at a time, other members of
+    the top-level object are decoded and discarded.
+
+    Parameters:
+    chunks: iterator of raw bytes (i.e: requests' iter_content())
+    key   : name of the top-level member holding the array
+
+    Returns:
+    An iterator over the decoded items of the array.
+    """
+    reader = _Reader(chunks)
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        name = reader.value()
+        reader.expect(':')
+
+        if name != key:
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == ']':
+                        reader.pos += 1
+                        break
+                    reader.expect(',')
+
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
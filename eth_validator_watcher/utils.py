@@ -1,3 +1,5 @@
+import math
+import os
 import re
 from pathlib import Path
 from time import sleep, time
@@ -13,12 +15,16 @@ from .config import WatchedKeyConfig
 SLOT_FOR_CONFIG_RELOAD = 15
 SLOT_FOR_MISSED_ATTESTATIONS_PROCESS = 16
 SLOT_FOR_REWARDS_PROCESS = 17
+SLOT_FOR_SNAPSHOT = 18
 
 # Default set of existing scopes.
 LABEL_SCOPE_ALL_NETWORK="scope:all-network"
 LABEL_SCOPE_WATCHED="scope:watched"
 LABEL_SCOPE_NETWORK="scope:network"
 
+# Where cgroups are mounted in containers.
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+
 
 def pct(a: int, b: int, inclusive: bool=False) -> float:
     """Helper function to calculate the percentage of a over b.
@@ -27,3 +33,53 @@ def pct(a: int, b: int, inclusive: bool=False) -> float:
     if total == 0:
         return 0.0
     return float(a / total) * 100.0
+
+
+def cgroup_cpu_quota(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """Returns the CPU quota of the cgroup of the process, if any.
+
+    Supports both cgroup v2 (cpu.max) and cgroup v1 (cpu.cfs_quota_us).
+
+    Parameters:
+    root: Path where cgroups are mounted
+
+    Returns:
+    Number of CPUs allowed by the quota, or None if unlimited.
+    """
+    try:
+        quota, period = (root / 'cpu.max').read_text().split()
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        quota = int((root / 'cpu' / 'cpu.cfs_quota_us').read_text())
+        period = int((root / 'cpu' / 'cpu.cfs_period_us').read_text())
+        if quota <= 0 or period <= 0:
+            return None
+        return quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(root: Path = CGROUP_ROOT) -> int:
+    """Returns the number of CPUs the process can effectively use.
+
+    os.cpu_count() returns the number of CPUs of the host, this also
+    takes into account the CPU affinity and the container CPU quota.
+
+    Parameters:
+    root: Path where cgroups are mounted
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota(root)
+    if quota is not None:
+        count = min(count, math.ceil(quota))
+
+    return max(count, 1)
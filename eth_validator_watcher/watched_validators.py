@@ -1,56 +1,55 @@
 """Watched validators.
 """
 
-from typing import Optional
-
-from eth_validator_watcher_ext import Validator
-from .config import Config, WatchedKeyConfig
-from .models import Validators, ValidatorsLivenessResponse, Rewards
-from .utils import LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, LABEL_SCOPE_NETWORK
+import os
 
+from typing import Iterable, Optional
 
-def normalized_public_key(pubkey: str) -> str:
-    """Normalize a public key.
-
-    Parameters:
-        pubkey: Public key to normalize
-    """
-    if pubkey.startswith('0x'):
-        pubkey = pubkey[2:]
-    return pubkey.lower()
+from eth_validator_watcher_ext import BlockEvent, EpochLiveness, EpochValidators, Registry, RegistryState
+from .columns import liveness_columns, prepare_epoch, pubkey_bytes
+from .config import Config, ScopeEnum, WatchedKeyConfig, watched_keys_digest
+from .keys_index import WatchedKeysIndex, watched_public_keys
+from .models import ValidatorRecord, ValidatorsLivenessResponse, Rewards
+from .utils import LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, LABEL_SCOPE_NETWORK
 
 
 class WatchedValidator:
     """Watched validator abstraction.
 
-    This is a wrapper around the C++ validator object which holds the
-    state of a validator.
+    This is a lightweight handle on a row of the registry, which
+    holds the state of all validators in C++ columns.
     """
 
-    def __init__(self):
-        # State is wrapped in a C++ object so we can perform efficient
-        # operations without holding the GIL.
-        #
-        # We need to be careful when dealing with _v as modifications
-        # can only be performed using explicit copies (i.e: do not
-        # call append() on a list but rather create a new list with
-        # the new element).
-        self._v = Validator()
-
-        # This gets overriden by process_config if the validator is watched.
-        self._v.labels : Optional[list[str]] = [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK]
+    def __init__(self, registry: Registry, index: int):
+        # State is held by the C++ registry so we can perform
+        # efficient operations without holding the GIL, only the
+        # index of the validator is kept here.
+        self._registry = registry
+        self._index = index
+
+    @property
+    def index(self) -> int:
+        """Get the index of the validator.
+        """
+        return self._index
 
     @property
     def effective_balance(self) -> int:
         """Get the effective balance of the validator.
         """
-        return self._v.consensus_effective_balance
+        return self._registry.effective_balance(self._index)
 
     @property
     def labels(self) -> list[str]:
         """Get the labels for the validator.
         """
-        return self._v.labels
+        return self._registry.labels(self._index)
+
+    @property
+    def watched(self) -> bool:
+        """Whether the validator is in the configuration file.
+        """
+        return LABEL_SCOPE_WATCHED in self.labels
 
     def process_config(self, config: WatchedKeyConfig):
         """Processes a new configuration.
@@ -65,19 +64,12 @@ class WatchedValidator:
         if config.labels:
             labels = labels + config.labels
 
-        self._v.labels = labels
-
-    def process_epoch(self, validator: Validators.DataItem):
-        """Processes a new epoch.
+        self._registry.set_labels(self._index, labels)
 
-        Parameters:
-            validator: Validator beacon state
+    def reset_config(self):
+        """Processes the removal of the validator from the configuration.
         """
-        self._v.consensus_pubkey = validator.validator.pubkey
-        self._v.consensus_effective_balance = validator.validator.effective_balance
-        self._v.consensus_slashed = validator.validator.slashed
-        self._v.consensus_index = validator.index
-        self._v.consensus_status = validator.status
+        self._registry.set_labels(self._index, [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK])
 
     def process_liveness(self, liveness: ValidatorsLivenessResponse.Data):
         """Processes liveness data.
@@ -85,8 +77,7 @@ class WatchedValidator:
         Parameters:
         liveness: Validator liveness data
         """
-        self._v.previous_missed_attestation = self._v.missed_attestation
-        self._v.missed_attestation = liveness.is_live != True
+        self._registry.set_liveness(self._index, liveness.is_live == True)
 
     def process_rewards(self, ideal: Rewards.Data.IdealReward, reward: Rewards.Data.TotalReward):
         """Processes rewards data.
@@ -95,12 +86,14 @@ class WatchedValidator:
             ideal: Ideal rewards
             reward: Actual rewards
         """
-        self._v.suboptimal_source = reward.source != ideal.source
-        self._v.suboptimal_target = reward.target != ideal.target
-        self._v.suboptimal_head = reward.head != ideal.head
-
-        self._v.ideal_consensus_reward = ideal.source + ideal.target + ideal.head
-        self._v.actual_consensus_reward = reward.source + reward.target + reward.head
+        self._registry.set_rewards(
+            self._index,
+            reward.source != ideal.source,
+            reward.target != ideal.target,
+            reward.head != ideal.head,
+            ideal.source + ideal.target + ideal.head,
+            reward.source + reward.target + reward.head,
+        )
 
     def process_block(self, slot: int, has_block: bool):
         """Processes a block proposal.
@@ -109,10 +102,8 @@ class WatchedValidator:
             slot: Slot of the block proposal
             missed: Whether the block was missed
         """
-        if has_block:
-            self._v.proposed_blocks = self._v.proposed_blocks + [slot]
-        else:
-            self._v.missed_blocks = self._v.missed_blocks + [slot]
+        event = BlockEvent.PROPOSED if has_block else BlockEvent.MISSED
+        self._registry.add_block_event(self._index, event, slot)
 
     def process_block_finalized(self, slot: int, has_block: bool):
         """Processes a finalized block proposal.
@@ -121,10 +112,8 @@ class WatchedValidator:
             slot: Slot of the block proposal
             missed: Whether the block was missed
         """
-        if has_block:
-            self._v.proposed_blocks_finalized = self._v.proposed_blocks_finalized + [slot]
-        else:
-            self._v.missed_blocks_finalized = self._v.missed_blocks_finalized + [slot]
+        event = BlockEvent.PROPOSED_FINALIZED if has_block else BlockEvent.MISSED_FINALIZED
+        self._registry.add_block_event(self._index, event, slot)
 
     def process_future_block(self, slot: int):
         """Processes a future block proposal.
@@ -132,16 +121,12 @@ class WatchedValidator:
         Parameters:
             slot: Slot of the block proposal
         """
-        self._v.future_blocks_proposal = self._v.future_blocks_proposal + [slot]
+        self._registry.add_block_event(self._index, BlockEvent.FUTURE, slot)
 
     def reset_blocks(self):
         """Reset the counters for the next run.
         """
-        self._v.missed_blocks = []
-        self._v.missed_blocks_finalized = []
-        self._v.proposed_blocks = []
-        self._v.proposed_blocks_finalized = []
-        self._v.future_blocks_proposal = []
+        self._registry.reset_blocks(self._index)
 
 
 class WatchedValidators:
@@ -149,22 +134,46 @@ class WatchedValidators:
 
     Provides facilities to retrieve a validator by index or public
     key. This needs to be efficient both in terms of CPU and memory as
-    there are about ~1 million validators on the network.
+    there are about ~1 million validators on the network: the state
+    is stored in columns by the C++ registry, indexed by validator
+    index.
     """
 
     def __init__(self):
-        self._validators: dict[int, WatchedValidator] = {}
-        self._pubkey_to_index: dict[str, int] = {}
+        # Validators get those labels until process_config is called
+        # for them, if they are watched.
+        self._registry = Registry([LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK])
 
         self.config_initialized = False
 
+        # Configuration applied so far, by public key, so that only
+        # what changed is applied on reload.
+        self._config_keys: list[WatchedKeyConfig] = []
+        self._config_digest = watched_keys_digest([])
+        self._config_by_pubkey: dict[bytes, WatchedKeyConfig] = {}
+        # Watched keys not yet in the registry.
+        self._config_unresolved: set[bytes] = set()
+
+        # Compiled index of the watched keys, if configured, along with
+        # the file state it was loaded from.
+        self._keys_index: Optional[WatchedKeysIndex] = None
+        self._keys_index_stat = None
+        self._keys_index_digest: Optional[bytes] = None
+        self._keys_index_missing = 0
+        self._keys_index_public_keys: Optional[list[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._registry)
+
     def get_validator_by_index(self, index: int) -> Optional[WatchedValidator]:
         """Get a validator by index.
 
         Parameters:
             index: Index of the validator to retrieve
         """
-        return self._validators.get(index)
+        if not self._registry.has(index):
+            return None
+        return WatchedValidator(self._registry, index)
 
     def get_validator_by_pubkey(self, pubkey: str) -> Optional[WatchedValidator]:
         """Get a validator by public key.
@@ -172,57 +181,196 @@ class WatchedValidators:
         Parameters:
             pubkey: Public key of the validator to retrieve
         """
-        index = self._pubkey_to_index.get(normalized_public_key(pubkey))
-        if index is None:
+        key = pubkey_bytes(pubkey)
+        if key is None:
             return None
-        return self._validators.get(index)
+        index = self._registry.find(key)
+        if index < 0:
+            return None
+        return WatchedValidator(self._registry, index)
 
     def get_indexes(self) -> list[int]:
         """Get all validator indexes."""
-        return list(self._validators.keys())
+        return self._registry.indexes()
+
+    def get_active_indexes(self, label: str = LABEL_SCOPE_ALL_NETWORK) -> list[int]:
+        """Get the indexes of the active validators having a label.
+
+        Parameters:
+            label: Label of the validators, all of them by default
+        """
+        return self._registry.indexes_with_label(label, True)
+
+    def get_liveness_indexes(self, scope: Optional[ScopeEnum]) -> list[int]:
+        """Get the indexes of the validators to query the liveness of.
 
-    def get_validators(self) -> dict[int, WatchedValidator]:
-        """Iterate over all validators."""
-        return self._validators
+        Only active validators are accounted for missed attestations,
+        so only those in the scope are queried.
+
+        Parameters:
+            scope: Liveness scope of the configuration
+        """
+        label = LABEL_SCOPE_WATCHED if scope == ScopeEnum.watched else LABEL_SCOPE_ALL_NETWORK
+        return self.get_active_indexes(label)
+
+    def get_watched_indexes(self) -> list[int]:
+        """Get the indexes of the validators in the configuration."""
+        return self._registry.indexes_with_label(LABEL_SCOPE_WATCHED)
+
+    def get_watched_public_keys(self, config: Config) -> list[str]:
+        """Get the public keys of the watched validators.
+
+        With an index, the one opened by process_config() is reused
+        and its keys are only converted once.
+
+        Parameters:
+            config: Current configuration
+        """
+        if not config.watched_keys_index or self._keys_index is None or self._keys_index_stat[0] != config.watched_keys_index:
+            return watched_public_keys(config)
+        if self._keys_index_public_keys is None:
+            self._keys_index_public_keys = self._keys_index.public_keys()
+        return self._keys_index_public_keys
+
+    def get_registry(self) -> Registry:
+        """Get the underlying C++ registry."""
+        return self._registry
+
+    def get_state(self) -> RegistryState:
+        """Get a copy of the state of the validators, to snapshot it."""
+        return self._registry.state()
+
+    def restore(self, state: RegistryState):
+        """Restore the state of the validators from a snapshot.
+
+        Validators are back to the network scope until the
+        configuration is processed.
+
+        Parameters:
+            state: State of the validators, from get_state()
+        """
+        self._registry.restore(state)
 
     def process_config(self, config: Config):
         """Process a config update.
 
+        Only the difference with the configuration previously applied
+        is processed: validators removed from the configuration are
+        back to the network scope, and watched keys that were not in
+        the registry yet are looked up again.
+
         Parameters:
             config: Updated configuration
         """
-        for item in config.watched_keys:
-            index = self._pubkey_to_index.get(normalized_public_key(item.public_key), None)
-            if index:
-                validator = self._validators.get(index)
-                if validator:
-                    validator.process_config(item)
+        if config.watched_keys_index:
+            self._process_keys_index(config.watched_keys_index)
+        else:
+            if self._keys_index is not None:
+                # Back to the configuration file, which is applied
+                # from scratch.
+                self._registry.apply_watched_keys(b'', b'', b'', [], [], LABEL_SCOPE_WATCHED)
+                self._keys_index.close()
+                self._keys_index = None
+                self._keys_index_stat = None
+                self._keys_index_digest = None
+                self._keys_index_public_keys = None
+            self._process_watched_keys(config.watched_keys or [])
 
         self.config_initialized = True
 
-    def process_epoch(self, validators: Validators):
-        """Process a new epoch
+    def _process_watched_keys(self, watched_keys: list[WatchedKeyConfig]):
+        """Apply the watched keys of the configuration file.
 
         Parameters:
-            validators: New validator state for the epoch from the beaconchain.
-            liveness: Whether or not the validator attested in the previous epoch.
+            watched_keys: Watched keys of the configuration
         """
-        for item in validators.data:
-            validator = self._validators.get(item.index)
-            if validator is None:
-                validator = WatchedValidator()
-                self._validators[item.index] = validator
-                self._pubkey_to_index[normalized_public_key(item.validator.pubkey)] = item.index
+        pending = self._config_unresolved
+
+        # The configuration is only reloaded when the file changed,
+        # the content may still be the same.
+        if watched_keys is not self._config_keys:
+            digest = watched_keys_digest(watched_keys)
+            if digest != self._config_digest:
+                by_pubkey = dict()
+                for item in watched_keys:
+                    key = pubkey_bytes(item.public_key)
+                    if key is not None:
+                        by_pubkey[key] = item
+
+                for key in self._config_by_pubkey.keys() - by_pubkey.keys():
+                    index = self._registry.find(key)
+                    if index >= 0:
+                        WatchedValidator(self._registry, index).reset_config()
+
+                previous = self._config_by_pubkey
+                pending = {key for key in pending if key in by_pubkey}
+                pending.update(key for key, item in by_pubkey.items() if key not in previous or previous[key].labels != item.labels)
+
+                self._config_by_pubkey = by_pubkey
+                self._config_digest = digest
+            self._config_keys = watched_keys
+
+        unresolved = set()
+        for key in pending:
+            index = self._registry.find(key)
+            if index < 0:
+                unresolved.add(key)
+            else:
+                WatchedValidator(self._registry, index).process_config(self._config_by_pubkey[key])
+        self._config_unresolved = unresolved
+
+    def _process_keys_index(self, path: str):
+        """Apply a compiled index of the watched keys.
+
+        The index is reopened when the file changed, and only applied
+        when its content changed or some of its keys were not in the
+        registry yet.
 
-            validator.process_epoch(item)
+        Parameters:
+            path: Path of the index
+        """
+        st = os.stat(path)
+        stat = (path, st.st_mtime_ns, st.st_size)
+        if stat != self._keys_index_stat:
+            index = WatchedKeysIndex(path)
+            if self._keys_index is not None:
+                self._keys_index.close()
+            self._keys_index, self._keys_index_stat = index, stat
+            self._keys_index_public_keys = None
+
+            # Validators labelled from the configuration file are
+            # taken over by the index.
+            self._config_keys = []
+            self._config_digest = watched_keys_digest([])
+            self._config_by_pubkey = {}
+            self._config_unresolved = set()
+
+        index = self._keys_index
+        if index.digest != self._keys_index_digest or self._keys_index_missing:
+            self._keys_index_missing = self._registry.apply_watched_keys(
+                index.pubkeys, index.offsets, index.label_ids, index.labels,
+                [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED], LABEL_SCOPE_WATCHED)
+            self._keys_index_digest = index.digest
+
+    def process_epoch(self, validators: Iterable[ValidatorRecord] | EpochValidators):
+        """Process a new epoch
+
+        Parameters:
+            validators: New validator state for the epoch from the
+                        beaconchain, can be streamed or already
+                        loaded with prepare_epoch().
+        """
+        if not isinstance(validators, EpochValidators):
+            validators = prepare_epoch(validators)
+        self._registry.set_epoch_all(validators)
 
-    def process_liveness(self, liveness: ValidatorsLivenessResponse):
+    def process_liveness(self, liveness: ValidatorsLivenessResponse | EpochLiveness):
         """Process liveness data
 
         Parameters:
-            liveness: Liveness data from the beacon chain
+            liveness: Liveness data from the beacon chain, can be
+                      already converted with liveness_columns().
         """
-        for item in liveness.data:
-            validator = self._validators.get(item.index)
-            if validator:
-                validator.process_liveness(item)
+        if not isinstance(liveness, EpochLiveness):
+            liveness = liveness_columns(liveness)
+        self._registry.set_liveness_all(liveness)
@@ -0,0 +1,31 @@
+"""Builders of beacon data shared by the tests.
+"""
+
+from eth_validator_watcher.models import ProposerDuties, ValidatorRecord, Validators
+
+
+def pubkey(index: int) -> str:
+    return '0x' + f'{index:02x}' * 48
+
+
+def records(count: int) -> list[ValidatorRecord]:
+    return [
+        ValidatorRecord(
+            index=i,
+            pubkey=pubkey(i),
+            effective_balance=32000000000,
+            slashed=False,
+            status=Validators.DataItem.StatusEnum.activeOngoing,
+        )
+        for i in range(count)
+    ]
+
+
+def header(slot: int) -> dict:
+    return {'data': {'header': {'message': {'slot': str(slot)}}}}
+
+
+def duties(proposers: dict[int, int]) -> ProposerDuties:
+    return ProposerDuties(dependent_root='0x00', data=[
+        ProposerDuties.Data(pubkey=pubkey(index), validator_index=index, slot=slot) for slot, index in proposers.items()
+    ])
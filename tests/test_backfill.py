@@ -0,0 +1,130 @@
+import io
+import json
+from pathlib import Path
+
+from requests_mock import Mocker
+
+from eth_validator_watcher.backfill import Backfill, MetricsWriter
+from eth_validator_watcher.beacon import Beacon
+from eth_validator_watcher.config import Config, WatchedKeyConfig
+from eth_validator_watcher.decoding import Decoder
+from eth_validator_watcher.metrics import WorkerPool
+from eth_validator_watcher.models import Spec
+from tests.helpers import duties, header, pubkey, records
+
+
+def _mock_beacon(m: Mocker) -> None:
+    url = 'http://beacon-node:5051'
+    validators = {'data': [
+        {'index': str(r.index), 'status': r.status, 'validator': {
+            'pubkey': r.pubkey, 'effective_balance': str(r.effective_balance), 'slashed': r.slashed,
+        }}
+        for r in records(4)
+    ]}
+    for slot in (8, 12):
+        m.get(f'{url}/eth/v1/beacon/states/{slot}/validators', json=validators)
+        m.post(f'{url}/eth/v1/beacon/states/{slot}/validators',
+               json=lambda request, _: {'data': [v for v in validators['data'] if v['validator']['pubkey'] in request.json()['ids']]})
+    for epoch in (2, 3, 4):
+        m.get(f'{url}/eth/v1/validator/duties/proposer/{epoch}',
+              json=duties({epoch * 4 + i: i for i in range(4)}).model_dump(mode='json'))
+    for slot in range(8, 16):
+        # Validator 1 misses its proposal in epoch 2.
+        if slot == 9:
+            m.get(f'{url}/eth/v1/beacon/headers/{slot}', status_code=404)
+        else:
+            m.get(f'{url}/eth/v1/beacon/headers/{slot}', json=header(slot))
+    for epoch in (1, 2):
+        # Validator 1 didn't attest in epoch 1.
+        m.post(f'{url}/eth/v1/validator/liveness/{epoch}',
+               json=lambda request, _: {'data': [{'index': i, 'is_live': i != '1'} for i in request.json()]})
+    for epoch in (0, 1):
+        m.post(f'{url}/eth/v1/beacon/rewards/attestations/{epoch}', json={'data': {
+            'ideal_rewards': [{'effective_balance': '32000000000', 'source': '3', 'target': '2', 'head': '1'}],
+            'total_rewards': [{'validator_index': str(i), 'source': '3', 'target': '2', 'head': '1'} for i in range(4)],
+        }})
+
+
+def _backfill(archive: Path, **kwargs) -> list[dict]:
+    kwargs.setdefault('watched_keys', [WatchedKeyConfig(public_key=pubkey(1), labels=['vc:1'])])
+    cfg = Config(network='mainnet', **kwargs)
+    spec = Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=4))
+    beacon = Beacon('http://beacon-node:5051', 90)
+
+    fh = io.StringIO()
+    backfill = Backfill(cfg, beacon, spec, Decoder(0), WorkerPool(1), archive, prefetch_epochs=2)
+    backfill.run(8, 16, MetricsWriter(fh, 'mainnet', 1000, 12))
+    beacon.close()
+    return [json.loads(line) for line in fh.getvalue().splitlines()]
+
+
+def test_backfill(tmp_path: Path) -> None:
+    with Mocker() as m:
+        _mock_beacon(m)
+        lines = _backfill(tmp_path)
+
+    assert [line['slot'] for line in lines] == list(range(8, 16))
+    assert lines[0]['timestamp'] == 1000 + 8 * 12
+
+    first = lines[0]['samples']
+    assert first['eth_validator_status_count{network="mainnet",scope="vc:1",status="active_ongoing"}'] == 1.0
+    assert first['eth_missed_attestations{network="mainnet",scope="vc:1"}'] == 1.0
+    assert first['eth_ideal_consensus_rewards_gwei{network="mainnet",scope="scope:all-network"}'] == 24.0
+
+    # Only changed samples are written: the missed proposal of slot 9
+    # is accounted at head and finalized at once.
+    assert lines[1]['samples'] == {
+        'eth_future_block_proposals{network="mainnet",scope="vc:1"}': 1.0,
+        'eth_future_block_proposals{network="mainnet",scope="scope:watched"}': 1.0,
+        'eth_future_block_proposals{network="mainnet",scope="scope:all-network"}': 6.0,
+        'eth_missed_block_proposals_head_total{network="mainnet",scope="vc:1"}': 1.0,
+        'eth_missed_block_proposals_head_total{network="mainnet",scope="scope:watched"}': 1.0,
+        'eth_missed_block_proposals_head_total{network="mainnet",scope="scope:all-network"}': 1.0,
+        'eth_missed_block_proposals_finalized_total{network="mainnet",scope="vc:1"}': 1.0,
+        'eth_missed_block_proposals_finalized_total{network="mainnet",scope="scope:watched"}': 1.0,
+        'eth_missed_block_proposals_finalized_total{network="mainnet",scope="scope:all-network"}': 1.0,
+    }
+
+    # A second backfill over the same slots reads the archive only.
+    with Mocker() as m:
+        assert _backfill(tmp_path) == lines
+        assert m.call_count == 0
+
+
+def test_backfill_archive_scope(tmp_path: Path) -> None:
+    with Mocker() as m:
+        _mock_beacon(m)
+        lines = _backfill(tmp_path, validators_scope='watched')
+
+    first = lines[0]['samples']
+    assert first['eth_validator_status_count{network="mainnet",scope="scope:all-network",status="active_ongoing"}'] == 1.0
+
+    # What was archived for the watched validators isn't reused for
+    # another set of validators.
+    with Mocker() as m:
+        _mock_beacon(m)
+        lines = _backfill(tmp_path, validators_scope='watched', watched_keys=[
+            WatchedKeyConfig(public_key=pubkey(1), labels=['vc:1']),
+            WatchedKeyConfig(public_key=pubkey(2), labels=['vc:2']),
+        ])
+        assert m.call_count > 0
+
+    first = lines[0]['samples']
+    assert first['eth_validator_status_count{network="mainnet",scope="scope:all-network",status="active_ongoing"}'] == 2.0
+
+
+def test_backfill_lookup_scopes(tmp_path: Path) -> None:
+    with Mocker() as m:
+        _mock_beacon(m)
+        lines = _backfill(tmp_path, liveness_scope='watched', block_lookup_scope='watched')
+        headers = sorted(r.path for r in m.request_history if '/headers/' in r.path)
+        liveness = [r.json() for r in m.request_history if '/liveness/' in r.path]
+
+    # Only the watched validator 1 is looked up, it proposes the
+    # second slot of each epoch.
+    assert headers == ['/eth/v1/beacon/headers/13', '/eth/v1/beacon/headers/9']
+    assert liveness == [['1'], ['1']]
+
+    first = lines[0]['samples']
+    assert first['eth_missed_attestations{network="mainnet",scope="vc:1"}'] == 1.0
+    assert lines[1]['samples']['eth_missed_block_proposals_finalized_total{network="mainnet",scope="scope:all-network"}'] == 1.0
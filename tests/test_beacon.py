@@ -1,12 +1,14 @@
 from pathlib import Path
 import json
 import unittest
+import unittest.mock
 
 from pytest import raises
 from requests import HTTPError, Response, codes, exceptions
 from requests_mock import Mocker
 
 from eth_validator_watcher.beacon import Beacon, NoBlockError
+from eth_validator_watcher.watched_validators import WatchedValidators
 from tests import assets
 
 
@@ -29,6 +31,89 @@ class BeaconTestCase(unittest.TestCase):
             b = Beacon("http://beacon-node:5051", 90)
             self.assertTrue(b.has_block_at_slot(4996301))
 
+    def test_submit(self) -> None:
+        """Test that independent calls can be in flight at once."""
+
+        with open(Path(assets.__file__).parent / "sepolia_header_4996301.json") as fd:
+            data = json.load(fd)
+
+        with Mocker() as m:
+            m.get(f"http://beacon-node:5051/eth/v1/beacon/headers/4996301", json=data)
+            m.get(f"http://beacon-node:5051/eth/v1/beacon/headers/4996302", status_code=codes.not_found)
+            b = Beacon("http://beacon-node:5051", 90, max_concurrent_requests=2)
+            found = b.submit(b.has_block_at_slot, 4996301)
+            missed = b.submit(b.has_block_at_slot, 4996302)
+            self.assertTrue(found.result())
+            self.assertFalse(missed.result())
+            b.close()
+
+    def test_get_proposer_duties_cache(self) -> None:
+        """Test proposer duties are refetched only on dependent root change."""
+        def duties(root):
+            return {"dependent_root": root, "data": [{"pubkey": "0x01", "validator_index": "1", "slot": "320"}]}
+
+        with Mocker() as m:
+            m.get("http://beacon-node:5051/eth/v1/validator/duties/proposer/10", [{'json': duties('0xaa')}, {'json': duties('0xbb')}])
+            b = Beacon("http://beacon-node:5051", 90)
+            self.assertEqual(b.get_proposer_duties(10).dependent_root, '0xaa')
+            self.assertIn('gzip', m.last_request.headers['Accept-Encoding'])
+
+            b.invalidate_proposer_duties(10, '0xaa')
+            self.assertEqual(b.get_proposer_duties(10).dependent_root, '0xaa')
+            self.assertEqual(m.call_count, 1)
+
+            b.invalidate_proposer_duties(10, '0xbb')
+            self.assertEqual(b.get_proposer_duties(10).dependent_root, '0xbb')
+            self.assertEqual(m.call_count, 2)
+
+    def test_get_validators_columns_json(self) -> None:
+        """Test get_validators_columns() decodes JSON."""
+        data = {"data": [{
+            "index": "3",
+            "status": "active_ongoing",
+            "validator": {"pubkey": "0x" + "03" * 48, "effective_balance": "32000000000", "slashed": False},
+        }]}
+
+        with Mocker() as m:
+            m.get("http://beacon-node:5051/eth/v1/beacon/states/320/validators", json=data)
+            b = Beacon("http://beacon-node:5051", 90)
+            self.assertEqual(len(b.get_validators_columns(320)), 1)
+            self.assertEqual(m.last_request.headers['Accept'], 'application/json')
+
+    def test_get_validators_columns_ids(self) -> None:
+        """Test get_validators_columns() queries ids by chunks."""
+        def callback(request, context):
+            return {"data": [{
+                "index": i,
+                "status": "active_ongoing",
+                "validator": {"pubkey": "0x" + "00" * 48, "effective_balance": "32000000000", "slashed": False},
+            } for i in request.json()['ids']]}
+
+        with Mocker() as m, unittest.mock.patch('eth_validator_watcher.beacon.VALIDATORS_IDS_CHUNK_SIZE', 2):
+            m.post("http://beacon-node:5051/eth/v1/beacon/states/320/validators", json=callback)
+            b = Beacon("http://beacon-node:5051", 90)
+            columns = b.get_validators_columns(320, ['1', '2', '3', '4', '5'])
+            self.assertEqual(m.call_count, 3)
+            b.close()
+
+        validators = WatchedValidators()
+        validators.process_epoch(columns)
+        self.assertEqual(validators.get_indexes(), [1, 2, 3, 4, 5])
+
+    def test_get_liveness_columns(self) -> None:
+        """Test get_liveness_columns() queries indexes by chunks."""
+        def callback(request, context):
+            return {"data": [{"index": i, "is_live": int(i) % 2 == 0} for i in request.json()]}
+
+        with Mocker() as m, unittest.mock.patch('eth_validator_watcher.beacon.LIVENESS_CHUNK_SIZE', 2):
+            m.post("http://beacon-node:5051/eth/v1/validator/liveness/10", json=callback)
+            b = Beacon("http://beacon-node:5051", 90)
+            liveness = b.get_liveness_columns(10, [0, 1, 2])
+            self.assertEqual(m.call_count, 2)
+            b.close()
+
+        self.assertEqual(len(liveness), 3)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,98 @@
+from requests_mock import Mocker
+
+from eth_validator_watcher.beacon import Beacon
+from eth_validator_watcher.blocks import process_finalized_blocks
+from eth_validator_watcher.config import Config, WatchedKeyConfig
+from eth_validator_watcher.metrics import compute_validator_metrics, WorkerPool
+from eth_validator_watcher.models import Spec
+from eth_validator_watcher.proposer_schedule import ProposerSchedule
+from eth_validator_watcher.utils import LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK, LABEL_SCOPE_WATCHED
+from eth_validator_watcher.watched_validators import WatchedValidators
+from tests.helpers import duties, header, pubkey, records
+
+
+def test_process_finalized_blocks() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    schedule = ProposerSchedule(Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=4)))
+    # Slot 3 has an unknown proposer, slot 4 isn't in the schedule.
+    schedule.set_duties(0, duties({1: 1, 2: 2, 3: 42}), final=True)
+
+    with Mocker() as m:
+        m.get('http://beacon-node:5051/eth/v1/beacon/headers/1', json=header(1))
+        m.get('http://beacon-node:5051/eth/v1/beacon/headers/2', status_code=404)
+
+        beacon = Beacon('http://beacon-node:5051', 90)
+        process_finalized_blocks(beacon, validators, schedule, 1, 5)
+
+        # Requests are concurrent, their order is not deterministic.
+        assert sorted(r.path for r in m.request_history) == ['/eth/v1/beacon/headers/1', '/eth/v1/beacon/headers/2']
+
+    metrics = compute_validator_metrics(validators, 0, WorkerPool(1))
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].proposed_blocks_finalized == 1
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].missed_blocks_finalized == 1
+
+
+def test_process_finalized_blocks_watched_only() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+    validators.process_config(Config(watched_keys=[WatchedKeyConfig(public_key=pubkey(1))]))
+
+    schedule = ProposerSchedule(Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=4)))
+    schedule.set_duties(0, duties({1: 1, 2: 2, 3: 3}), final=True)
+
+    with Mocker() as m:
+        m.get('http://beacon-node:5051/eth/v1/beacon/headers/1', json=header(1))
+
+        beacon = Beacon('http://beacon-node:5051', 90)
+        # Slot 2 was missed at head, slot 3 wasn't seen.
+        process_finalized_blocks(beacon, validators, schedule, 1, 4, {2: False})
+
+        # Only the watched proposer is looked up.
+        assert [r.path for r in m.request_history] == ['/eth/v1/beacon/headers/1']
+
+    metrics = compute_validator_metrics(validators, 0, WorkerPool(1))
+    assert metrics[LABEL_SCOPE_WATCHED].proposed_blocks_finalized == 1
+    assert metrics[LABEL_SCOPE_NETWORK].missed_blocks_finalized == 1
+    assert metrics[LABEL_SCOPE_NETWORK].proposed_blocks_finalized == 0
+
+
+def test_proposer_schedule() -> None:
+    schedule = ProposerSchedule(Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=4)))
+
+    with Mocker() as m:
+        m.get('http://beacon-node:5051/eth/v1/validator/duties/proposer/2', [
+            {'json': duties({11: 3, 8: 0, 9: 1, 10: 2}).model_dump(mode='json')},
+            {'json': duties({8: 3, 9: 3, 10: 3, 11: 3}).model_dump(mode='json')},
+        ])
+        m.get('http://beacon-node:5051/eth/v1/validator/duties/proposer/1', json=duties({4: 0, 5: 1, 6: 2, 7: 3}).model_dump(mode='json'))
+        m.get('http://beacon-node:5051/eth/v1/validator/duties/proposer/3', json=duties({12: 0, 13: 1, 14: 2, 15: 3}).model_dump(mode='json'))
+
+        beacon = Beacon('http://beacon-node:5051', 90)
+        schedule.update(beacon, 9, None, 4)
+        assert schedule.get_finalized_proposer(5) == 1
+        assert schedule.get_head_proposer(9) == 1
+        assert schedule.get_finalized_proposer(9) is None
+        assert schedule.get_future_proposals(13) == {14: 2, 15: 3}
+        assert list(schedule.get_future_proposals(10)) == [11, 12, 13, 14, 15]
+
+        # Nothing is refetched until the dependent root changes.
+        schedule.update(beacon, 10, 4, 4)
+        assert m.call_count == 3
+        schedule.invalidate(2, '0x00')
+        schedule.update(beacon, 10, 4, 4)
+        assert m.call_count == 3
+
+        # Duties of a finalized epoch are fetched again.
+        schedule.update(beacon, 10, 4, 8)
+        assert m.call_count == 4
+        assert schedule.get_finalized_proposer(9) == 3
+        assert schedule.get_head_proposer(9) == 3
+
+        # A reorg changed the dependent root of the next epoch.
+        beacon.invalidate_proposer_duties(3, '0x01')
+        schedule.invalidate(3, '0x01')
+        assert schedule.get_head_proposer(13) is None
+        schedule.update(beacon, 10, 8, 8)
+        assert m.call_count == 5
@@ -1,7 +1,10 @@
 import os
 
 from pathlib import Path
-from eth_validator_watcher.config import load_config, WatchedKeyConfig
+from pydantic import ValidationError
+from pytest import raises
+
+from eth_validator_watcher.config import Config, load_config, WatchedKeyConfig
 from tests import assets
 
 
@@ -63,3 +66,19 @@ def test_filled_config_overriden() -> None:
 
     os.environ.clear()
     os.environ.update(environ)
+
+
+def test_invalid_watched_keys(tmp_path: Path) -> None:
+    path = tmp_path / 'config.json'
+    path.write_text('{"network": "holesky", "watched_keys": [{"public_key": "0x01"}, {"labels": ["vc:1"]}]}')
+
+    with raises(ValidationError):
+        load_config(str(path))
+
+
+def test_snapshot_interval() -> None:
+    assert Config(snapshot_interval_epochs=2).snapshot_interval_epochs == 2
+
+    # Snapshots written less often would be too old to resume from.
+    with raises(ValidationError):
+        Config(snapshot_interval_epochs=3)
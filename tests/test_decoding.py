@@ -0,0 +1,104 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pytest import raises
+
+from eth_validator_watcher.beacon import Beacon
+from eth_validator_watcher.columns import prepare_epoch, rewards_columns
+from eth_validator_watcher.decoding import Decoder
+from eth_validator_watcher.metrics import compute_validator_metrics, WorkerPool
+from eth_validator_watcher.models import Rewards
+from eth_validator_watcher.rewards import process_rewards
+from eth_validator_watcher.utils import LABEL_SCOPE_ALL_NETWORK
+from eth_validator_watcher.watched_validators import EpochValidators, WatchedValidators
+from tests.helpers import pubkey, records
+
+
+def test_columns_round_trip() -> None:
+    columns = prepare_epoch(records(3))
+    buf = bytearray(columns.nbytes())
+    columns.dump(buf)
+
+    loaded = EpochValidators.load(buf)
+    assert len(loaded) == 3
+
+    validators = WatchedValidators()
+    validators.process_epoch(loaded)
+    assert validators.get_validator_by_pubkey(pubkey(2)).index == 2
+
+    with raises(ValueError):
+        EpochValidators.load(buf[:-1])
+
+
+def test_process_rewards() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(3))
+
+    rewards = Rewards(data=Rewards.Data(
+        ideal_rewards=[Rewards.Data.IdealReward(effective_balance=32000000000, source=3, target=2, head=1)],
+        total_rewards=[
+            Rewards.Data.TotalReward(validator_index=0, source=3, target=2, head=1),
+            Rewards.Data.TotalReward(validator_index=1, source=3, target=-2, head=0),
+            # Unknown validators are ignored.
+            Rewards.Data.TotalReward(validator_index=7, source=3, target=2, head=1),
+        ],
+    ))
+    assert len(rewards_columns(rewards)) == 3
+    process_rewards(validators, rewards)
+
+    metrics = compute_validator_metrics(validators, 0, WorkerPool(1))[LABEL_SCOPE_ALL_NETWORK]
+    assert metrics.ideal_consensus_reward == 12
+    assert metrics.actual_consensus_reward == 7
+    assert metrics.suboptimal_target_count == 1
+    assert metrics.suboptimal_head_count == 1
+    assert metrics.suboptimal_source_count == 0
+
+
+class _BeaconHandler(BaseHTTPRequestHandler):
+    """Stand-in for a beacon serving the large responses."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        assert self.path == '/eth/v1/beacon/states/64/validators'
+        self._send({'data': [
+            {'index': str(r.index), 'status': r.status, 'validator': {
+                'pubkey': r.pubkey, 'effective_balance': str(r.effective_balance), 'slashed': r.slashed,
+            }}
+            for r in records(4)
+        ]})
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        assert self.path == '/eth/v1/validator/liveness/1'
+        self._send({'data': [{'index': i, 'is_live': i != '2'} for i in body]})
+
+
+def test_decoder_workers() -> None:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BeaconHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    beacon = Beacon(f'http://127.0.0.1:{server.server_port}', 10)
+    decoder = Decoder(1)
+    try:
+        validators = WatchedValidators()
+        validators.process_epoch(decoder.validators(beacon, 64))
+        assert validators.get_indexes() == [0, 1, 2, 3]
+
+        validators.process_liveness(decoder.liveness(beacon, 1, validators.get_indexes()))
+        metrics = compute_validator_metrics(validators, 0, WorkerPool(1))[LABEL_SCOPE_ALL_NETWORK]
+        assert metrics.missed_attestations == 1
+    finally:
+        decoder.close()
+        server.shutdown()
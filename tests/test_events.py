@@ -0,0 +1,124 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from urllib.parse import parse_qs
+
+from eth_validator_watcher.events import BeaconEvents, iter_events
+
+
+def test_iter_events() -> None:
+    stream = (
+        b': keep-alive\r\n\r\n'
+        b'event: head\r\ndata: {"slot": "10", "block": "0x01"}\r\n\r\n'
+        b'event: chain_reorg\n'
+        b'data: {"slot": "11",\n'
+        b'data: "depth": "2"}\n\n'
+    )
+    # Split at every position to make sure chunk boundaries don't matter.
+    for i in range(len(stream)):
+        events = list(iter_events([stream[:i], stream[i:]]))
+        assert events == [('head', {'slot': '10', 'block': '0x01'}), ('chain_reorg', {'slot': '11', 'depth': '2'})]
+
+
+class _EventsHandler(BaseHTTPRequestHandler):
+    """Stand-in for a beacon emitting a few events and hanging up."""
+    protocol_version = 'HTTP/1.1'
+    release = threading.Event()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition('?')
+        assert path == '/eth/v1/events'
+        assert parse_qs(query) == {'topics': ['head,block,finalized_checkpoint,chain_reorg']}
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._chunk(b'event: block\ndata: {"slot": "5", "block": "0x05"}\n\n')
+        self._chunk(b'event: head\ndata: {"slot": "6", "block": "0x06", '
+                    b'"previous_duty_dependent_root": "0xaa", "current_duty_dependent_root": "0xbb"}\n\n')
+        self.release.wait(5)
+        self._chunk(b'event: chain_reorg\ndata: {"slot": "6", "depth": "1"}\n\n')
+        self.release.wait(5)
+        self._chunk(b'')
+        self.close_connection = True
+
+
+def test_beacon_events() -> None:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _EventsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    events = BeaconEvents(f'http://127.0.0.1:{server.server_port}', 5)
+    events.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not events.connected() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert events.wait_for_block(6, 5)
+        assert events.has_block(5)
+        assert not events.wait_for_block(7, 0.1)
+        assert events.pop_dependent_roots() == [(6, '0xaa', '0xbb')]
+        assert events.finalized_changed()
+        assert not events.finalized_changed()
+
+        # Slot 6 was reorged out.
+        _EventsHandler.release.set()
+        assert not events.wait_for_block(7, 5)
+        assert not events.has_block(6)
+        assert events.pop_reorgs() == [(6, 1)]
+        assert events.pop_reorgs() == []
+
+        # The stand-in hung up, we don't trust what we knew anymore.
+        assert not events.connected()
+        assert not events.has_block(5)
+        assert events.finalized_changed()
+    finally:
+        events.stop()
+        server.shutdown()
+
+
+class _EndlessEventsHandler(_EventsHandler):
+    """Stand-in for a beacon emitting head events until disconnected."""
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for slot in range(1000):
+                self._chunk(b'event: head\ndata: {"slot": "%d", "block": "0x00"}\n\n' % slot)
+                time.sleep(0.05)
+        except OSError:
+            pass
+        self.close_connection = True
+
+
+def test_beacon_events_stop() -> None:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _EndlessEventsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    events = BeaconEvents(f'http://127.0.0.1:{server.server_port}', 5)
+    events.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not events.has_block(2) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        events.stop()
+        assert not events._thread.is_alive()
+
+        # Nothing is ingested anymore.
+        slots = set(events._blocks)
+        time.sleep(0.2)
+        assert events._blocks == slots
+    finally:
+        server.shutdown()
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import pytest
+
+from eth_validator_watcher.config import Config, WatchedKeyConfig
+from eth_validator_watcher.keys_index import WatchedKeysIndex, compile_watched_keys
+from eth_validator_watcher.metrics import WorkerPool, verify_validator_metrics
+from eth_validator_watcher.utils import LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK, LABEL_SCOPE_WATCHED
+from eth_validator_watcher.watched_validators import WatchedValidators
+from tests.helpers import pubkey, records
+
+
+def test_compile_and_load(tmp_path: Path) -> None:
+    path = str(tmp_path / 'keys.idx')
+    count = compile_watched_keys([
+        WatchedKeyConfig(public_key=pubkey(3), labels=['vc:1', 'région:sbg']),
+        WatchedKeyConfig(public_key=pubkey(1)),
+        WatchedKeyConfig(public_key=pubkey(3).upper().replace('0X', '0x'), labels=['vc:2']),
+    ], path)
+    assert count == 2
+
+    with WatchedKeysIndex(path) as index:
+        assert len(index) == 2
+        assert index.public_keys() == [pubkey(1), pubkey(3)]
+        assert index.labels == ['vc:2']
+        assert index.offsets.cast('Q').tolist() == [0, 0, 1]
+        assert index.label_ids.cast('I').tolist() == [0]
+
+    with pytest.raises(ValueError):
+        compile_watched_keys([WatchedKeyConfig(public_key='0x1234')], path)
+
+    (tmp_path / 'garbage.idx').write_bytes(b'EVWKIDX1' + b'\0' * 80)
+    with pytest.raises(ValueError):
+        WatchedKeysIndex(str(tmp_path / 'garbage.idx'))
+
+    # A label rewritten in place doesn't match the digest anymore.
+    compile_watched_keys([WatchedKeyConfig(public_key=pubkey(1), labels=['vc:1'])], path)
+    data = bytearray(Path(path).read_bytes())
+    data[-1] ^= 1
+    (tmp_path / 'corrupted.idx').write_bytes(data)
+    with pytest.raises(ValueError):
+        WatchedKeysIndex(str(tmp_path / 'corrupted.idx'))
+
+
+def test_process_config_from_index(tmp_path: Path) -> None:
+    path = str(tmp_path / 'keys.idx')
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    validators.process_config(Config(watched_keys=[WatchedKeyConfig(public_key=pubkey(3), labels=['vc:3'])]))
+    assert validators.get_watched_indexes() == [3]
+
+    # The index takes over the configuration file.
+    compile_watched_keys([
+        WatchedKeyConfig(public_key=pubkey(0), labels=['vc:0']),
+        WatchedKeyConfig(public_key=pubkey(1), labels=['vc:0', 'region:rbx']),
+        WatchedKeyConfig(public_key=pubkey(5), labels=['vc:5']),
+    ], path)
+    config = Config(watched_keys=[WatchedKeyConfig(public_key=pubkey(3), labels=['vc:3'])], watched_keys_index=path)
+    validators.process_config(config)
+
+    assert validators.get_watched_indexes() == [0, 1]
+
+    # The opened index is reused for the keys to fetch.
+    keys = validators.get_watched_public_keys(config)
+    assert keys == [pubkey(0), pubkey(1), pubkey(5)]
+    assert validators.get_watched_public_keys(config) is keys
+    assert validators.get_validator_by_index(1).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, 'vc:0', 'region:rbx']
+    assert validators.get_validator_by_index(3).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK]
+
+    # Validator 5 shows up later on.
+    validators.process_epoch(records(6))
+    validators.process_config(config)
+    assert validators.get_watched_indexes() == [0, 1, 5]
+
+    # Keys removed from the index are back to the network scope.
+    compile_watched_keys([WatchedKeyConfig(public_key=pubkey(5), labels=['vc:0'])], path)
+    validators.process_config(config)
+    assert validators.get_watched_indexes() == [5]
+    assert validators.get_validator_by_index(5).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, 'vc:0']
+    assert verify_validator_metrics(validators.get_registry(), WorkerPool(2))
+
+    # And back to the configuration file.
+    validators.process_config(Config(watched_keys=[WatchedKeyConfig(public_key=pubkey(3), labels=['vc:3'])]))
+    assert validators.get_watched_indexes() == [3]
+    assert verify_validator_metrics(validators.get_registry(), WorkerPool(2))
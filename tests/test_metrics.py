@@ -0,0 +1,29 @@
+from prometheus_client import CollectorRegistry
+
+from eth_validator_watcher.metrics import ValidatorMetricsCollector, compute_validator_metrics, WorkerPool
+from eth_validator_watcher.utils import LABEL_SCOPE_WATCHED
+from eth_validator_watcher.watched_validators import WatchedValidators
+from tests.helpers import records
+
+
+def test_validator_metrics_collector() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    collector = ValidatorMetricsCollector()
+    registry = CollectorRegistry()
+    registry.register(collector)
+
+    for slot in (10, 11):
+        validators.get_validator_by_index(1).process_block(slot, False)
+        collector.update('mainnet', compute_validator_metrics(validators, slot, WorkerPool(1)))
+
+    labels = {'scope': LABEL_SCOPE_WATCHED, 'network': 'mainnet'}
+    assert registry.get_sample_value('eth_missed_block_proposals_head_total', labels) is None
+
+    labels = {'scope': 'scope:all-network', 'network': 'mainnet'}
+    assert registry.get_sample_value('eth_missed_block_proposals_head_total', labels) == 2
+    assert registry.get_sample_value('eth_block_proposals_head_total', labels) == 0
+    assert registry.get_sample_value('eth_validator_status_count', {**labels, 'status': 'active_ongoing'}) == 4
+    assert registry.get_sample_value('eth_validator_status_count', {**labels, 'status': 'exited_slashed'}) == 0
+    assert registry.get_sample_value('eth_suboptimal_heads_rate', labels) == 0
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+from eth_validator_watcher import notifications
+from eth_validator_watcher.notifications import SlackDispatcher
+
+
+class _SlackHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Slack API, rate limiting the first post."""
+    protocol_version = 'HTTP/1.1'
+    posts = []
+    release = threading.Event()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, code: int, body: dict, headers: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        assert self.path == '/api/chat.postMessage'
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.posts.append(body)
+        if len(self.posts) == 1:
+            return self._send(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': '0'})
+        self.release.wait(5)
+        self._send(200, {'ok': True}, {})
+
+
+def _dispatcher(server: ThreadingHTTPServer) -> tuple[SlackDispatcher, CollectorRegistry]:
+    registry = CollectorRegistry()
+    depth = Gauge('depth', 'depth', registry=registry)
+    dropped = Counter('dropped', 'dropped', registry=registry)
+    slack = SlackDispatcher('xoxb-test', '#alerts', depth, dropped, base_url=f'http://127.0.0.1:{server.server_port}/api/')
+    return slack, registry
+
+
+def test_slack_dispatcher(monkeypatch) -> None:
+    monkeypatch.setattr(notifications, 'SLACK_QUEUE_SIZE', 1)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    slack, registry = _dispatcher(server)
+
+    try:
+        # Messages of a slot are coalesced.
+        slack.send('first')
+        slack.send('second')
+        slack.flush()
+
+        # The post was rate limited, then retried and is now stuck.
+        deadline = time.monotonic() + 5
+        while len(_SlackHandler.posts) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [post['text'] for post in _SlackHandler.posts] == ['first\nsecond'] * 2
+        assert _SlackHandler.posts[0]['channel'] == '#alerts'
+
+        # One more slot fits in the queue, the next is dropped.
+        slack.send('third')
+        slack.flush()
+        slack.send('fourth')
+        slack.send('fifth')
+        slack.flush()
+        assert registry.get_sample_value('depth') == 1
+        assert registry.get_sample_value('dropped_total') == 2
+
+        _SlackHandler.release.set()
+        slack.join(5)
+        assert [post['text'] for post in _SlackHandler.posts][2:] == ['third']
+        assert registry.get_sample_value('depth') == 0
+    finally:
+        slack.close()
+        server.shutdown()
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+from eth_validator_watcher.config import Config, WatchedKeyConfig
+from eth_validator_watcher.metrics import compute_validator_metrics, verify_validator_metrics, WorkerPool
+from eth_validator_watcher.models import Spec, ValidatorsLivenessResponse
+from eth_validator_watcher.proposer_schedule import ProposerSchedule
+from eth_validator_watcher.snapshot import Snapshot, load_snapshot, read_snapshot, write_snapshot
+from eth_validator_watcher.utils import LABEL_SCOPE_WATCHED
+from eth_validator_watcher.watched_validators import WatchedValidators
+from tests.helpers import duties, records
+
+
+def _liveness(missed: list[int]) -> ValidatorsLivenessResponse:
+    return ValidatorsLivenessResponse(data=[
+        ValidatorsLivenessResponse.Data(index=i, is_live=i not in missed) for i in range(6)
+    ])
+
+
+def _snapshot(validators: WatchedValidators, schedule: ProposerSchedule, slot: int = 100) -> Snapshot:
+    return Snapshot(
+        network='mainnet',
+        genesis_time=1606824023,
+        slot=slot,
+        last_processed_finalized_slot=63,
+        liveness_epoch=slot // 32 - 1,
+        rewards_epoch=None,
+        network_validators_epoch=None,
+        head_blocks={64: True, 65: False},
+        schedule=schedule.dump(),
+        registry=validators.get_state(),
+    )
+
+
+def test_snapshot_round_trip(tmp_path: Path) -> None:
+    path = str(tmp_path / 'snapshot.bin')
+    config = Config(watched_keys=[WatchedKeyConfig(public_key=records(6)[i].pubkey, labels=['vc:0']) for i in (1, 2)])
+
+    validators = WatchedValidators()
+    validators.process_epoch(records(6))
+    validators.process_config(config)
+    validators.process_liveness(_liveness([1, 4]))
+    validators.process_liveness(_liveness([1, 2]))
+
+    spec = Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=32))
+    schedule = ProposerSchedule(spec)
+    schedule.set_duties(2, duties({64: 1, 65: 2}), final=True)
+    schedule.set_duties(3, duties({96: 3}), final=False)
+
+    write_snapshot(_snapshot(validators, schedule), path)
+    snapshot = read_snapshot(path)
+    assert snapshot.head_blocks == {64: True, 65: False}
+    assert snapshot.last_processed_finalized_slot == 63
+    assert snapshot.rewards_epoch is None
+
+    # Only final duties are kept, the others are fetched again.
+    restored_schedule = ProposerSchedule(spec)
+    restored_schedule.load(snapshot.schedule)
+    assert restored_schedule.get_finalized_proposer(65) == 2
+    assert restored_schedule.get_head_proposer(96) is None
+
+    # Liveness history survives, labels come from the configuration.
+    restored = WatchedValidators()
+    restored.restore(snapshot.registry)
+    restored.process_config(config)
+    assert restored.get_watched_indexes() == [1, 2]
+
+    pool = WorkerPool(2)
+    assert verify_validator_metrics(restored.get_registry(), pool)
+    metrics = compute_validator_metrics(restored, 0, pool)
+    assert metrics[LABEL_SCOPE_WATCHED].missed_attestations == 2
+    assert metrics[LABEL_SCOPE_WATCHED].missed_consecutive_attestations == 1
+    expected = compute_validator_metrics(validators, 0, pool)
+    assert metrics.keys() == expected.keys()
+    for label, m in metrics.items():
+        assert m.validator_status_count == expected[label].validator_status_count
+        assert m.missed_consecutive_attestations == expected[label].missed_consecutive_attestations
+
+
+def test_load_snapshot(tmp_path: Path) -> None:
+    path = str(tmp_path / 'snapshot.bin')
+    assert load_snapshot(path, 'mainnet', 1606824023, 101, 3) is None
+
+    validators = WatchedValidators()
+    validators.process_epoch(records(2))
+    write_snapshot(_snapshot(validators, ProposerSchedule(Spec(data=Spec.Data(SECONDS_PER_SLOT=12, SLOTS_PER_EPOCH=32)))), path)
+
+    assert load_snapshot(path, 'mainnet', 1606824023, 101, 3) is not None
+    # Another chain, or too old to know the liveness of the previous epoch.
+    assert load_snapshot(path, 'holesky', 1606824023, 101, 3) is None
+    assert load_snapshot(path, 'mainnet', 1695902400, 101, 3) is None
+    assert load_snapshot(path, 'mainnet', 1606824023, 100, 3) is None
+    assert load_snapshot(path, 'mainnet', 1606824023, 130, 4) is not None
+    assert load_snapshot(path, 'mainnet', 1606824023, 160, 5) is None
+
+    # Corrupted.
+    data = bytearray(Path(path).read_bytes())
+    data[-1] ^= 1
+    Path(path).write_bytes(data)
+    assert load_snapshot(path, 'mainnet', 1606824023, 101, 3) is None
@@ -0,0 +1,28 @@
+import json
+
+from eth_validator_watcher.streaming import iter_json_array
+
+
+def _chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_iter_json_array() -> None:
+    doc = {
+        "execution_optimistic": False,
+        "meta": {"data": [1, 2], "text": "é ]}"},
+        "data": [{"index": str(i), "value": 10 ** i, "name": f"vé{i}"} for i in range(20)],
+        "finalized": True,
+    }
+    raw = json.dumps(doc, ensure_ascii=False).encode()
+
+    # Small chunks make sure items, numbers and multi-bytes
+    # characters get split across chunk boundaries.
+    for size in (1, 3, 7, len(raw)):
+        assert list(iter_json_array(_chunked(raw, size), "data")) == doc["data"]
+
+
+def test_iter_json_array_empty() -> None:
+    assert list(iter_json_array([b'{"data": []}'], "data")) == []
+    assert list(iter_json_array([b'{}'], "data")) == []
@@ -0,0 +1,28 @@
+from pathlib import Path
+
+from eth_validator_watcher.utils import available_cpus, cgroup_cpu_quota
+
+
+def test_cgroup_cpu_quota_v2(tmp_path: Path) -> None:
+    (tmp_path / 'cpu.max').write_text('max 100000\n')
+    assert cgroup_cpu_quota(tmp_path) is None
+
+    (tmp_path / 'cpu.max').write_text('150000 100000\n')
+    assert cgroup_cpu_quota(tmp_path) == 1.5
+    assert available_cpus(tmp_path) <= 2
+
+
+def test_cgroup_cpu_quota_v1(tmp_path: Path) -> None:
+    (tmp_path / 'cpu').mkdir()
+    (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('-1\n')
+    (tmp_path / 'cpu' / 'cpu.cfs_period_us').write_text('100000\n')
+    assert cgroup_cpu_quota(tmp_path) is None
+
+    (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('50000\n')
+    assert cgroup_cpu_quota(tmp_path) == 0.5
+    assert available_cpus(tmp_path) == 1
+
+
+def test_no_cgroup(tmp_path: Path) -> None:
+    assert cgroup_cpu_quota(tmp_path) is None
+    assert available_cpus(tmp_path) >= 1
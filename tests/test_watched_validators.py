@@ -0,0 +1,114 @@
+from eth_validator_watcher.config import Config, WatchedKeyConfig
+from eth_validator_watcher.metrics import compute_validator_metrics, verify_validator_metrics, WorkerPool
+from eth_validator_watcher.models import Validators, ValidatorsLivenessResponse
+from eth_validator_watcher.utils import LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK, LABEL_SCOPE_WATCHED
+from eth_validator_watcher.watched_validators import WatchedValidators
+from tests.helpers import pubkey, records
+
+
+def test_lookups() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    assert len(validators) == 4
+    assert validators.get_indexes() == [0, 1, 2, 3]
+
+    v = validators.get_validator_by_pubkey(pubkey(2).upper()[2:])
+    assert v is not None and v.index == 2
+    assert v.effective_balance == 32000000000
+    assert v.labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK]
+
+    assert validators.get_validator_by_index(3).index == 3
+    assert validators.get_validator_by_index(4) is None
+    assert validators.get_validator_by_pubkey(pubkey(4)) is None
+    assert validators.get_validator_by_pubkey('0xnot-a-key') is None
+
+
+def test_process_config_and_liveness() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    config = Config(watched_keys=[
+        WatchedKeyConfig(public_key=pubkey(0), labels=['operator:kiln']),
+        WatchedKeyConfig(public_key=pubkey(9)),
+    ])
+    validators.process_config(config)
+
+    assert validators.config_initialized
+    assert validators.get_watched_indexes() == [0]
+    assert validators.get_validator_by_index(0).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, 'operator:kiln']
+    assert validators.get_validator_by_index(1).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK]
+
+    liveness = ValidatorsLivenessResponse(data=[
+        ValidatorsLivenessResponse.Data(index=0, is_live=False),
+        ValidatorsLivenessResponse.Data(index=42, is_live=False),
+    ])
+    # Unknown indexes are ignored.
+    validators.process_liveness(liveness)
+
+    metrics = compute_validator_metrics(validators, 0, WorkerPool(3))
+    assert metrics[LABEL_SCOPE_WATCHED].missed_attestations == 1
+    assert metrics[LABEL_SCOPE_NETWORK].missed_attestations == 0
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].validator_status_count == {'active_ongoing': 4}
+
+
+def test_running_metrics_match_full_recomputation() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(8))
+    validators.process_config(Config(watched_keys=[
+        WatchedKeyConfig(public_key=pubkey(i), labels=[f'vc:{i % 2}']) for i in range(0, 8, 3)
+    ]))
+    validators.process_liveness(ValidatorsLivenessResponse(data=[
+        ValidatorsLivenessResponse.Data(index=i, is_live=i % 2 == 0) for i in range(8)
+    ]))
+
+    validators.get_validator_by_index(5).process_block(10, False)
+    validators.get_validator_by_index(6).process_block(11, True)
+    validators.get_validator_by_index(6).process_future_block(40)
+
+    # Next epoch: validators change status and labels are moved around.
+    items = records(9)
+    items[3] = items[3]._replace(status=Validators.DataItem.StatusEnum.exitedUnslashed, slashed=True)
+    validators.process_epoch(items)
+    validators.process_config(Config(watched_keys=[
+        WatchedKeyConfig(public_key=pubkey(i), labels=['vc:0']) for i in range(0, 9, 2)
+    ]))
+
+    assert validators.get_active_indexes() == [0, 1, 2, 4, 5, 6, 7, 8]
+    assert validators.get_active_indexes(LABEL_SCOPE_WATCHED) == [0, 2, 4, 6, 8]
+
+    pool = WorkerPool(2)
+    assert verify_validator_metrics(validators.get_registry(), pool)
+
+    metrics = compute_validator_metrics(validators, 0, pool)
+    assert metrics['vc:0'].validator_status_count == {'active_ongoing': 5}
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].validator_slashes == 1
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].missed_blocks == 1
+    assert metrics[LABEL_SCOPE_ALL_NETWORK].future_blocks_proposal == 1
+
+    # Blocks were reset once reported.
+    assert verify_validator_metrics(validators.get_registry(), pool)
+    assert compute_validator_metrics(validators, 0, pool)[LABEL_SCOPE_ALL_NETWORK].missed_blocks == 0
+
+
+def test_process_config_changes() -> None:
+    validators = WatchedValidators()
+    validators.process_epoch(records(4))
+
+    validators.process_config(Config(watched_keys=[
+        WatchedKeyConfig(public_key=pubkey(0), labels=['vc:0']),
+        WatchedKeyConfig(public_key=pubkey(1)),
+        WatchedKeyConfig(public_key=pubkey(5), labels=['vc:5']),
+    ]))
+    assert validators.get_watched_indexes() == [0, 1]
+
+    # Validator 5 shows up later on.
+    validators.process_epoch(records(6))
+    validators.process_config(Config(watched_keys=[
+        WatchedKeyConfig(public_key=pubkey(0), labels=['vc:1']),
+        WatchedKeyConfig(public_key=pubkey(5), labels=['vc:5']),
+    ]))
+
+    assert validators.get_validator_by_index(0).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, 'vc:1']
+    assert validators.get_validator_by_index(1).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_NETWORK]
+    assert validators.get_validator_by_index(5).labels == [LABEL_SCOPE_ALL_NETWORK, LABEL_SCOPE_WATCHED, 'vc:5']